@@ -0,0 +1,169 @@
+"""Admission control: per-route-class concurrency limits with bounded wait queues, and token buckets.
+
+Every request belongs to a route class. A class admits up to `limit` requests at once; beyond
+that, up to `queue` requests wait for a slot for at most ADMISSION_QUEUE_TIMEOUT seconds, and the
+rest are turned away immediately. Rejected requests fail fast with 503 and Retry-After instead of
+piling up on MongoDB or the hashing pool until they time out.
+
+A waiting request holds a server thread, so the limits and queues of the expensive classes
+should add up to less than the threads of a worker (GUNICORN_THREADS) to leave threads free for
+cheap reads. Limits are per worker process.
+"""
+import os
+import threading
+import time
+
+from cache import TTLCache
+
+QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 0.5))
+
+RETRY_AFTER = 1
+
+
+def _class_limits(name, limit, queue):
+    prefix = f'ADMISSION_{name.upper()}'
+    return int(os.getenv(f'{prefix}_CONCURRENCY', limit)), int(os.getenv(f'{prefix}_QUEUE', queue))
+
+
+# route class -> (concurrent requests, waiting requests); a limit of 0 admits everything
+ROUTE_CLASSES = {
+    'auth': _class_limits('auth', 2, 2),
+    'import': _class_limits('import', 1, 0),
+    'export': _class_limits('export', 1, 1),
+    'simulation': _class_limits('simulation', 1, 1),
+    'dashboard': _class_limits('dashboard', 2, 2),
+    'read': _class_limits('read', 0, 0),
+    'write': _class_limits('write', 0, 0)
+}
+
+# Paths that hash passwords
+AUTH_PATHS = ('/api/login', '/api/register', '/api/settings/password')
+
+# Paths that run CPU-bound Monte Carlo simulations
+SIMULATION_PATHS = ('/api/dashboard/goals/simulation',)
+
+# Dashboard reads that fan out several queries or aggregate the user's history
+DASHBOARD_PATHS = (
+    '/api/dashboard/summary',
+    '/api/dashboard/analytics',
+    '/api/dashboard/networth',
+    '/api/dashboard/forecast'
+)
+
+
+def route_class(method, path):
+    if path in AUTH_PATHS:
+        return 'auth'
+    if path.startswith('/api/import/'):
+        return 'import'
+    if path.startswith('/api/export/'):
+        return 'export'
+    if path in SIMULATION_PATHS:
+        return 'simulation'
+    if path in DASHBOARD_PATHS:
+        return 'dashboard'
+    return 'read' if method in ('GET', 'HEAD', 'OPTIONS') else 'write'
+
+
+class Overloaded(Exception):
+    def __init__(self, route_class, retry_after=RETRY_AFTER):
+        super().__init__(f'{route_class} requests are over capacity')
+        self.route_class = route_class
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    def __init__(self, name, limit, queue, timeout=QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._condition = threading.Condition()
+
+    # Take a slot, waiting in the queue if need be; raises Overloaded when none frees up in time
+    def acquire(self):
+        with self._condition:
+            if self.active >= self.limit:
+                if self.waiting >= self.queue:
+                    self.rejected += 1
+                    raise Overloaded(self.name)
+
+                self.waiting += 1
+                try:
+                    deadline = time.monotonic() + self.timeout
+                    while self.active >= self.limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected += 1
+                            raise Overloaded(self.name)
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+
+            self.active += 1
+            self.admitted += 1
+        return self
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'limit': self.limit,
+                'queue': self.queue,
+                'active': self.active,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected
+            }
+
+
+class AdmissionControl:
+    def __init__(self, route_classes=None, timeout=QUEUE_TIMEOUT):
+        self.limiters = {
+            name: ConcurrencyLimiter(name, limit, queue, timeout)
+            for name, (limit, queue) in (route_classes or ROUTE_CLASSES).items()
+            if limit > 0
+        }
+
+    # Returns the limiter to release when the request ends, or None for unlimited classes
+    def admit(self, method, path):
+        limiter = self.limiters.get(route_class(method, path))
+        return limiter.acquire() if limiter is not None else None
+
+    def stats(self):
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
+
+
+# Token buckets keyed by client or account: each key holds up to `capacity` tokens and regains
+# `rate` tokens per second. A bucket that has refilled completely is forgotten.
+class TokenBucket:
+    def __init__(self, capacity, rate, maxsize=100000):
+        self.capacity = capacity
+        self.rate = rate
+        self._buckets = TTLCache(maxsize=maxsize, ttl=capacity / rate)
+        self._lock = threading.Lock()
+
+    # Take a token from every given bucket. Returns 0 when all had one, otherwise the seconds
+    # until they all will; in that case no token is taken.
+    def take(self, *keys):
+        now = time.monotonic()
+        with self._lock:
+            levels = {}
+            for key in keys:
+                tokens, updated = self._buckets.get(key) or (self.capacity, now)
+                levels[key] = min(self.capacity, tokens + (now - updated) * self.rate)
+
+            wait = max((1 - tokens) / self.rate for tokens in levels.values()) if levels else 0
+            if wait > 0:
+                return wait
+            for key, tokens in levels.items():
+                self._buckets.set(key, (tokens - 1, now))
+            return 0
@@ -1,14 +1,42 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, make_response, stream_with_context
 from flask_cors import CORS
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 import pymongo
-from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 import datetime
+import hashlib
+import hmac
+import json
+import math
 import os
+import time
 from dotenv import load_dotenv
 from bson.objectid import ObjectId
 from functools import wraps
+from werkzeug.middleware.proxy_fix import ProxyFix
+import admission
+from cache import AuthCache, LocalCacheBackend, RedisCacheBackend, ResponseCache, TTLCache
+from concurrency import fan_out
+from dashboard import fetch_summary
+from indexes import ensure_indexes_in_background, ensure_unique_indexes
+from pagination import TRANSACTION_SORT, InvalidCursor, encode_cursor, seek_filter
+import categorize
+import exports
+import forecast
+import goal_simulation
+import metrics
+import passwords
+import profiling
+import provisioning
+import rollups
+import schemas
+import search
+import snapshots
+import spending
+import statements
+import user_settings
+from versions import bump_version, current_version
 
 # Load environment variables
 load_dotenv()
@@ -16,30 +44,164 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
+# Number of reverse proxies in front of the app that append to X-Forwarded-For. Behind them,
+# request.remote_addr is the client's address only once ProxyFix has read it from that header;
+# without it, every client shares the proxy's address (and its login rate limit).
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+
+# Serializes ObjectId and datetime natively, with orjson when it is installed
+app.json = schemas.json_provider_class()(app)
+
 # Secret key for JWT
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key')
 
+# Largest accepted upload (statement imports), in bytes
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_BYTES', 50 * 1024 * 1024))
+
 # MongoDB connection
 # Note: In production, use environment variables for the connection string
-MONGO_URI = 'mongodb://localhost:27017/finfine'
-try:
-    # client = pymongo.MongoClient("mongodb://127.0.0.1:27017");
-    client = pymongo.MongoClient("mongodb://localhost:27017")
-
-
-    db = client.finfine  # Database name
-    users_collection = db.users  # Collection name
-    accounts_collection = db.accounts
-    transactions_collection = db.transactions
-    budgets_collection = db.budgets
-    goals_collection = db.goals
-    settings_collection = db.settings  # New collection for user settings
-    print("Connected to MongoDB")
-except Exception as e:
-    print(f"Error connecting to MongoDB: {e}")
-
-# Create unique index on email field
-users_collection.create_index("email", unique=True)
+MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/finfine')
+
+# Connection pool and timeouts for each process's client
+MONGO_CLIENT_OPTIONS = {
+    'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', 50)),
+    'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', 0)),
+    'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    'connectTimeoutMS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+    'socketTimeoutMS': int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 30000)),
+    'waitQueueTimeoutMS': int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+    # Attributes every command to the request that issued it (see metrics.py)
+    'event_listeners': [metrics.command_listener]
+}
+
+# Create the MongoClient and collection handles for this process. A MongoClient must not be
+# shared across fork(), so pre-fork servers call this again in every worker (see gunicorn.conf.py).
+def connect_db():
+    global client, db, users_collection, accounts_collection, transactions_collection
+    global budgets_collection, goals_collection, settings_collection
+    
+    try:
+        client = pymongo.MongoClient(MONGO_URI, **MONGO_CLIENT_OPTIONS)
+        
+        db = client.get_default_database('finfine')  # Database name
+        users_collection = db.users  # Collection name
+        accounts_collection = db.accounts
+        transactions_collection = db.transactions
+        budgets_collection = db.budgets
+        goals_collection = db.goals
+        settings_collection = db.settings  # New collection for user settings
+        print("Connected to MongoDB")
+    except Exception as e:
+        # A worker without a database cannot serve anything, so it fails to start instead
+        print(f"Error connecting to MongoDB: {e}")
+        raise
+
+def close_db():
+    client.close()
+
+connect_db()
+
+# Unique indexes are required before serving: registration relies on the email index to reject
+# duplicates, so a worker that cannot create them fails to start. Existing duplicate documents
+# only log an error pointing to 'python indexes.py --dedupe', so that every worker does not fail
+# on data it cannot repair. The other indexes every route relies on (see indexes.py) are built
+# without blocking startup.
+ensure_unique_indexes(db)
+ensure_indexes_in_background(db)
+
+# In-process cache of verified token -> user document
+auth_cache = AuthCache(
+    maxsize=int(os.getenv('AUTH_CACHE_SIZE', 10000)),
+    ttl=int(os.getenv('AUTH_CACHE_TTL', 60))
+)
+
+# Short-lived cache of per-user transaction counts used by pagination
+count_cache = TTLCache(
+    maxsize=int(os.getenv('COUNT_CACHE_SIZE', 10000)),
+    ttl=int(os.getenv('COUNT_CACHE_TTL', 30))
+)
+
+# Cache of serialized dashboard responses; set REDIS_URL to share it between worker processes
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 60))
+if os.getenv('REDIS_URL'):
+    response_cache_backend = RedisCacheBackend(os.getenv('REDIS_URL'), ttl=RESPONSE_CACHE_TTL)
+else:
+    response_cache_backend = LocalCacheBackend(
+        maxsize=int(os.getenv('RESPONSE_CACHE_SIZE', 10000)),
+        ttl=RESPONSE_CACHE_TTL
+    )
+
+# Settings documents, stamped with the data version they were read at
+settings_cache = TTLCache(
+    maxsize=int(os.getenv('SETTINGS_CACHE_SIZE', 10000)),
+    ttl=int(os.getenv('SETTINGS_CACHE_TTL', 300))
+)
+
+# A worker may serve another worker's stale version for at most this long with the local backend
+response_cache = ResponseCache(
+    response_cache_backend,
+    version_ttl=int(os.getenv('RESPONSE_CACHE_VERSION_TTL', 5 if not os.getenv('REDIS_URL') else RESPONSE_CACHE_TTL))
+)
+
+# Upper bound on the page size of paginated endpoints
+MAX_PAGE_SIZE = 100
+
+# How often an import checks for a rollup rebuild that started after it; well within
+# rollups.REBUILD_DRAIN_SECONDS, so the rebuild never reads while the import still writes
+REBUILD_CHECK_SECONDS = 1
+# Seconds a write refused during a rollup rebuild is told to wait before retrying
+REBUILD_RETRY_AFTER = 10
+
+# Registered before admission control, so shed requests are timed and counted too
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.metrics_token = metrics.registry.start_request()
+
+@app.after_request
+def record_request_metrics(response):
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        metrics.registry.end_request(
+            token,
+            request.url_rule.rule if request.url_rule else 'unmatched',
+            request.method,
+            response.status_code,
+            time.perf_counter() - g.request_started
+        )
+    return response
+
+# Concurrency limits per route class (see admission.py)
+admission_control = admission.AdmissionControl()
+
+# Login attempts allowed per client address and per account: a burst, then a steady rate
+login_limiter = admission.TokenBucket(
+    capacity=int(os.getenv('LOGIN_BURST', 10)),
+    rate=int(os.getenv('LOGIN_RATE_PER_MINUTE', 10)) / 60
+)
+
+# Routes served through cached_response are admitted there, only on a cache miss, so 304s
+# and cached bodies are never shed
+@app.before_request
+def admit_request():
+    if getattr(app.view_functions.get(request.endpoint), 'admit_on_miss', False):
+        return
+    g.admission_slot = admission_control.admit(request.method, request.path)
+
+# Runs after streamed responses finish, so exports hold their slot until the last byte
+@app.teardown_request
+def release_request(exc):
+    slot = g.pop('admission_slot', None)
+    if slot is not None:
+        slot.release()
+
+@app.errorhandler(admission.Overloaded)
+def overloaded(e):
+    response = jsonify({'message': 'Server is busy, please try again shortly'})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
 
 # Token required decorator
 def token_required(f):
@@ -53,22 +215,136 @@ def token_required(f):
         try:
             token = auth_header.split(' ')[1]
             payload = jwt.decode(token, app.config.get('SECRET_KEY'), algorithms=['HS256'])
-            user_id = payload['sub']
             
-            current_user = users_collection.find_one({'_id': ObjectId(user_id)})
+            # The signature is always verified; only the user lookup is cached
+            current_user = auth_cache.get(token)
             
-            if not current_user:
-                return jsonify({'message': 'User not found'}), 404
+            if current_user is None:
+                current_user = users_collection.find_one({'_id': ObjectId(payload['sub'])}, schemas.USER.projection)
+                
+                if not current_user:
+                    return jsonify({'message': 'User not found'}), 404
+                
+                auth_cache.set(token, current_user, token_exp=payload.get('exp'))
         
         except jwt.ExpiredSignatureError:
             return jsonify({'message': 'Token has expired'}), 401
         except (jwt.InvalidTokenError, Exception) as e:
             return jsonify({'message': f'Invalid token: {str(e)}'}), 401
-            
+        
+        # Opt-in profiling of this request (see profiling.py); a single flag check when disabled
+        if profiling.ENABLED and profiling.requested(request):
+            return profiling.profile(request, current_user['_id'], f, current_user, *args, **kwargs)
+        
         return f(current_user, *args, **kwargs)
     
     return decorated
 
+# Conditional GET: answers If-None-Match with a 304 before the handler queries anything.
+# The ETag is derived from the user's data version, so it changes on every write.
+def conditional_get(f):
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        user_id = current_user['_id']
+        version = g.data_version = user_version(user_id)
+        
+        # Today's date is part of the tag because month-to-date figures roll over without a write
+        key = f"{user_id}:{version}:{datetime.datetime.utcnow().date()}:{request.path}:{sorted(request.args.items(multi=True))}"
+        etag = hashlib.sha1(key.encode()).hexdigest()
+        
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(f(current_user, *args, **kwargs))
+            if response.status_code != 200:
+                return response
+        
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    
+    return decorated
+
+# Serve a handler's 200 responses from the response cache. Must sit under conditional_get,
+# which looks up the data version the cache key is built from.
+def cached_response(f):
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        key = ResponseCache.key(current_user['_id'], g.data_version, request.path, sorted(request.args.items(multi=True)))
+        
+        body = response_cache.get(key)
+        if body is not None:
+            return Response(body, mimetype='application/json')
+        
+        g.admission_slot = admission_control.admit(request.method, request.path)
+        response = make_response(f(current_user, *args, **kwargs))
+        if response.status_code == 200:
+            response_cache.set(key, response.get_data())
+        return response
+    
+    # Copied onto the outer decorators by wraps, where admit_request looks for it
+    decorated.admit_on_miss = True
+    return decorated
+
+# The user's data version, read through the response cache
+def user_version(user_id):
+    version = response_cache.get_version(user_id)
+    if version is None:
+        version = current_version(db, user_id)
+        response_cache.set_version(user_id, version)
+    return version
+
+# Record that a user's dashboard data changed, invalidating their ETags and cached responses
+def data_changed(user_id):
+    version = bump_version(db, user_id)
+    response_cache.set_version(user_id, version)
+    return version
+
+# Write a new user's default documents; runs on the provisioning queue
+def provision_user(user_id):
+    provisioning.ensure_default_account(accounts_collection, user_id)
+    settings = provisioning.ensure_default_settings(settings_collection, user_id)
+    settings_written(user_id, settings)
+
+provisioning_queue = provisioning.ProvisioningQueue(provision_user)
+
+# Store a user's freshly written settings so the next read does not go back to MongoDB
+def settings_written(user_id, settings):
+    settings_cache.set(str(user_id), (data_changed(user_id), settings))
+
+# Transaction writes wait for a rollup rebuild of the user (rollups.py --rebuild) to finish
+@app.errorhandler(rollups.RebuildInProgress)
+def rebuild_in_progress(e):
+    response = jsonify({'message': 'Totals are being recalculated, please try again shortly'})
+    response.headers['Retry-After'] = str(REBUILD_RETRY_AFTER)
+    return response, 503
+
+# Password hashing is shed rather than queued without bound when the pool is saturated
+@app.errorhandler(passwords.HashingUnavailable)
+def hashing_unavailable(e):
+    response = jsonify({'message': 'Server is busy, please try again shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+# Prometheus metrics of this worker process; set METRICS_TOKEN to require it as a bearer token
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    token = os.getenv('METRICS_TOKEN')
+    # Constant-time comparison, so response timing does not reveal the token
+    if token and not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        return jsonify({'message': 'Token is invalid'}), 401
+    
+    gauges = metrics.stats_gauges('cache', 'cache', {
+        'auth': auth_cache.stats(),
+        'response': response_cache.stats(),
+        'count': count_cache.stats(),
+        'settings': settings_cache.stats(),
+        'goal_simulation': goal_simulation.cache_stats()
+    })
+    gauges.update(metrics.stats_gauges('admission', 'route_class', admission_control.stats()))
+    
+    return Response(metrics.registry.render(gauges), content_type=metrics.CONTENT_TYPE)
+
 # Helper function to generate JWT token
 def generate_token(user_id):
     payload = {
@@ -91,12 +367,12 @@ def register():
     if not data or not data.get('email') or not data.get('password') or not data.get('name'):
         return jsonify({'message': 'Missing required fields'}), 400
         
-    # Check if user already exists
-    if users_collection.find_one({'email': data['email']}):
+    # Check if user already exists before paying for a password hash
+    if users_collection.find_one({'email': data['email']}, {'_id': 1}):
         return jsonify({'message': 'User already exists'}), 409
     
     # Create new user
-    hashed_password = generate_password_hash(data['password'])
+    hashed_password = passwords.hash_password(data['password'])
     
     new_user = {
         'name': data['name'],
@@ -108,70 +384,26 @@ def register():
     }
     
     try:
+        # The unique email index settles concurrent sign-ups with the same email
         result = users_collection.insert_one(new_user)
-        user_id = result.inserted_id
-        
-        # Create default account for the user
-        default_account = {
-            'user_id': user_id,
-            'name': 'Cash Account',
-            'type': 'Cash',
-            'balance': 1000.00,
-            'currency': 'USD',
-            'created_at': datetime.datetime.utcnow()
-        }
-        accounts_collection.insert_one(default_account)
-        
-        # Create default settings for the user
-        default_settings = {
-            'user_id': user_id,
-            'theme': 'light',
-            'currency': 'USD',
-            'language': 'English',
-            'notifications': {
-                'email': True,
-                'push': True,
-                'budget_alerts': True,
-                'transaction_alerts': True,
-                'goal_reminders': True,
-                'investment_opportunities': False,
-                'monthly_reports': True
-            },
-            'privacy': {
-                'share_analytics': False,
-                'two_factor_auth': False,
-                'third_party_integrations': False,
-                'public_profile': False
-            },
-            'dashboard': {
-                'show_accounts': True,
-                'show_transactions': True,
-                'show_budgets': True,
-                'show_goals': True,
-                'compact_view': False
-            },
-            'created_at': datetime.datetime.utcnow(),
-            'updated_at': datetime.datetime.utcnow()
-        }
-        settings_collection.insert_one(default_settings)
-        
-        # Generate token
-        token = generate_token(str(user_id))
-        
-        # Return user info and token
-        return jsonify({
-            'message': 'User registered successfully',
-            'token': token,
-            'user': {
-                'id': str(user_id),
-                'name': data['name'],
-                'email': data['email'],
-                'avatar': new_user['avatar'],
-                'role': new_user['role']
-            }
-        }), 201
+    except DuplicateKeyError:
+        return jsonify({'message': 'User already exists'}), 409
     except Exception as e:
         return jsonify({'message': f'Error creating user: {str(e)}'}), 500
+    user_id = result.inserted_id
+    
+    # The default account and settings are written in the background
+    provisioning_queue.submit(user_id)
+    
+    # Generate token
+    token = generate_token(str(user_id))
+    
+    # Return user info and token
+    return jsonify({
+        'message': 'User registered successfully',
+        'token': token,
+        'user': schemas.USER.dump(new_user)
+    }), 201
 
 # Login route
 @app.route('/api/login', methods=['POST'])
@@ -182,119 +414,93 @@ def login():
     if not data or not data.get('email') or not data.get('password'):
         return jsonify({'message': 'Missing email or password'}), 400
     
+    # Throttle guessing from one client and against one account before any hashing
+    wait = login_limiter.take(f'ip:{request.remote_addr}', f"email:{str(data['email']).lower()}")
+    if wait:
+        response = jsonify({'message': 'Too many login attempts, please try again later'})
+        response.headers['Retry-After'] = str(math.ceil(wait))
+        return response, 429
+    
     # Find user by email
-    user = users_collection.find_one({'email': data['email']})
+    user = users_collection.find_one({'email': data['email']}, {**schemas.USER.projection, 'password': 1})
     
-    if not user or not check_password_hash(user['password'], data['password']):
+    if not user or not passwords.verify_password(user['password'], data['password']):
         return jsonify({'message': 'Invalid email or password'}), 401
     
+    # Upgrade the stored hash when the configured hashing parameters have changed
+    try:
+        if passwords.needs_rehash(user['password']):
+            users_collection.update_one(
+                {'_id': user['_id'], 'password': user['password']},
+                {'$set': {'password': passwords.hash_password(data['password'])}}
+            )
+            auth_cache.invalidate_user(user['_id'])
+    except passwords.HashingUnavailable:
+        pass  # Not worth failing the login over; it is retried on the next one
+    
     # Generate token
     token = generate_token(str(user['_id']))
     
     return jsonify({
         'message': 'Login successful',
         'token': token,
-        'user': {
-            'id': str(user['_id']),
-            'name': user['name'],
-            'email': user['email'],
-            'avatar': user['avatar'],
-            'role': user['role']
-        }
+        'user': schemas.USER.dump(user)
     }), 200
 
 # Verify token and get user
 @app.route('/api/user', methods=['GET'])
-def get_user():
-    auth_header = request.headers.get('Authorization')
-    
-    if not auth_header:
-        return jsonify({'message': 'Token is missing'}), 401
-    
-    try:
-        token = auth_header.split(' ')[1]
-        payload = jwt.decode(token, app.config.get('SECRET_KEY'), algorithms=['HS256'])
-        user_id = payload['sub']
-        
-        user = users_collection.find_one({'_id': ObjectId(user_id)})
-        
-        if not user:
-            return jsonify({'message': 'User not found'}), 404
-            
-        return jsonify({
-            'user': {
-                'id': str(user['_id']),
-                'name': user['name'],
-                'email': user['email'],
-                'avatar': user['avatar'],
-                'role': user['role']
-            }
-        }), 200
-    except jwt.ExpiredSignatureError:
-        return jsonify({'message': 'Token has expired'}), 401
-    except (jwt.InvalidTokenError, Exception) as e:
-        return jsonify({'message': f'Invalid token: {str(e)}'}), 401
+@token_required
+def get_user(current_user):
+    return jsonify({'user': schemas.USER.dump(current_user)}), 200
 
 # Settings API routes
 @app.route('/api/settings', methods=['GET'])
 @token_required
+@conditional_get
 def get_settings(current_user):
     user_id = current_user['_id']
     
-    # Get user settings
-    settings = settings_collection.find_one({'user_id': user_id})
+    # Get user settings, from the cache while no write has happened since they were read
+    cached = settings_cache.get(str(user_id))
+    if cached and cached[0] == g.data_version:
+        return jsonify(user_settings.format_settings(cached[1])), 200
+    
+    settings = settings_collection.find_one({'user_id': user_id}, schemas.SETTINGS.projection)
     
     if not settings:
-        # Create default settings if none exist
-        default_settings = {
-            'user_id': user_id,
-            'theme': 'light',
-            'currency': 'USD',
-            'language': 'English',
-            'notifications': {
-                'email': True,
-                'push': True,
-                'budget_alerts': True,
-                'transaction_alerts': True,
-                'goal_reminders': True,
-                'investment_opportunities': False,
-                'monthly_reports': True
-            },
-            'privacy': {
-                'share_analytics': False,
-                'two_factor_auth': False,
-                'third_party_integrations': False,
-                'public_profile': False
-            },
-            'dashboard': {
-                'show_accounts': True,
-                'show_transactions': True,
-                'show_budgets': True,
-                'show_goals': True,
-                'compact_view': False
-            },
-            'created_at': datetime.datetime.utcnow(),
-            'updated_at': datetime.datetime.utcnow()
-        }
-        
-        # Insert default settings
-        settings_collection.insert_one(default_settings)
-        settings = default_settings
-    
-    # Format the response
-    settings_response = {
-        'id': str(settings.get('_id', '')),
-        'theme': settings.get('theme', 'light'),
-        'currency': settings.get('currency', 'USD'),
-        'language': settings.get('language', 'English'),
-        'notifications': settings.get('notifications', {}),
-        'privacy': settings.get('privacy', {}),
-        'dashboard': settings.get('dashboard', {}),
-        'created_at': settings.get('created_at', datetime.datetime.utcnow()).isoformat(),
-        'updated_at': settings.get('updated_at', datetime.datetime.utcnow()).isoformat()
-    }
+        # Create default settings if provisioning has not run yet
+        settings = provisioning.ensure_default_settings(settings_collection, user_id)
+        settings_written(user_id, settings)
+    else:
+        settings_cache.set(str(user_id), (g.data_version, settings))
     
-    return jsonify(settings_response), 200
+    return jsonify(user_settings.format_settings(settings)), 200
+
+@app.route('/api/settings', methods=['PATCH'])
+@token_required
+def patch_settings(current_user):
+    user_id = current_user['_id']
+    data = request.get_json(silent=True)
+    
+    if not data or not isinstance(data, dict):
+        return jsonify({'message': 'No data provided'}), 400
+    
+    try:
+        updates = user_settings.settings_updates(data)
+    except user_settings.SettingsError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    if not updates:
+        return jsonify({'message': 'At least one valid setting must be provided'}), 400
+    
+    # One round trip applies every change and returns the updated document
+    settings = user_settings.update_settings(settings_collection, user_id, updates)
+    settings_written(user_id, settings)
+    
+    return jsonify({
+        'message': 'Settings updated successfully',
+        'settings': user_settings.format_settings(settings)
+    }), 200
 
 @app.route('/api/settings/theme', methods=['PUT'])
 @token_required
@@ -306,7 +512,7 @@ def update_theme(current_user):
         return jsonify({'message': 'Theme is required'}), 400
     
     theme = data['theme']
-    if theme not in ['light', 'dark', 'system']:
+    if theme not in user_settings.THEMES:
         return jsonify({'message': 'Invalid theme value. Must be "light", "dark", or "system"'}), 400
     
     # Update the theme setting
@@ -318,6 +524,7 @@ def update_theme(current_user):
         }},
         upsert=True
     )
+    data_changed(user_id)
     
     if result.modified_count > 0 or result.upserted_id:
         return jsonify({'message': 'Theme updated successfully', 'theme': theme}), 200
@@ -345,6 +552,7 @@ def update_currency(current_user):
         }},
         upsert=True
     )
+    data_changed(user_id)
     
     if result.modified_count > 0 or result.upserted_id:
         return jsonify({'message': 'Currency updated successfully', 'currency': currency}), 200
@@ -372,6 +580,7 @@ def update_language(current_user):
         }},
         upsert=True
     )
+    data_changed(user_id)
     
     if result.modified_count > 0 or result.upserted_id:
         return jsonify({'message': 'Language updated successfully', 'language': language}), 200
@@ -388,60 +597,23 @@ def update_notifications(current_user):
     if not data:
         return jsonify({'message': 'No data provided'}), 400
     
-    # Validate that at least one notification setting is provided
-    valid_fields = [
-        'email', 'push', 'budget_alerts', 'transaction_alerts', 'goal_reminders',
-        'investment_opportunities', 'monthly_reports',
-        # Frontend UI field mappings
-        'goalReminders', 'budgetAlerts', 'investmentOpportunities', 'monthlyReports'
-    ]
+    # Validate that at least one notification setting is provided (UI field names are mapped)
+    try:
+        updates = user_settings.group_updates('notifications', data)
+    except user_settings.SettingsError as e:
+        return jsonify({'message': str(e)}), 400
     
-    if not any(field in data for field in valid_fields):
+    if not updates:
         return jsonify({'message': 'At least one valid notification setting must be provided'}), 400
     
-    # Get current settings
-    settings = settings_collection.find_one({'user_id': user_id})
-    
-    if not settings:
-        return jsonify({'message': 'Settings not found'}), 404
-    
-    # Get current notification settings
-    current_notifications = settings.get('notifications', {})
-    
-    # Handle UI field mappings to backend fields
-    field_mappings = {
-        'goalReminders': 'goal_reminders',
-        'budgetAlerts': 'budget_alerts',
-        'investmentOpportunities': 'investment_opportunities',
-        'monthlyReports': 'monthly_reports'
-    }
-    
-    # Update notification settings
-    updates = {}
-    for key, value in data.items():
-        if key in valid_fields:
-            backend_key = field_mappings.get(key, key)  # Use mapping if exists, otherwise use original key
-            updates[f'notifications.{backend_key}'] = bool(value)
-    
-    # Update timestamp
-    updates['updated_at'] = datetime.datetime.utcnow()
-    
     try:
         # Update settings in the database
-        result = settings_collection.update_one(
-            {'user_id': user_id},
-            {'$set': updates}
-        )
-        
-        if result.modified_count == 0:
-            return jsonify({'message': 'No changes made'}), 200
-            
-        # Get updated settings
-        updated_settings = settings_collection.find_one({'user_id': user_id})
+        settings = user_settings.update_settings(settings_collection, user_id, updates)
+        settings_written(user_id, settings)
         
         return jsonify({
             'message': 'Notification settings updated successfully',
-            'notifications': updated_settings.get('notifications', {})
+            'notifications': settings.get('notifications', {})
         }), 200
     except Exception as e:
         return jsonify({'message': f'Error updating notification settings: {str(e)}'}), 500
@@ -456,59 +628,23 @@ def update_privacy(current_user):
     if not data:
         return jsonify({'message': 'No data provided'}), 400
     
-    # Validate that at least one privacy setting is provided
-    valid_fields = [
-        'share_analytics', 'two_factor_auth', 'third_party_integrations', 'public_profile',
-        # Frontend UI field mappings
-        'analyticsSharing', 'twoFactorAuth', 'thirdPartyIntegrations', 'publicProfile'
-    ]
+    # Validate that at least one privacy setting is provided (UI field names are mapped)
+    try:
+        updates = user_settings.group_updates('privacy', data)
+    except user_settings.SettingsError as e:
+        return jsonify({'message': str(e)}), 400
     
-    if not any(field in data for field in valid_fields):
+    if not updates:
         return jsonify({'message': 'At least one valid privacy setting must be provided'}), 400
     
-    # Get current settings
-    settings = settings_collection.find_one({'user_id': user_id})
-    
-    if not settings:
-        return jsonify({'message': 'Settings not found'}), 404
-    
-    # Get current privacy settings
-    current_privacy = settings.get('privacy', {})
-    
-    # Handle UI field mappings to backend fields
-    field_mappings = {
-        'analyticsSharing': 'share_analytics',
-        'twoFactorAuth': 'two_factor_auth',
-        'thirdPartyIntegrations': 'third_party_integrations',
-        'publicProfile': 'public_profile'
-    }
-    
-    # Update privacy settings
-    updates = {}
-    for key, value in data.items():
-        if key in valid_fields:
-            backend_key = field_mappings.get(key, key)  # Use mapping if exists, otherwise use original key
-            updates[f'privacy.{backend_key}'] = bool(value)
-    
-    # Update timestamp
-    updates['updated_at'] = datetime.datetime.utcnow()
-    
     try:
         # Update settings in the database
-        result = settings_collection.update_one(
-            {'user_id': user_id},
-            {'$set': updates}
-        )
-        
-        if result.modified_count == 0:
-            return jsonify({'message': 'No changes made'}), 200
-            
-        # Get updated settings
-        updated_settings = settings_collection.find_one({'user_id': user_id})
+        settings = user_settings.update_settings(settings_collection, user_id, updates)
+        settings_written(user_id, settings)
         
         return jsonify({
             'message': 'Privacy settings updated successfully',
-            'privacy': updated_settings.get('privacy', {})
+            'privacy': settings.get('privacy', {})
         }), 200
     except Exception as e:
         return jsonify({'message': f'Error updating privacy settings: {str(e)}'}), 500
@@ -523,47 +659,20 @@ def update_dashboard(current_user):
     if not data:
         return jsonify({'message': 'No data provided'}), 400
 
-    # Get current settings
-    settings = settings_collection.find_one({'user_id': user_id})
-    
-    if not settings:
-        return jsonify({'message': 'Settings not found'}), 404
-    
-    # Get current dashboard settings
-    current_dashboard = settings.get('dashboard', {})
-    
     # Update dashboard settings
-    updates = {}
-    if 'show_accounts' in data:
-        updates['dashboard.show_accounts'] = data['show_accounts']
-    if 'show_transactions' in data:
-        updates['dashboard.show_transactions'] = data['show_transactions']
-    if 'show_budgets' in data:
-        updates['dashboard.show_budgets'] = data['show_budgets']
-    if 'show_goals' in data:
-        updates['dashboard.show_goals'] = data['show_goals']
-    if 'compact_view' in data:
-        updates['dashboard.compact_view'] = data['compact_view']
-    
-    # Update timestamp
-    updates['updated_at'] = datetime.datetime.utcnow()
+    try:
+        updates = user_settings.group_updates('dashboard', data)
+    except user_settings.SettingsError as e:
+        return jsonify({'message': str(e)}), 400
     
     try:
         # Update settings in the database
-        result = settings_collection.update_one(
-            {'user_id': user_id},
-            {'$set': updates}
-        )
-        
-        if result.modified_count == 0:
-            return jsonify({'message': 'No changes made'}), 200
-            
-        # Get updated settings
-        updated_settings = settings_collection.find_one({'user_id': user_id})
+        settings = user_settings.update_settings(settings_collection, user_id, updates)
+        settings_written(user_id, settings)
         
         return jsonify({
             'message': 'Dashboard settings updated successfully',
-            'dashboard': updated_settings.get('dashboard', {})
+            'dashboard': settings.get('dashboard', {})
         }), 200
     except Exception as e:
         return jsonify({'message': f'Error updating dashboard settings: {str(e)}'}), 500
@@ -593,20 +702,15 @@ def update_profile(current_user):
         {'_id': user_id},
         {'$set': update_fields}
     )
+    auth_cache.invalidate_user(user_id)
     
     if result.modified_count > 0:
         # Get the updated user
-        updated_user = users_collection.find_one({'_id': user_id})
+        updated_user = users_collection.find_one({'_id': user_id}, schemas.USER.projection)
         
         return jsonify({
             'message': 'Profile updated successfully',
-            'user': {
-                'id': str(updated_user['_id']),
-                'name': updated_user['name'],
-                'email': updated_user['email'],
-                'avatar': updated_user['avatar'],
-                'role': updated_user['role']
-            }
+            'user': schemas.USER.dump(updated_user)
         }), 200
     else:
         return jsonify({'message': 'No changes made to profile'}), 304
@@ -620,8 +724,9 @@ def update_password(current_user):
     if not data or not data.get('current_password') or not data.get('new_password'):
         return jsonify({'message': 'Current password and new password are required'}), 400
     
-    # Verify current password
-    if not check_password_hash(current_user['password'], data['current_password']):
+    # Verify current password; the hash is only read here, never cached with the user
+    stored = users_collection.find_one({'_id': user_id}, {'password': 1})
+    if not stored or not passwords.verify_password(stored['password'], data['current_password']):
         return jsonify({'message': 'Current password is incorrect'}), 401
     
     # Password validation
@@ -629,12 +734,13 @@ def update_password(current_user):
         return jsonify({'message': 'Password must be at least 8 characters long'}), 400
     
     # Update the password
-    hashed_password = generate_password_hash(data['new_password'])
+    hashed_password = passwords.hash_password(data['new_password'])
     
     result = users_collection.update_one(
         {'_id': user_id},
         {'$set': {'password': hashed_password}}
     )
+    auth_cache.invalidate_user(user_id)
     
     if result.modified_count > 0:
         return jsonify({'message': 'Password updated successfully'}), 200
@@ -644,62 +750,34 @@ def update_password(current_user):
 # Dashboard API routes
 @app.route('/api/dashboard/summary', methods=['GET'])
 @token_required
+@conditional_get
+@cached_response
 def get_dashboard_summary(current_user):
     user_id = current_user['_id']
     
-    # Get accounts
-    accounts = list(accounts_collection.find({'user_id': user_id}))
-    total_balance = sum(account.get('balance', 0) for account in accounts)
-    
-    # Get recent transactions
-    recent_transactions = list(transactions_collection.find(
-        {'user_id': user_id}
-    ).sort('date', -1).limit(5))
+    # Accounts, recent transactions, budgets, goals and their totals come from one aggregation;
+    # month-to-date figures come from the daily rollups. The two reads run concurrently.
+    today = datetime.datetime.utcnow()
+    summary, month_totals = fan_out(
+        lambda: fetch_summary(db, user_id),
+        lambda: rollups.totals(db, user_id, today.replace(day=1), today)
+    )
     
-    # Get budgets
-    budgets = list(budgets_collection.find({'user_id': user_id}))
-    total_budget = sum(budget.get('amount', 0) for budget in budgets)
-    spent = sum(budget.get('spent', 0) for budget in budgets)
+    # Budgets whose period ended since they were last written start over, as on the budgets endpoint
+    if spending.roll_over(db, user_id, summary['budgets']):
+        summary['spent'] = sum(budget['spent'] for budget in summary['budgets'])
+        data_changed(user_id)
     
-    # Get goals
-    goals = list(goals_collection.find({'user_id': user_id}))
-    goals_total = sum(goal.get('target_amount', 0) for goal in goals)
-    goals_current = sum(goal.get('current_amount', 0) for goal in goals)
+    total_balance = summary['total_balance']
+    total_budget = summary['total_budget']
+    spent = summary['spent']
+    goals_total = summary['goals_total']
+    goals_current = summary['goals_current']
     
-    # Format the data for the response
-    formatted_accounts = [{
-        'id': str(account['_id']),
-        'name': account.get('name', ''),
-        'type': account.get('type', ''),
-        'balance': account.get('balance', 0),
-        'currency': account.get('currency', 'USD')
-    } for account in accounts]
-    
-    formatted_transactions = [{
-        'id': str(transaction['_id']),
-        'date': transaction.get('date', datetime.datetime.utcnow()).isoformat(),
-        'description': transaction.get('description', ''),
-        'amount': transaction.get('amount', 0),
-        'category': transaction.get('category', 'Uncategorized'),
-        'type': transaction.get('type', 'expense')
-    } for transaction in recent_transactions]
-    
-    formatted_budgets = [{
-        'id': str(budget['_id']),
-        'category': budget.get('category', ''),
-        'amount': budget.get('amount', 0),
-        'spent': budget.get('spent', 0),
-        'period': budget.get('period', 'monthly')
-    } for budget in budgets]
-    
-    formatted_goals = [{
-        'id': str(goal['_id']),
-        'name': goal.get('name', ''),
-        'target_amount': goal.get('target_amount', 0),
-        'current_amount': goal.get('current_amount', 0),
-        'deadline': goal.get('deadline', '').isoformat() if goal.get('deadline') else None,
-        'priority': goal.get('priority', 'medium')
-    } for goal in goals]
+    formatted_accounts = summary['accounts']
+    formatted_transactions = summary['transactions']
+    formatted_budgets = summary['budgets']
+    formatted_goals = summary['goals']
     
     # Create mock data if no data exists
     if not formatted_accounts:
@@ -721,7 +799,14 @@ def get_dashboard_summary(current_user):
         ]
         total_balance = 6500
     
+    income_this_month = month_totals['income']
+    expenses_this_month = month_totals['expense']
+    savings_rate = round((income_this_month - expenses_this_month) / income_this_month * 100, 2) if income_this_month > 0 else 0
+    
     if not formatted_transactions:
+        income_this_month = 3000.00
+        expenses_this_month = 195.70
+        savings_rate = 25  # Mock value
         formatted_transactions = [
             {
                 'id': 'mock-tx-1',
@@ -820,53 +905,119 @@ def get_dashboard_summary(current_user):
         },
         'summary': {
             'net_worth': total_balance,
-            'income_this_month': sum(t.get('amount', 0) for t in formatted_transactions if t.get('type') == 'income'),
-            'expenses_this_month': sum(t.get('amount', 0) for t in formatted_transactions if t.get('type') == 'expense'),
-            'savings_rate': 25  # Mock value
+            'income_this_month': income_this_month,
+            'expenses_this_month': expenses_this_month,
+            'savings_rate': savings_rate
         }
     }), 200
 
 @app.route('/api/dashboard/accounts', methods=['GET'])
 @token_required
+@conditional_get
+@cached_response
 def get_accounts(current_user):
     user_id = current_user['_id']
     
-    accounts = list(accounts_collection.find({'user_id': user_id}))
+    accounts = list(accounts_collection.find({'user_id': user_id}, schemas.ACCOUNT.projection))
     
     if not accounts:
-        # Create a default account if none exists
-        default_account = {
-            'user_id': user_id,
-            'name': 'Cash Account',
-            'type': 'Cash',
-            'balance': 1000.00,
-            'currency': 'USD',
-            'created_at': datetime.datetime.utcnow()
-        }
-        accounts_collection.insert_one(default_account)
-        accounts = [default_account]
-    
-    formatted_accounts = [{
-        'id': str(account['_id']),
-        'name': account.get('name', ''),
-        'type': account.get('type', ''),
-        'balance': account.get('balance', 0),
-        'currency': account.get('currency', 'USD')
-    } for account in accounts]
+        # Create the default account if provisioning has not run yet
+        accounts = [provisioning.ensure_default_account(accounts_collection, user_id)]
+        data_changed(user_id)
     
     return jsonify({
-        'accounts': formatted_accounts,
+        'accounts': schemas.ACCOUNT.dump_many(accounts),
         'total_balance': sum(account.get('balance', 0) for account in accounts)
     }), 200
 
+def mock_transactions_response():
+    mock_transactions = [
+        {
+            'id': 'mock-tx-1',
+            'date': datetime.datetime.utcnow().isoformat(),
+            'description': 'Grocery shopping',
+            'amount': 120.50,
+            'category': 'Food',
+            'type': 'expense'
+        },
+        {
+            'id': 'mock-tx-2',
+            'date': (datetime.datetime.utcnow() - datetime.timedelta(days=1)).isoformat(),
+            'description': 'Salary',
+            'amount': 3000.00,
+            'category': 'Income',
+            'type': 'income'
+        },
+        {
+            'id': 'mock-tx-3',
+            'date': (datetime.datetime.utcnow() - datetime.timedelta(days=2)).isoformat(),
+            'description': 'Restaurant',
+            'amount': 75.20,
+            'category': 'Dining',
+            'type': 'expense'
+        }
+    ]
+    return {
+        'transactions': mock_transactions,
+        'total_count': len(mock_transactions),
+        'current_page': 1,
+        'total_pages': 1
+    }
+
+# Exact counts are cached briefly so paging does not re-count the collection on every request.
+# Entries are grouped per user so a write can drop all of that user's counts at once.
+def count_transactions(query):
+    user_key = str(query['user_id'])
+    filter_key = (query.get('category'), query.get('type'))
+    counts = count_cache.get(user_key) or {}
+    total_count = counts.get(filter_key)
+    if total_count is None:
+        total_count = transactions_collection.count_documents(query)
+        count_cache.set(user_key, {**counts, filter_key: total_count})
+    return total_count
+
+# Statement rows, stopping the import at the next batch once a rollup rebuild of the user
+# starts. The rows already imported stay, and uploading the file again imports the rest.
+def rows_until_rebuild(user_id, rows):
+    checked_at = time.monotonic()
+    for row in rows:
+        if time.monotonic() - checked_at >= REBUILD_CHECK_SECONDS:
+            rollups.check_writable(db, user_id)
+            checked_at = time.monotonic()
+        yield row
+
+# Newline-delimited JSON progress of a streamed import. The response has started by the time
+# a rebuild stops the import, so the last line reports it instead of a 503.
+def import_progress_lines(progress):
+    report = {}
+    try:
+        for report in progress:
+            yield json.dumps(report) + '\n'
+    except rollups.RebuildInProgress:
+        error = 'Totals are being recalculated; upload the file again to import the remaining rows'
+        yield json.dumps({**report, 'done': True, 'error': error}) + '\n'
+
+# Keep everything derived from a user's transactions in step with a write
+def transactions_written(user_id, transactions):
+    rollups.apply_transactions(db, transactions)
+    spending.apply_transactions(db, transactions)
+    count_cache.delete(str(user_id))
+    data_changed(user_id)
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d')
+
 @app.route('/api/dashboard/transactions', methods=['GET'])
 @token_required
+@conditional_get
 def get_transactions(current_user):
     user_id = current_user['_id']
     
     # Optional query parameters
-    limit = request.args.get('limit', default=10, type=int)
-    skip = request.args.get('skip', default=0, type=int)
+    limit = max(1, min(request.args.get('limit', default=10, type=int), MAX_PAGE_SIZE))
+    skip = max(0, request.args.get('skip', default=0, type=int))
+    cursor = request.args.get('cursor')
+    include_total = request.args.get('include_total', default='false').lower() == 'true'
     category = request.args.get('category')
     transaction_type = request.args.get('type')  # income or expense
     
@@ -877,69 +1028,402 @@ def get_transactions(current_user):
     if transaction_type:
         query['type'] = transaction_type
     
-    # Get transactions
-    transactions = list(transactions_collection.find(query).sort('date', -1).skip(skip).limit(limit))
-    
-    # Get the total count
-    total_count = transactions_collection.count_documents(query)
+    if cursor is not None:
+        # Keyset pagination: seek past the last row of the previous page instead of skipping
+        try:
+            page_query = seek_filter(query, cursor) if cursor else query
+        except InvalidCursor:
+            return jsonify({'message': 'Invalid cursor'}), 400
+        
+        transactions = list(
+            transactions_collection.find(page_query, schemas.TRANSACTION.projection).sort(TRANSACTION_SORT).limit(limit + 1)
+        )
+        has_more = len(transactions) > limit
+        transactions = transactions[:limit]
+        
+        if not transactions and not cursor:
+            return jsonify(mock_transactions_response()), 200
+        
+        response = {
+            'transactions': schemas.TRANSACTION.dump_many(transactions),
+            'next_cursor': encode_cursor(transactions[-1]) if has_more else None,
+            'has_more': has_more
+        }
+        if include_total:
+            response['total_count'] = count_transactions(query)
+        
+        return jsonify(response), 200
+    
+    # Get transactions and the total count concurrently
+    transactions, total_count = fan_out(
+        lambda: list(
+            transactions_collection.find(query, schemas.TRANSACTION.projection).sort(TRANSACTION_SORT).skip(skip).limit(limit)
+        ),
+        lambda: count_transactions(query)
+    )
     
     if not transactions:
         # Return mock data
-        mock_transactions = [
-            {
-                'id': 'mock-tx-1',
-                'date': datetime.datetime.utcnow().isoformat(),
-                'description': 'Grocery shopping',
-                'amount': 120.50,
-                'category': 'Food',
-                'type': 'expense'
-            },
-            {
-                'id': 'mock-tx-2',
-                'date': (datetime.datetime.utcnow() - datetime.timedelta(days=1)).isoformat(),
-                'description': 'Salary',
-                'amount': 3000.00,
-                'category': 'Income',
-                'type': 'income'
-            },
-            {
-                'id': 'mock-tx-3',
-                'date': (datetime.datetime.utcnow() - datetime.timedelta(days=2)).isoformat(),
-                'description': 'Restaurant',
-                'amount': 75.20,
-                'category': 'Dining',
-                'type': 'expense'
-            }
-        ]
-        return jsonify({
-            'transactions': mock_transactions,
-            'total_count': len(mock_transactions),
-            'current_page': 1,
-            'total_pages': 1
-        }), 200
-    
-    formatted_transactions = [{
-        'id': str(transaction['_id']),
-        'date': transaction.get('date', datetime.datetime.utcnow()).isoformat(),
-        'description': transaction.get('description', ''),
-        'amount': transaction.get('amount', 0),
-        'category': transaction.get('category', 'Uncategorized'),
-        'type': transaction.get('type', 'expense')
-    } for transaction in transactions]
+        return jsonify(mock_transactions_response()), 200
     
     return jsonify({
-        'transactions': formatted_transactions,
+        'transactions': schemas.TRANSACTION.dump_many(transactions),
         'total_count': total_count,
         'current_page': skip // limit + 1,
-        'total_pages': (total_count + limit - 1) // limit
+        'total_pages': (total_count + limit - 1) // limit,
+        'next_cursor': encode_cursor(transactions[-1]) if skip + len(transactions) < total_count else None
+    }), 200
+
+@app.route('/api/dashboard/transactions/search', methods=['GET'])
+@token_required
+@conditional_get
+@cached_response
+def search_transactions(current_user):
+    user_id = current_user['_id']
+    query = (request.args.get('q') or '').strip()
+    limit = max(1, min(request.args.get('limit', default=20, type=int), MAX_PAGE_SIZE))
+    
+    if not search.MIN_QUERY_LENGTH <= len(query) <= search.MAX_QUERY_LENGTH:
+        return jsonify({
+            'message': f'q must be between {search.MIN_QUERY_LENGTH} and {search.MAX_QUERY_LENGTH} characters'
+        }), 400
+    
+    # Optional filters, applied in the same indexed query as the search terms
+    filters = {}
+    if request.args.get('category'):
+        filters['category'] = request.args['category']
+    if request.args.get('type'):
+        filters['type'] = request.args['type']
+    
+    try:
+        date_range = {}
+        if request.args.get('from'):
+            date_range['$gte'] = parse_date(request.args['from'])
+        if request.args.get('to'):
+            date_range['$lt'] = parse_date(request.args['to']) + datetime.timedelta(days=1)
+    except ValueError:
+        return jsonify({'message': 'Invalid date. Use YYYY-MM-DD'}), 400
+    if date_range:
+        filters['date'] = date_range
+    
+    amount_range = {}
+    for name, operator in (('min_amount', '$gte'), ('max_amount', '$lte')):
+        if request.args.get(name):
+            try:
+                amount_range[operator] = float(request.args[name])
+            except ValueError:
+                return jsonify({'message': f'Invalid {name}'}), 400
+    if amount_range:
+        filters['amount'] = amount_range
+    
+    results = search.search(transactions_collection, user_id, query, filters, limit, schemas.TRANSACTION.projection)
+    
+    return jsonify({
+        'query': query,
+        'results': [
+            {**schemas.TRANSACTION.dump(transaction), 'score': round(transaction['score'], 3)}
+            for transaction in results
+        ]
+    }), 200
+
+@app.route('/api/dashboard/transactions', methods=['POST'])
+@token_required
+def create_transaction(current_user):
+    user_id = current_user['_id']
+    data = request.get_json()
+    
+    # Validate input fields
+    if not data or not data.get('description') or data.get('amount') is None:
+        return jsonify({'message': 'Description and amount are required'}), 400
+    
+    transaction_type = data.get('type', 'expense')
+    if transaction_type not in ['income', 'expense']:
+        return jsonify({'message': 'Invalid type. Must be "income" or "expense"'}), 400
+    
+    try:
+        amount = float(data['amount'])
+        date = datetime.datetime.fromisoformat(data['date']) if data.get('date') else datetime.datetime.utcnow()
+    except (TypeError, ValueError):
+        return jsonify({'message': 'Invalid amount or date'}), 400
+    
+    # Dates are stored as naive UTC like everywhere else
+    if date.tzinfo:
+        date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    
+    # Without an explicit category, the user's rules and then the global merchant rules decide
+    category = data.get('category') or categorize.categorizer(db, user_id)(data['description'], transaction_type)
+    
+    transaction = {
+        'user_id': user_id,
+        'date': date,
+        'description': data['description'],
+        'amount': amount,
+        'category': category or 'Uncategorized',
+        'type': transaction_type,
+        'search_grams': search.description_grams(data['description']),
+        'created_at': datetime.datetime.utcnow()
+    }
+    
+    rollups.check_writable(db, user_id)
+    transactions_collection.insert_one(transaction)
+    transactions_written(user_id, [transaction])
+    
+    return jsonify({
+        'message': 'Transaction created successfully',
+        'transaction': schemas.TRANSACTION.dump(transaction)
+    }), 201
+
+@app.route('/api/dashboard/analytics', methods=['GET'])
+@token_required
+@conditional_get
+def get_analytics(current_user):
+    user_id = current_user['_id']
+    today = datetime.datetime.utcnow()
+    
+    # Date range (inclusive), defaults to month to date
+    try:
+        start = parse_date(request.args['from']) if request.args.get('from') else today.replace(day=1)
+        end = parse_date(request.args['to']) if request.args.get('to') else today
+    except ValueError:
+        return jsonify({'message': 'Invalid date. Use YYYY-MM-DD'}), 400
+    
+    group_by = request.args.get('group_by', 'day')
+    if group_by not in rollups.GROUPINGS:
+        return jsonify({'message': 'Invalid group_by value. Must be "day", "month", or "category"'}), 400
+    
+    if start > end:
+        return jsonify({'message': '"from" must not be after "to"'}), 400
+    
+    rows = rollups.series(db, user_id, start, end, group_by)
+    income = sum(row['income'] for row in rows)
+    expenses = sum(row['expenses'] for row in rows)
+    
+    return jsonify({
+        'from': start.strftime('%Y-%m-%d'),
+        'to': end.strftime('%Y-%m-%d'),
+        'group_by': group_by,
+        'income': income,
+        'expenses': expenses,
+        'net': income - expenses,
+        'series': rows
+    }), 200
+
+@app.route('/api/dashboard/networth', methods=['GET'])
+@token_required
+@conditional_get
+@cached_response
+def get_networth(current_user):
+    user_id = current_user['_id']
+    today = datetime.datetime.utcnow()
+    
+    # Date range (inclusive), defaults to the last 30 days
+    try:
+        start = parse_date(request.args['from']) if request.args.get('from') else today - datetime.timedelta(days=30)
+        end = parse_date(request.args['to']) if request.args.get('to') else today
+    except ValueError:
+        return jsonify({'message': 'Invalid date. Use YYYY-MM-DD'}), 400
+    
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in snapshots.GRANULARITIES:
+        return jsonify({'message': 'Invalid granularity value. Must be "day", "week", or "month"'}), 400
+    
+    if start > end:
+        return jsonify({'message': '"from" must not be after "to"'}), 400
+    
+    # Past days come from the snapshots; today is the live sum of balances, as on the summary
+    points, current = fan_out(
+        lambda: snapshots.net_worth_series(db, user_id, start, min(end, today), granularity),
+        lambda: sum(account.get('balance', 0) for account in accounts_collection.find({'user_id': user_id}, {'balance': 1}))
+    )
+    if end.date() >= today.date():
+        today_key = today.strftime('%Y-%m-%d')
+        points = [point for point in points if point['date'] != today_key]
+        points.append({'date': today_key, 'net_worth': current})
+    
+    return jsonify({
+        'from': start.strftime('%Y-%m-%d'),
+        'to': end.strftime('%Y-%m-%d'),
+        'granularity': granularity,
+        'current': current,
+        'series': points
     }), 200
 
+@app.route('/api/dashboard/forecast', methods=['GET'])
+@token_required
+@conditional_get
+@cached_response
+def get_forecast(current_user):
+    user_id = current_user['_id']
+    today = datetime.datetime.utcnow()
+    
+    days = request.args.get('days', default=forecast.FORECAST_DAYS, type=int)
+    if days < 1 or days > forecast.MAX_FORECAST_DAYS:
+        return jsonify({'message': f'days must be between 1 and {forecast.MAX_FORECAST_DAYS}'}), 400
+    
+    # Recurring series are analyzed incrementally; the projection starts from today's live balances.
+    # The data version is read here, since the request context is not available on the pool threads.
+    version = g.data_version
+    stats, current = fan_out(
+        lambda: forecast.series_stats(db, user_id, version),
+        lambda: sum(account.get('balance', 0) for account in accounts_collection.find({'user_id': user_id}, {'balance': 1}))
+    )
+    series = forecast.recurring(stats, today)
+    points = forecast.project(series, current, today, days)
+    lowest = min(points, key=lambda point: point['balance'])
+    
+    return jsonify({
+        'from': today.strftime('%Y-%m-%d'),
+        'days': days,
+        'current': current,
+        'projected': points[-1]['balance'],
+        'lowest': lowest,
+        'recurring': series,
+        'series': points
+    }), 200
+
+@app.route('/api/import/transactions', methods=['POST'])
+@token_required
+def import_transactions(current_user):
+    user_id = current_user['_id']
+    upload = request.files.get('file')
+    
+    if not upload or not upload.filename:
+        return jsonify({'message': 'A statement file is required'}), 400
+    
+    statement_format = (request.form.get('format') or statements.detect_format(upload.filename) or '').lower()
+    if statement_format not in statements.FORMATS:
+        return jsonify({'message': 'Unsupported format. Must be "csv", "ofx", or "qif"'}), 400
+    
+    account_id = None
+    if request.form.get('account_id'):
+        account = accounts_collection.find_one({'_id': ObjectId(request.form['account_id']), 'user_id': user_id}) \
+            if ObjectId.is_valid(request.form['account_id']) else None
+        if not account:
+            return jsonify({'message': 'Account not found'}), 404
+        account_id = account['_id']
+    
+    # The upload is spooled to disk by werkzeug and parsed as a stream, never loaded whole
+    try:
+        rows = statements.parse_statement(upload.stream, statement_format, request.form.get('date_format'))
+    except statements.StatementError as e:
+        return jsonify({'message': f'Invalid statement: {str(e)}'}), 400
+    
+    rollups.check_writable(db, user_id)
+    progress = statements.import_statement(
+        transactions_collection,
+        user_id,
+        rows_until_rebuild(user_id, rows),
+        on_inserted=lambda inserted: transactions_written(user_id, inserted),
+        account_id=account_id,
+        categorize=categorize.categorizer(db, user_id)
+    )
+    
+    # Large files can report progress as newline-delimited JSON, one line per batch
+    if request.args.get('stream', 'false').lower() == 'true':
+        return Response(
+            stream_with_context(import_progress_lines(progress)),
+            mimetype='application/x-ndjson'
+        )
+    
+    for report in progress:
+        pass
+    
+    # Rows before the one that could not be read stay imported; the report says how many
+    if report.get('error'):
+        error = report.pop('error')
+        return jsonify({'message': f'Invalid statement: {error}', **report}), 400
+    
+    return jsonify({'message': 'Statement imported successfully', **report}), 200
+
+@app.route('/api/categories/rules', methods=['GET'])
+@token_required
+def get_category_rules(current_user):
+    rules = categorize.user_rules(db, current_user['_id'])
+    
+    return jsonify({
+        'rules': [{'pattern': pattern, 'category': category} for pattern, category in sorted(rules.items())]
+    }), 200
+
+@app.route('/api/categories/rules', methods=['POST'])
+@token_required
+def add_category_rule(current_user):
+    data = request.get_json(silent=True) or {}
+    
+    try:
+        rule = categorize.add_rule(db, current_user['_id'], data.get('pattern'), data.get('category'))
+    except categorize.RuleError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    return jsonify({
+        'message': 'Rule saved successfully',
+        'rule': {'pattern': rule['pattern'], 'category': rule['category']}
+    }), 200
+
+# Categorize the user's uncategorized transactions with their rules and the global ones
+@app.route('/api/categories/apply', methods=['POST'])
+@token_required
+def apply_category_rules(current_user):
+    user_id = current_user['_id']
+    rollups.check_writable(db, user_id)
+    categorized = categorize.apply(db, user_id).get(user_id, 0)
+    
+    if categorized:
+        count_cache.delete(str(user_id))
+        data_changed(user_id)
+    
+    return jsonify({'message': 'Rules applied successfully', 'categorized': categorized}), 200
+
+@app.route('/api/export/transactions', methods=['GET'])
+@token_required
+def export_transactions(current_user):
+    user_id = current_user['_id']
+    
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in exports.FORMATS:
+        return jsonify({'message': 'Invalid format. Must be "ndjson" or "csv"'}), 400
+    
+    # Optional filters, same as the transactions listing plus an inclusive date range
+    query = {'user_id': user_id}
+    if request.args.get('category'):
+        query['category'] = request.args['category']
+    if request.args.get('type'):
+        query['type'] = request.args['type']
+    
+    try:
+        date_range = {}
+        if request.args.get('from'):
+            date_range['$gte'] = parse_date(request.args['from'])
+        if request.args.get('to'):
+            date_range['$lt'] = parse_date(request.args['to']) + datetime.timedelta(days=1)
+    except ValueError:
+        return jsonify({'message': 'Invalid date. Use YYYY-MM-DD'}), 400
+    if date_range:
+        query['date'] = date_range
+    
+    # Rows are streamed from the cursor as they arrive, so memory stays flat for any history size
+    cursor = exports.export_cursor(transactions_collection, query)
+    
+    return Response(
+        stream_with_context(exports.stream_export(cursor, export_format)),
+        mimetype=exports.FORMATS[export_format],
+        headers={
+            'Content-Disposition': f'attachment; filename=transactions.{export_format}',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
 @app.route('/api/dashboard/budgets', methods=['GET'])
 @token_required
+@conditional_get
+@cached_response
 def get_budgets(current_user):
     user_id = current_user['_id']
     
-    budgets = list(budgets_collection.find({'user_id': user_id}))
+    budgets = list(budgets_collection.find({'user_id': user_id}, schemas.BUDGET.projection))
+    
+    # Budgets whose period ended since they were last written start over in the current period
+    if spending.roll_over(db, user_id, budgets):
+        data_changed(user_id)
     
     if not budgets:
         # Return mock data
@@ -973,19 +1457,11 @@ def get_budgets(current_user):
             'remaining': 350
         }), 200
     
-    formatted_budgets = [{
-        'id': str(budget['_id']),
-        'category': budget.get('category', ''),
-        'amount': budget.get('amount', 0),
-        'spent': budget.get('spent', 0),
-        'period': budget.get('period', 'monthly')
-    } for budget in budgets]
-    
     total_budget = sum(budget.get('amount', 0) for budget in budgets)
     total_spent = sum(budget.get('spent', 0) for budget in budgets)
     
     return jsonify({
-        'budgets': formatted_budgets,
+        'budgets': schemas.BUDGET.dump_many(budgets),
         'total': total_budget,
         'spent': total_spent,
         'remaining': total_budget - total_spent
@@ -993,10 +1469,12 @@ def get_budgets(current_user):
 
 @app.route('/api/dashboard/goals', methods=['GET'])
 @token_required
+@conditional_get
+@cached_response
 def get_goals(current_user):
     user_id = current_user['_id']
     
-    goals = list(goals_collection.find({'user_id': user_id}))
+    goals = list(goals_collection.find({'user_id': user_id}, schemas.GOAL.projection))
     
     if not goals:
         # Return mock data
@@ -1029,24 +1507,140 @@ def get_goals(current_user):
             'progress': round(goals_current / goals_total * 100, 2)
         }), 200
     
-    formatted_goals = [{
-        'id': str(goal['_id']),
-        'name': goal.get('name', ''),
-        'target_amount': goal.get('target_amount', 0),
-        'current_amount': goal.get('current_amount', 0),
-        'deadline': goal.get('deadline', '').isoformat() if goal.get('deadline') else None,
-        'priority': goal.get('priority', 'medium')
-    } for goal in goals]
-    
     goals_total = sum(goal.get('target_amount', 0) for goal in goals)
     goals_current = sum(goal.get('current_amount', 0) for goal in goals)
     
     return jsonify({
-        'goals': formatted_goals,
+        'goals': schemas.GOAL.dump_many(goals),
         'total': goals_total,
         'current': goals_current,
         'progress': round((goals_current / goals_total * 100) if goals_total > 0 else 0, 2)
     }), 200
 
+# Paths and market assumptions for a goal simulation, from query parameters or a JSON body.
+# Without paths, as many as fit the goals' horizon are used (see goal_simulation.default_paths).
+def simulation_options(source):
+    paths = int(source['paths']) if source.get('paths') else None
+    expected_return, volatility = source.get('expected_return'), source.get('volatility')
+    return {
+        'paths': max(100, min(paths, goal_simulation.MAX_PATHS)) if paths else None,
+        'expected_return': goal_simulation.EXPECTED_RETURN if expected_return in (None, '') else float(expected_return),
+        'volatility': goal_simulation.VOLATILITY if volatility in (None, '') else float(volatility)
+    }
+
+# Why simulation options cannot be simulated, or None. A return of -100% or less has no
+# logarithm, and NaN or infinite inputs would fill every path with NaN.
+def invalid_simulation_options(options):
+    if not math.isfinite(options['expected_return']) or options['expected_return'] <= -1:
+        return 'expected_return must be a finite number greater than -1'
+    if not math.isfinite(options['volatility']) or options['volatility'] < 0:
+        return 'volatility must be a finite number of at least 0'
+    return None
+
+# Average monthly income minus expenses over the last three full months, from the rollups
+def average_monthly_savings(user_id):
+    start = datetime.datetime.utcnow().replace(day=1)
+    end = start - datetime.timedelta(days=1)
+    for _ in range(3):
+        start = (start - datetime.timedelta(days=1)).replace(day=1)
+    totals = rollups.totals(db, user_id, start, end)
+    return round((totals['income'] - totals['expense']) / 3, 2)
+
+@app.route('/api/dashboard/goals/simulation', methods=['GET'])
+@token_required
+@conditional_get
+@cached_response
+def simulate_goals(current_user):
+    user_id = current_user['_id']
+    
+    try:
+        options = simulation_options(request.args)
+        monthly_savings = float(request.args['monthly_savings']) if request.args.get('monthly_savings') else None
+    except ValueError:
+        return jsonify({'message': 'paths, expected_return, volatility and monthly_savings must be numbers'}), 400
+    
+    message = invalid_simulation_options(options)
+    if message:
+        return jsonify({'message': message}), 400
+    if monthly_savings is not None and not math.isfinite(monthly_savings):
+        return jsonify({'message': 'monthly_savings must be a finite number'}), 400
+    
+    goals, savings = fan_out(
+        lambda: list(goals_collection.find({'user_id': user_id}, {**schemas.GOAL.projection, 'monthly_contribution': 1})),
+        lambda: monthly_savings if monthly_savings is not None else average_monthly_savings(user_id)
+    )
+    
+    # Goals without their own monthly_contribution share the user's savings by priority
+    inputs = goal_simulation.allocate_contributions([{
+        'target_amount': goal.get('target_amount', 0),
+        'current_amount': goal.get('current_amount', 0),
+        'months': goal_simulation.months_until(goal.get('deadline')),
+        'priority': goal.get('priority', 'medium'),
+        'monthly_contribution': goal.get('monthly_contribution')
+    } for goal in goals], savings)
+    options['paths'] = options['paths'] or goal_simulation.default_paths(inputs)
+    
+    try:
+        results = goal_simulation.simulate(inputs, **options)
+    except goal_simulation.SimulationTooLarge as e:
+        return jsonify({'message': str(e)}), 400
+    
+    return jsonify({
+        **options,
+        'monthly_savings': savings,
+        'goals': [{
+            **schemas.GOAL.dump(goal),
+            'months_remaining': goal_input['months'],
+            'monthly_contribution': goal_input['monthly_contribution'],
+            **result
+        } for goal, goal_input, result in zip(goals, inputs, results)]
+    }), 200
+
+# Same simulation for goals that are not stored, e.g. from the planners
+@app.route('/api/dashboard/goals/simulation', methods=['POST'])
+@token_required
+def simulate_planned_goals(current_user):
+    data = request.get_json(silent=True)
+    
+    if not data or not isinstance(data.get('goals'), list) or not data['goals']:
+        return jsonify({'message': 'A non-empty list of goals is required'}), 400
+    if len(data['goals']) > MAX_PAGE_SIZE:
+        return jsonify({'message': f'At most {MAX_PAGE_SIZE} goals can be simulated at once'}), 400
+    
+    try:
+        options = simulation_options(data)
+        inputs = [{
+            'target_amount': float(goal['target_amount']),
+            'current_amount': float(goal.get('current_amount') or 0),
+            'months': goal_simulation.months_until(parse_date(goal['deadline'])) if goal.get('deadline') else None,
+            'priority': goal.get('priority', 'medium'),
+            'monthly_contribution': float(goal['monthly_contribution']) if goal.get('monthly_contribution') is not None else None
+        } for goal in data['goals']]
+        monthly_savings = float(data.get('monthly_savings') or 0)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'message': 'Each goal needs a numeric target_amount and an optional YYYY-MM-DD deadline'}), 400
+    
+    message = invalid_simulation_options(options)
+    if message:
+        return jsonify({'message': message}), 400
+    
+    inputs = goal_simulation.allocate_contributions(inputs, monthly_savings)
+    options['paths'] = options['paths'] or goal_simulation.default_paths(inputs)
+    
+    try:
+        results = goal_simulation.simulate(inputs, **options)
+    except goal_simulation.SimulationTooLarge as e:
+        return jsonify({'message': str(e)}), 400
+    
+    return jsonify({
+        **options,
+        'goals': [{
+            'months_remaining': goal_input['months'],
+            'monthly_contribution': goal_input['monthly_contribution'],
+            **result
+        } for goal_input, result in zip(inputs, results)]
+    }), 200
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
+    # The debugger runs arbitrary code for anyone who can reach it, so it is opt-in
+    app.run(debug=os.getenv('FLASK_DEBUG', '').lower() in ('1', 'true'), host='0.0.0.0', port=5000) 
\ No newline at end of file
@@ -0,0 +1,88 @@
+"""Transaction categorization: one trie-shaped regex vs. a scan per rule.
+
+Generates --rules merchant rules (the global ones plus synthetic merchants) and
+--descriptions statement-style descriptions, about half of which match a rule, and
+reports descriptions per second for the compiled matcher and for checking every rule
+in turn.
+
+Usage (from the backend directory; MongoDB is not needed):
+    python -m benchmarks.bench_categorize --rules 500 --descriptions 200000
+"""
+import argparse
+import random
+import re
+import string
+import time
+
+import categorize
+
+
+def synthetic_rules(count, rng):
+    rules = {**categorize.GLOBAL_RULES, **categorize.GLOBAL_INCOME_RULES}
+    categories = sorted(set(rules.values()))
+    while len(rules) < count:
+        words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9))) for _ in range(rng.randint(1, 2))]
+        rules[' '.join(words)] = rng.choice(categories)
+    return rules
+
+
+def descriptions(rules, count, rng):
+    patterns = list(rules)
+    rows = []
+    for i in range(count):
+        reference = f'{rng.randint(1000, 99999)} {rng.choice(["CA", "NY", "TX", "WA"])}'
+        if i % 2:
+            merchant = rng.choice(patterns).upper().replace(' ', rng.choice([' ', '*', '.']))
+        else:
+            merchant = ''.join(rng.choices(string.ascii_uppercase, k=rng.randint(6, 12)))
+        rows.append(f'POS PURCHASE {merchant} #{reference}')
+    return rows
+
+
+# The straightforward approach: every rule's pattern searched in turn
+def per_rule(rules):
+    compiled = [
+        (re.compile(r'(?<![a-z0-9])' + r'[^a-z0-9]+'.join(map(re.escape, pattern.split())) + r'(?![a-z0-9])'), category)
+        for pattern, category in rules.items()
+    ]
+
+    def match(description):
+        lowered = description.lower()
+        return next((category for regex, category in compiled if regex.search(lowered)), None)
+    return match
+
+
+def throughput(match, rows):
+    start = time.perf_counter()
+    matched = sum(1 for row in rows if match(row))
+    return len(rows) / (time.perf_counter() - start), matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rules', type=int, default=500)
+    parser.add_argument('--descriptions', type=int, default=200000)
+    parser.add_argument('--per-rule-sample', type=int, default=5000, help='descriptions timed for the per-rule scan')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    rules = synthetic_rules(args.rules, rng)
+    rows = descriptions(rules, args.descriptions, rng)
+
+    start = time.perf_counter()
+    matcher = categorize.Matcher(rules)
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    results = [
+        ('trie regex', *throughput(matcher.match, rows)),
+        ('per-rule scan', *throughput(per_rule(rules), rows[:args.per_rule_sample]))
+    ]
+
+    print(f'{len(rules)} rules, {len(rows)} descriptions, matcher compiled in {compile_ms:.1f}ms')
+    for name, rate, matched in results:
+        print(f'{name:>14} {rate:>12,.0f} descriptions/s  ({matched} matched)')
+    print('(per-rule scan timed on the first', args.per_rule_sample, 'descriptions)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Summary latency under concurrent load: sequential reads vs. concurrent fan-out.
+
+Each strategy is driven by --concurrency client threads issuing --requests summary
+reads in total; p50/p99 latency and throughput are reported per strategy.
+
+Usage (from the backend directory, with MongoDB running):
+    python -m benchmarks.bench_fanout --size 100 --concurrency 1 8 32
+"""
+import argparse
+import datetime
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pymongo
+from bson.objectid import ObjectId
+
+import rollups
+from benchmarks.bench_summary import legacy_summary, seed
+from concurrency import fan_out
+from dashboard import fetch_summary
+
+
+def month_to_date(db, user_id):
+    today = datetime.datetime.utcnow()
+    return rollups.totals(db, user_id, today.replace(day=1), today)
+
+
+STRATEGIES = {
+    # The four original queries plus the rollup read, one after another
+    'sequential': lambda db, user_id: (legacy_summary(db, user_id), month_to_date(db, user_id)),
+    # One aggregation, then the rollup read
+    'aggregate': lambda db, user_id: (fetch_summary(db, user_id, 'aggregate'), month_to_date(db, user_id)),
+    # One aggregation and the rollup read concurrently (the default handler path)
+    'aggregate+fan_out': lambda db, user_id: fan_out(
+        lambda: fetch_summary(db, user_id, 'aggregate'),
+        lambda: month_to_date(db, user_id)
+    ),
+    # One query per collection plus the rollup read, all concurrently
+    'fan_out': lambda db, user_id: fan_out(
+        lambda: fetch_summary(db, user_id, 'fan_out'),
+        lambda: month_to_date(db, user_id)
+    )
+}
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run(strategy, db, user_id, concurrency, requests):
+    def timed(_):
+        start = time.perf_counter()
+        strategy(db, user_id)
+        return (time.perf_counter() - start) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        timings = sorted(clients.map(timed, range(requests)))
+    elapsed = time.perf_counter() - started
+    return percentile(timings, 0.5), percentile(timings, 0.99), requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--database', default='finfine_bench')
+    parser.add_argument('--size', type=int, default=100, help='accounts, budgets and goals per user')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.mongo_uri, maxPoolSize=max(args.concurrency) * 4)
+    db = client[args.database]
+    for name in ('accounts', 'budgets', 'goals'):
+        db[name].create_index('user_id')
+    db.transactions.create_index([('user_id', 1), ('date', -1), ('_id', -1)])
+    rollups.rollups_collection(db).create_index([('user_id', 1), ('day', 1), ('category', 1), ('type', 1)], unique=True)
+
+    user_id = ObjectId()
+    seed(db, user_id, args.size)
+    # Nothing else writes to the benchmark database, so there are no writes to wait for
+    rollups.rebuild(db, user_id, drain_seconds=0)
+
+    print(f"{'strategy':>18} {'clients':>8} {'p50':>10} {'p99':>10} {'req/s':>10}")
+    try:
+        for concurrency in args.concurrency:
+            for name, strategy in STRATEGIES.items():
+                p50, p99, throughput = run(strategy, db, user_id, concurrency, args.requests)
+                print(f'{name:>18} {concurrency:>8} {p50:>8.2f}ms {p99:>8.2f}ms {throughput:>10.0f}')
+    finally:
+        client.drop_database(args.database)
+
+
+if __name__ == '__main__':
+    main()
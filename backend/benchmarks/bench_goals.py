@@ -0,0 +1,80 @@
+"""Goal attainment simulation: vectorized engine vs. a per-path Python loop.
+
+Simulates --goals goals with deadlines spread over the next --horizon months on --paths
+paths, and reports the median time of the NumPy engine (memoization bypassed), a
+memoized repeat, and a pure Python loop over a sample of the paths.
+
+Usage (from the backend directory; MongoDB is not needed):
+    python -m benchmarks.bench_goals --paths 10000 --goals 20
+"""
+import argparse
+import random
+import statistics
+import time
+
+import goal_simulation
+
+
+def goals(count, horizon):
+    return [{
+        'target_amount': 5000.0 + 1000 * i,
+        'current_amount': 500.0 * i,
+        'months': 1 + (i * horizon) // count,
+        'monthly_contribution': 150.0
+    } for i in range(count)]
+
+
+# The straightforward approach: one Python loop per path, month and goal
+def loop_simulation(inputs, paths):
+    rng = random.Random(goal_simulation.SEED)
+    sigma = goal_simulation.VOLATILITY / 12 ** 0.5
+    mu = goal_simulation.EXPECTED_RETURN / 12
+    hits = [0] * len(inputs)
+    for _ in range(paths):
+        balances = [goal['current_amount'] for goal in inputs]
+        level = max(rng.gauss(1, goal_simulation.CONTRIBUTION_VOLATILITY), 0)
+        for month in range(max(goal['months'] for goal in inputs)):
+            growth = 1 + rng.gauss(mu, sigma)
+            for i, goal in enumerate(inputs):
+                if month < goal['months']:
+                    balances[i] = balances[i] * growth + goal['monthly_contribution'] * level
+        for i, goal in enumerate(inputs):
+            hits[i] += balances[i] >= goal['target_amount']
+    return [hit / paths for hit in hits]
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--paths', type=int, default=10000)
+    parser.add_argument('--goals', type=int, default=20)
+    parser.add_argument('--horizon', type=int, default=120, help='months to the furthest deadline')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--loop-paths', type=int, default=200, help='paths timed for the Python loop')
+    args = parser.parse_args()
+
+    inputs = goals(args.goals, args.horizon)
+    rows = [
+        ('numpy', timed(lambda: goal_simulation._simulate(
+            tuple((g['current_amount'], g['target_amount'], g['months'], g['monthly_contribution']) for g in inputs),
+            args.paths, goal_simulation.EXPECTED_RETURN, goal_simulation.VOLATILITY), args.repeat)),
+        ('numpy (memoized)', timed(lambda: goal_simulation.simulate(inputs, args.paths), args.repeat)),
+        ('python loop', timed(lambda: loop_simulation(inputs, args.loop_paths), 1) * args.paths / args.loop_paths)
+    ]
+
+    print(f'{args.paths} paths x {args.goals} goals, furthest deadline in {args.horizon} months')
+    for name, median in rows:
+        print(f'{name:>18} {median:>10.2f}ms')
+    print('(python loop extrapolated from', args.loop_paths, 'paths)')
+
+
+if __name__ == '__main__':
+    main()
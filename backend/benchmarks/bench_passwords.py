@@ -0,0 +1,73 @@
+"""Password hashing inline vs. on the hashing process pool.
+
+--concurrency client threads run --logins password verifications in total while one
+more thread repeatedly serializes a dashboard-sized JSON payload, standing in for the
+cheap reads served by the same worker. Login throughput and the p50/p99 latency of
+the concurrent reads are reported per mode; inline hashing holds the GIL and stalls them.
+
+Usage (from the backend directory; MongoDB is not needed):
+    python -m benchmarks.bench_passwords --logins 64 --concurrency 8
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import passwords
+from benchmarks.bench_fanout import percentile
+
+PAYLOAD = {
+    'transactions': [
+        {'id': str(i), 'description': f'Transaction {i}', 'amount': i * 1.5, 'category': 'Food', 'type': 'expense'}
+        for i in range(200)
+    ]
+}
+
+
+def run(workers, logins, concurrency):
+    passwords.configure_hash_pool(workers=workers, queue_limit=max(logins, 1))
+    password_hash = passwords.hash_password('benchmark-password')
+
+    read_timings = []
+    stop = threading.Event()
+
+    def reads():
+        while not stop.is_set():
+            start = time.perf_counter()
+            json.dumps(PAYLOAD)
+            read_timings.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.001)
+
+    reader = threading.Thread(target=reads)
+    reader.start()
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as clients:
+            list(clients.map(lambda _: passwords.verify_password(password_hash, 'benchmark-password'), range(logins)))
+    finally:
+        elapsed = time.perf_counter() - started
+        stop.set()
+        reader.join()
+        passwords.shutdown_hash_pool()
+
+    read_timings.sort()
+    return logins / elapsed, percentile(read_timings, 0.5), percentile(read_timings, 0.99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logins', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4], help='hashing processes; 0 is inline')
+    args = parser.parse_args()
+
+    print(f"{'mode':>10} {'logins/s':>10} {'read p50':>10} {'read p99':>10}")
+    for workers in args.workers:
+        throughput, p50, p99 = run(workers, args.logins, args.concurrency)
+        mode = 'inline' if workers <= 0 else f'pool({workers})'
+        print(f'{mode:>10} {throughput:>10.1f} {p50:>8.3f}ms {p99:>8.3f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Transaction search at scale: looking up every query trigram vs. only the rarest ones.
+
+Seeds one user with --rows transactions whose descriptions are drawn from the merchants of
+benchmarks/seed.py, then runs each query --repeat times both ways and reports p50/p99 latency
+and the number of candidate rows the index lookup returns before scoring. Both ways return
+the same results; the rarest-grams lookup also pays for one index count per query gram,
+issued concurrently.
+
+Usage (from the backend directory, with MongoDB running):
+    python -m benchmarks.bench_search --rows 100000 --repeat 20
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import time
+
+import pymongo
+from bson.objectid import ObjectId
+
+import search
+from benchmarks.seed import MERCHANTS
+
+QUERIES = ('amazon', 'amazn mktp', 'starbcks', 'city gym', 'city electric', 'wal', 'netflix com')
+
+BATCH_SIZE = 10000
+
+
+def seed(db, user_id, rows, rng):
+    merchants = [merchant for names in MERCHANTS.values() for merchant in names]
+    now = datetime.datetime.utcnow()
+    batch = []
+    for i in range(rows):
+        description = f'{rng.choice(merchants)} #{rng.randint(1000, 99999)} {rng.choice(["CA", "NY", "TX", "WA"])}'
+        batch.append({
+            'user_id': user_id,
+            'date': now - datetime.timedelta(minutes=i),
+            'description': description,
+            'amount': round(rng.uniform(1, 500), 2),
+            'type': 'expense',
+            search.SEARCH_FIELD: search.description_grams(description)
+        })
+        if len(batch) >= BATCH_SIZE:
+            db.transactions.insert_many(batch)
+            batch = []
+    if batch:
+        db.transactions.insert_many(batch)
+
+
+# The lookup before candidates were narrowed: any row holding any query gram
+def any_gram_search(collection, user_id, query):
+    grams = search.query_grams(query)
+    pipeline = search.search_pipeline(user_id, query)
+    pipeline[0]['$match'][search.SEARCH_FIELD] = {'$in': grams}
+    return list(collection.aggregate(pipeline)), grams
+
+
+def rarest_gram_search(collection, user_id, query):
+    grams = search.query_grams(query)
+    counts = search.gram_counts(collection, user_id, grams)
+    pipeline = search.search_pipeline(user_id, query, counts=counts)
+    return list(collection.aggregate(pipeline)), search.lookup_grams(grams, counts)
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[max(int(len(timings) * 0.99) - 1, 0)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--database', default='finfine_bench')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.mongo_uri)
+    db = client[args.database]
+    db.transactions.create_index([('user_id', 1), (search.SEARCH_FIELD, 1)])
+
+    user_id = ObjectId()
+    seed(db, user_id, args.rows, random.Random(args.seed))
+
+    print(f"{'query':>14} {'strategy':>10} {'candidates':>11} {'p50':>10} {'p99':>10}")
+    try:
+        for query in QUERIES:
+            for name, strategy in (('any', any_gram_search), ('rarest', rarest_gram_search)):
+                _, lookup = strategy(db.transactions, user_id, query)
+                candidates = db.transactions.count_documents(
+                    {'user_id': user_id, search.SEARCH_FIELD: {'$in': lookup}}
+                )
+                p50, p99 = measure(lambda: strategy(db.transactions, user_id, query), args.repeat)
+                print(f'{query:>14} {name:>10} {candidates:>11} {p50:>8.2f}ms {p99:>8.2f}ms')
+    finally:
+        client.drop_database(args.database)
+
+
+if __name__ == '__main__':
+    main()
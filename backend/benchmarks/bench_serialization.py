@@ -0,0 +1,88 @@
+"""Serialize transaction pages: per-row formatting + stock JSON vs. schema rows + the app's JSON provider.
+
+'legacy' rebuilds each row with str(_id) and isoformat() and encodes it the way Flask's
+default provider does (sorted keys). 'schema' builds rows with schemas.TRANSACTION and lets
+the provider convert ObjectId and datetime; it is timed with both the standard library
+provider and orjson (when installed).
+
+Usage (from the backend directory; MongoDB is not needed):
+    python -m benchmarks.bench_serialization --rows 1000 100000
+"""
+import argparse
+import datetime
+import json
+import statistics
+import time
+
+from bson.objectid import ObjectId
+from flask import Flask
+
+import schemas
+
+
+def documents(rows):
+    now = datetime.datetime.utcnow()
+    return [
+        {
+            '_id': ObjectId(),
+            'user_id': ObjectId(),
+            'date': now - datetime.timedelta(minutes=i),
+            'description': f'Transaction {i}',
+            'amount': round(10 + i * 0.37, 2),
+            'category': ('Food', 'Rent', 'Travel', 'Salary')[i % 4],
+            'type': 'income' if i % 4 == 3 else 'expense',
+            'created_at': now
+        }
+        for i in range(rows)
+    ]
+
+
+# The row builder and encoder the transactions endpoint used before schemas
+def legacy(transactions):
+    rows = [{
+        'id': str(transaction['_id']),
+        'date': transaction.get('date', datetime.datetime.utcnow()).isoformat(),
+        'description': transaction.get('description', ''),
+        'amount': transaction.get('amount', 0),
+        'category': transaction.get('category', 'Uncategorized'),
+        'type': transaction.get('type', 'expense')
+    } for transaction in transactions]
+    return json.dumps({'transactions': rows}, sort_keys=True)
+
+
+def with_provider(provider):
+    return lambda transactions: provider.dumps({'transactions': schemas.TRANSACTION.dump_many(transactions)})
+
+
+def measure(fn, transactions, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(transactions)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    variants = {'legacy': legacy, 'schema+stdlib': with_provider(schemas.StdlibJSONProvider(app))}
+    if schemas.orjson is not None:
+        variants['schema+orjson'] = with_provider(schemas.OrjsonProvider(app))
+
+    print(f"{'rows':>8} {'variant':>14} {'median':>12} {'speedup':>8}")
+    for rows in args.rows:
+        transactions = documents(rows)
+        baseline = None
+        for name, fn in variants.items():
+            median = measure(fn, transactions, args.repeat)
+            baseline = baseline or median
+            print(f'{rows:>8} {name:>14} {median:>10.2f}ms {baseline / median:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
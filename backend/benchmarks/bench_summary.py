@@ -0,0 +1,95 @@
+"""Compare the single-aggregation dashboard summary with the previous four-query path.
+
+Usage (from the backend directory, with MongoDB running):
+    python -m benchmarks.bench_summary --sizes 10 100 1000 --repeat 50
+"""
+import argparse
+import datetime
+import os
+import statistics
+import time
+
+import pymongo
+from bson.objectid import ObjectId
+
+from dashboard import fetch_summary
+
+
+# The code path get_dashboard_summary used before the aggregation rewrite
+def legacy_summary(db, user_id):
+    accounts = list(db.accounts.find({'user_id': user_id}))
+    total_balance = sum(account.get('balance', 0) for account in accounts)
+
+    recent_transactions = list(db.transactions.find({'user_id': user_id}).sort('date', -1).limit(5))
+
+    budgets = list(db.budgets.find({'user_id': user_id}))
+    total_budget = sum(budget.get('amount', 0) for budget in budgets)
+    spent = sum(budget.get('spent', 0) for budget in budgets)
+
+    goals = list(db.goals.find({'user_id': user_id}))
+    goals_total = sum(goal.get('target_amount', 0) for goal in goals)
+    goals_current = sum(goal.get('current_amount', 0) for goal in goals)
+
+    return total_balance, recent_transactions, total_budget, spent, goals_total, goals_current
+
+
+def seed(db, user_id, size):
+    now = datetime.datetime.utcnow()
+    db.accounts.insert_many([
+        {'user_id': user_id, 'name': f'Account {i}', 'type': 'Cash', 'balance': 100.0 + i, 'currency': 'USD'}
+        for i in range(size)
+    ])
+    db.transactions.insert_many([
+        {'user_id': user_id, 'date': now - datetime.timedelta(hours=i), 'description': f'Transaction {i}',
+         'amount': 10.0 + i % 50, 'category': 'Food', 'type': 'expense'}
+        for i in range(size * 10)
+    ])
+    db.budgets.insert_many([
+        {'user_id': user_id, 'category': f'Category {i}', 'amount': 500, 'spent': i % 500, 'period': 'monthly'}
+        for i in range(size)
+    ])
+    db.goals.insert_many([
+        {'user_id': user_id, 'name': f'Goal {i}', 'target_amount': 10000, 'current_amount': i * 10,
+         'deadline': now + datetime.timedelta(days=365), 'priority': 'medium'}
+        for i in range(size)
+    ])
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--database', default='finfine_bench')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.mongo_uri)
+    db = client[args.database]
+    for name in ('accounts', 'transactions', 'budgets', 'goals'):
+        db[name].create_index('user_id')
+    db.transactions.create_index([('user_id', 1), ('date', -1)])
+
+    print(f"{'documents':>10} {'legacy p50':>12} {'legacy p99':>12} {'facet p50':>12} {'facet p99':>12}")
+    try:
+        for size in args.sizes:
+            user_id = ObjectId()
+            seed(db, user_id, size)
+            legacy_p50, legacy_p99 = measure(lambda: legacy_summary(db, user_id), args.repeat)
+            facet_p50, facet_p99 = measure(lambda: fetch_summary(db, user_id), args.repeat)
+            print(f'{size:>10} {legacy_p50:>10.2f}ms {legacy_p99:>10.2f}ms {facet_p50:>10.2f}ms {facet_p99:>10.2f}ms')
+    finally:
+        client.drop_database(args.database)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+"""Load test of the main API routes at fixed concurrency, reported as JSON.
+
+Each scenario sends --requests requests from each --concurrency number of client threads
+in turn, as users of a seeded population (see benchmarks/seed.py). Throughput, latency
+percentiles, error rate and status counts are reported per scenario and concurrency, with the
+requests shed by admission control (503) also counted on their own as 'shed'. With
+--baseline, the run is compared with an earlier report and the command exits with status 1
+when throughput or p95 latency regressed by more than --max-regression, or when the error
+rate rose by more than --max-error-increase (a fraction of requests).
+
+Targets:
+    --url http://localhost:5000   a running server, over HTTP with keep-alive connections
+    (default)                     the app in this process via Flask's test client, on --mongo-uri/--database
+    --in-memory                   the app in this process on mongomock, seeded with --users x --transactions
+
+--in-memory checks the suite itself rather than measuring anything: mongomock is not thread-safe,
+so keep it to --concurrency 1, and it lacks $unionWith, so the summary scenario fails there.
+
+Usage (from the backend directory):
+    python -m benchmarks.seed --users 10000 --transactions 5000 --drop
+    python -m benchmarks.load_test --concurrency 1 8 32 --output report.json
+    python -m benchmarks.load_test --in-memory --users 20 --transactions 500 --requests 100
+    python -m benchmarks.load_test --baseline report.json --max-regression 0.2 --max-error-increase 0.01
+
+Start a server under test with a large LOGIN_BURST, or the login scenario measures the rate limiter,
+and with ADMISSION_<CLASS>_CONCURRENCY=0 unless shedding is what is being measured. In-process
+targets set both unless they are already set.
+"""
+import argparse
+import datetime
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import seed as seeding
+
+THEMES = ('light', 'dark')
+
+CATEGORIES = seeding.CATEGORIES['expense']
+
+# Route classes admission control limits by default (see admission.py)
+ADMISSION_CLASSES = ('AUTH', 'IMPORT', 'EXPORT', 'SIMULATION', 'DASHBOARD')
+
+
+class HttpTarget:
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.name = url
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self._local = threading.local()
+
+    def request(self, method, path, token=None, body=None):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        try:
+            connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None
+            return 0, b''
+
+
+class AppTarget:
+    def __init__(self, app, name):
+        self.app = app
+        self.name = name
+        self._local = threading.local()
+
+    def request(self, method, path, token=None, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_data()
+
+
+def _json(body):
+    try:
+        return json.loads(body)
+    except ValueError:
+        return {}
+
+
+# Scenarios: (target, session, rng) -> status code. A session is one logged-in user and
+# keeps per-user state between requests, such as the position of a cursor walk.
+def login(target, session, rng):
+    status, _ = target.request('POST', '/api/login', body={'email': session['email'], 'password': session['password']})
+    return status
+
+
+def summary(target, session, rng):
+    return target.request('GET', '/api/dashboard/summary', session['token'])[0]
+
+
+def transactions(target, session, rng):
+    return target.request('GET', '/api/dashboard/transactions?limit=20', session['token'])[0]
+
+
+def transactions_deep(target, session, rng):
+    skip = rng.randrange(0, session['deep_offset'], 20)
+    return target.request('GET', f'/api/dashboard/transactions?limit=20&skip={skip}', session['token'])[0]
+
+
+def transactions_cursor(target, session, rng):
+    # Walks up to cursor_depth pages, then starts again from the first one
+    cursor = session.get('cursor') or ''
+    status, body = target.request('GET', f'/api/dashboard/transactions?limit=20&cursor={cursor}', session['token'])
+    session['pages'] = session.get('pages', 0) + 1
+    next_cursor = _json(body).get('next_cursor') if status == 200 else None
+    if not next_cursor or session['pages'] >= session['cursor_depth']:
+        next_cursor, session['pages'] = None, 0
+    session['cursor'] = next_cursor
+    return status
+
+
+def transactions_filtered(target, session, rng):
+    category = urllib.parse.quote(rng.choice(CATEGORIES))
+    return target.request(
+        'GET', f'/api/dashboard/transactions?limit=20&type=expense&category={category}', session['token']
+    )[0]
+
+
+def settings_get(target, session, rng):
+    return target.request('GET', '/api/settings', session['token'])[0]
+
+
+def settings_patch(target, session, rng):
+    return target.request('PATCH', '/api/settings', session['token'], {'theme': rng.choice(THEMES)})[0]
+
+
+SCENARIOS = {
+    'login': login,
+    'summary': summary,
+    'transactions': transactions,
+    'transactions_deep': transactions_deep,
+    'transactions_cursor': transactions_cursor,
+    'transactions_filtered': transactions_filtered,
+    'settings_get': settings_get,
+    'settings_patch': settings_patch
+}
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run(target, scenario, sessions, concurrency, requests, seed):
+    # Each client thread owns its sessions, so session state is never shared between threads
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        owned = sessions[index::concurrency] or [dict(rng.choice(sessions))]
+        results = []
+        for i in range(index, requests, concurrency):
+            session = owned[i // concurrency % len(owned)]
+            start = time.perf_counter()
+            status = scenario(target, session, rng)
+            results.append(((time.perf_counter() - start) * 1000, status))
+        return results
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        results = [result for batch in clients.map(client, range(concurrency)) for result in batch]
+    elapsed = time.perf_counter() - started
+
+    timings = sorted(timing for timing, _ in results)
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    errors = sum(count for status, count in statuses.items() if not 200 <= int(status) < 400)
+    return {
+        'requests': len(results),
+        'duration_seconds': round(elapsed, 3),
+        'throughput': round(len(results) / elapsed, 1),
+        'latency_ms': {
+            'p50': round(percentile(timings, 0.50), 2),
+            'p95': round(percentile(timings, 0.95), 2),
+            'p99': round(percentile(timings, 0.99), 2),
+            'mean': round(sum(timings) / len(timings), 2),
+            'max': round(timings[-1], 2)
+        },
+        'errors': errors,
+        'error_rate': round(errors / len(results), 4),
+        'shed': statuses.get('503', 0),
+        'statuses': statuses
+    }
+
+
+def open_sessions(target, count, users, password, deep_offset, cursor_depth):
+    sessions = []
+    for index in random.Random(0).sample(range(users), min(count, users)):
+        email = seeding.email(index)
+        status, body = target.request('POST', '/api/login', body={'email': email, 'password': password})
+        if status != 200:
+            raise SystemExit(f'Could not log in as {email} ({status}); seed the database first')
+        sessions.append({
+            'email': email,
+            'password': password,
+            'token': _json(body)['token'],
+            'deep_offset': deep_offset,
+            'cursor_depth': cursor_depth
+        })
+    return sessions
+
+
+def error_rate(result):
+    # Reports written before error_rate was added only have the error count
+    return result.get('error_rate', result['errors'] / result['requests'])
+
+
+# Regressions of this report against a baseline: lower throughput or higher p95 beyond the
+# tolerance, or an error rate higher by more than error_tolerance. A faster run that fails
+# more requests is not an improvement.
+def regressions(report, baseline, tolerance, error_tolerance=0.01):
+    previous = {(result['scenario'], result['concurrency']): result for result in baseline['results']}
+    found = []
+    for result in report['results']:
+        before = previous.get((result['scenario'], result['concurrency']))
+        if before is None:
+            continue
+        if result['throughput'] < before['throughput'] * (1 - tolerance):
+            found.append(f"{result['scenario']} x{result['concurrency']}: throughput "
+                         f"{before['throughput']} -> {result['throughput']} req/s")
+        if result['latency_ms']['p95'] > before['latency_ms']['p95'] * (1 + tolerance):
+            found.append(f"{result['scenario']} x{result['concurrency']}: p95 "
+                         f"{before['latency_ms']['p95']} -> {result['latency_ms']['p95']} ms")
+        if error_rate(result) > error_rate(before) + error_tolerance:
+            found.append(f"{result['scenario']} x{result['concurrency']}: error rate "
+                         f"{error_rate(before):.2%} -> {error_rate(result):.2%}")
+    return found
+
+
+def in_process_target(args):
+    # Login throttling would otherwise turn most of the login scenario into 429s, and the
+    # per-worker admission limits, sized for a server's threads, would shed most requests
+    # beyond a concurrency of 2 with 503s
+    os.environ.setdefault('LOGIN_BURST', str(10 ** 9))
+    for name in ADMISSION_CLASSES:
+        os.environ.setdefault(f'ADMISSION_{name}_CONCURRENCY', '0')
+
+    if args.in_memory:
+        try:
+            import mongomock
+        except ImportError:
+            raise SystemExit('--in-memory needs mongomock: pip install mongomock')
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+        # mongomock ignores partial filters, so the partial unique indexes would reject the seed;
+        # it scans collections whatever the indexes, so they are not created at all
+        import indexes
+        indexes.ensure_indexes_in_background = lambda db: None
+        indexes.ensure_unique_indexes = lambda db: None
+        os.environ['MONGO_URI'] = 'mongodb://localhost:27017/finfine_bench'
+    else:
+        os.environ['MONGO_URI'] = f"{args.mongo_uri.rstrip('/')}/{args.database}"
+
+    import app as app_module
+
+    if args.in_memory:
+        seeding.seed(app_module.db, args.users, args.transactions, password=args.password, seed=args.seed)
+    name = 'in-memory' if args.in_memory else f'in-process:{args.database}'
+    return AppTarget(app_module.app, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='base URL of a running server')
+    parser.add_argument('--in-memory', action='store_true', help='run against mongomock instead of MongoDB')
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--database', default='finfine_bench')
+    parser.add_argument('--users', type=int, default=1000, help='users in the seeded population')
+    parser.add_argument('--transactions', type=int, default=1000, help='transactions per user (--in-memory seeding)')
+    parser.add_argument('--password', default=seeding.PASSWORD)
+    parser.add_argument('--sessions', type=int, default=50, help='users logged in for the run')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=1000, help='requests per scenario and concurrency')
+    parser.add_argument('--deep-offset', type=int, default=2000, help='largest skip of the deep page scenario')
+    parser.add_argument('--cursor-depth', type=int, default=50, help='pages per cursor walk')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='earlier JSON report to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    parser.add_argument('--max-error-increase', type=float, default=0.01,
+                        help='largest rise of the error rate over the baseline, as a fraction of requests')
+    args = parser.parse_args()
+
+    target = HttpTarget(args.url) if args.url else in_process_target(args)
+    sessions = open_sessions(target, args.sessions, args.users, args.password, args.deep_offset, args.cursor_depth)
+
+    results = []
+    for name in args.scenarios:
+        for concurrency in args.concurrency:
+            result = run(target, SCENARIOS[name], sessions, concurrency, args.requests, args.seed)
+            results.append({'scenario': name, 'concurrency': concurrency, **result})
+            print(f"{name:>22} x{concurrency:<4} {result['throughput']:>9.1f} req/s  "
+                  f"p50 {result['latency_ms']['p50']:>8.2f}ms  p95 {result['latency_ms']['p95']:>8.2f}ms  "
+                  f"p99 {result['latency_ms']['p99']:>8.2f}ms  errors {result['errors']} ({result['error_rate']:.2%}, "
+                  f"{result['shed']} shed)",
+                  file=sys.stderr)
+
+    report = {
+        'started_at': datetime.datetime.utcnow().isoformat(),
+        'target': target.name,
+        'config': {
+            'users': args.users,
+            'sessions': len(sessions),
+            'requests': args.requests,
+            'deep_offset': args.deep_offset,
+            'cursor_depth': args.cursor_depth,
+            'seed': args.seed
+        },
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.max_regression, args.max_error_increase)
+        for regression in found:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""Seed a database with a synthetic user population for load tests.
+
+Every user gets accounts, transactions spread over the last --days days, budgets, goals and
+settings, plus the derived rollups and budget spend. Everything but the ids is drawn from
+--seed, with dates relative to the time of seeding, so runs with the same arguments produce
+the same population. All users share the password --password and log in as
+user<N>@bench.local.
+
+Usage (from the backend directory, with MongoDB running):
+    python -m benchmarks.seed --users 10000 --transactions 5000 --drop
+"""
+import argparse
+import datetime
+import os
+import random
+import time
+
+import pymongo
+from bson.objectid import ObjectId
+from werkzeug.security import generate_password_hash
+
+import passwords
+import provisioning
+import rollups
+import search
+import spending
+from indexes import ensure_indexes
+
+PASSWORD = 'benchmark-password'
+
+# Documents per insert_many
+BATCH_SIZE = 10000
+
+CATEGORIES = {
+    'expense': ['Food', 'Dining', 'Transportation', 'Entertainment', 'Shopping', 'Utilities', 'Housing', 'Health'],
+    'income': ['Income']
+}
+
+MERCHANTS = {
+    'Food': ['WHOLE FOODS', 'TRADER JOE', 'SAFEWAY', 'KROGER'],
+    'Dining': ['STARBUCKS', 'CHIPOTLE', 'DOORDASH', 'CORNER CAFE'],
+    'Transportation': ['UBER TRIP', 'LYFT RIDE', 'SHELL OIL', 'CITY TRANSIT'],
+    'Entertainment': ['NETFLIX.COM', 'SPOTIFY', 'CINEMA CITY', 'STEAM GAMES'],
+    'Shopping': ['AMAZON MKTP', 'TARGET', 'WALMART', 'EBAY'],
+    'Utilities': ['COMCAST', 'VERIZON', 'CITY ELECTRIC', 'WATER BILL'],
+    'Housing': ['RENT PAYMENT', 'MORTGAGE'],
+    'Health': ['CVS PHARMACY', 'WALGREENS', 'CITY GYM'],
+    'Income': ['ACME PAYROLL', 'INTEREST PAID']
+}
+
+GOAL_NAMES = ['Emergency Fund', 'Vacation', 'New Car', 'House Deposit', 'Retirement', 'Education']
+
+
+def email(index):
+    return f'user{index}@bench.local'
+
+
+def _user_documents(rng, index, user_id, password_hash, now, population):
+    account_ids = [ObjectId() for _ in range(population['accounts'])]
+    accounts = [{
+        '_id': account_id,
+        'user_id': user_id,
+        'name': 'Cash Account' if i == 0 else f'Account {i}',
+        'type': rng.choice(['Cash', 'Checking', 'Savings', 'Credit Card']),
+        'balance': round(rng.uniform(-2000, 20000), 2),
+        'currency': 'USD',
+        'created_at': now,
+        **({'is_default': True} if i == 0 else {})
+    } for i, account_id in enumerate(account_ids)]
+
+    transactions = []
+    for i in range(population['transactions']):
+        transaction_type = 'income' if rng.random() < 0.1 else 'expense'
+        category = rng.choice(CATEGORIES[transaction_type])
+        description = f'{rng.choice(MERCHANTS[category])} #{rng.randint(1000, 99999)}'
+        transactions.append({
+            'user_id': user_id,
+            'account_id': rng.choice(account_ids),
+            'date': now - datetime.timedelta(seconds=rng.randint(0, population['days'] * 86400)),
+            'description': description,
+            'amount': round(rng.lognormvariate(3.5, 1) if transaction_type == 'expense' else rng.uniform(500, 5000), 2),
+            # A share of rows arrives uncategorized, as from statement imports
+            'category': category if rng.random() < 0.8 else 'Uncategorized',
+            'type': transaction_type,
+            'search_grams': search.description_grams(description),
+            'created_at': now
+        })
+
+    budgets = [{
+        'user_id': user_id,
+        'category': category,
+        'amount': rng.choice([100, 200, 500, 1000]),
+        'spent': 0,
+        'period': 'monthly'
+    } for category in rng.sample(CATEGORIES['expense'], min(population['budgets'], len(CATEGORIES['expense'])))]
+
+    goals = [{
+        'user_id': user_id,
+        'name': rng.choice(GOAL_NAMES),
+        'target_amount': rng.choice([1000, 5000, 10000, 50000]),
+        'current_amount': round(rng.uniform(0, 5000), 2),
+        'deadline': now + datetime.timedelta(days=rng.randint(30, 3650)),
+        'priority': rng.choice(['high', 'medium', 'low'])
+    } for _ in range(population['goals'])]
+
+    user = {
+        '_id': user_id,
+        'name': f'Bench User {index}',
+        'email': email(index),
+        'password': password_hash,
+        'role': 'Standard User',
+        'avatar': 'BU',
+        'created_at': now
+    }
+    return user, accounts, transactions, budgets, goals, provisioning.default_settings(user_id, now)
+
+
+def seed(db, users, transactions, accounts=3, budgets=5, goals=3, days=365, password=PASSWORD, seed=0,
+         progress=False):
+    population = {'transactions': transactions, 'accounts': accounts, 'budgets': budgets, 'goals': goals, 'days': days}
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    # One hash for everyone: hashing is deliberately slow and would dominate the seeding time
+    password_hash = generate_password_hash(password, method=passwords.PASSWORD_HASH_METHOD)
+
+    pending = {name: [] for name in ('users', 'accounts', 'transactions', 'budgets', 'goals', 'settings')}
+
+    def flush(name):
+        if pending[name]:
+            db[name].insert_many(pending[name], ordered=False)
+            if name == 'transactions':
+                rollups.apply_transactions(db, pending[name])
+            pending[name] = []
+
+    started = time.perf_counter()
+    for index in range(users):
+        user_id = ObjectId()
+        documents = _user_documents(rng, index, user_id, password_hash, now, population)
+        for name, docs in zip(pending, documents):
+            pending[name].extend(docs if isinstance(docs, list) else [docs])
+            if len(pending[name]) >= BATCH_SIZE:
+                flush(name)
+        if progress and (index + 1) % 1000 == 0:
+            print(f'{index + 1} users seeded ({time.perf_counter() - started:.0f}s)')
+
+    for name in pending:
+        flush(name)
+    spending.reconcile(db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--database', default='finfine_bench')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--transactions', type=int, default=1000, help='transactions per user')
+    parser.add_argument('--accounts', type=int, default=3, help='accounts per user')
+    parser.add_argument('--budgets', type=int, default=5, help='budgets per user')
+    parser.add_argument('--goals', type=int, default=3, help='goals per user')
+    parser.add_argument('--days', type=int, default=365, help='days of transaction history')
+    parser.add_argument('--password', default=PASSWORD)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--drop', action='store_true', help='drop the database first')
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.mongo_uri)
+    if args.drop:
+        client.drop_database(args.database)
+    db = client[args.database]
+    ensure_indexes(db)
+
+    started = time.perf_counter()
+    seed(db, args.users, args.transactions, args.accounts, args.budgets, args.goals, args.days, args.password,
+         args.seed, progress=True)
+    print(f'Seeded {args.users} users x {args.transactions} transactions into {args.database} '
+          f'in {time.perf_counter() - started:.0f}s')
+
+
+if __name__ == '__main__':
+    main()
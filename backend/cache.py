@@ -0,0 +1,253 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Bounded, thread-safe LRU cache with a per-entry time-to-live. on_evict, when given, is
+# called with (key, value) for every entry removed by eviction, expiry or delete(), outside
+# the cache's lock so it may use other locks freely.
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _removed(self, entries):
+        if self.on_evict:
+            for key, (value, _) in entries:
+                self.on_evict(key, value)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+
+            del self._data[key]
+            self.misses += 1
+        self._removed([(key, entry)])
+        return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+
+        evicted = []
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False))
+                self.evictions += 1
+        self._removed(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is None:
+            return False
+        self._removed([(key, entry)])
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[1] > time.monotonic()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+# Cache of verified JWT -> user document, so token_required skips the users lookup.
+# The tokens of each user are indexed for invalidate_user; the index holds exactly the
+# tokens still in the cache, since evicted and expired ones are removed from it as they go.
+class AuthCache:
+    def __init__(self, maxsize=10000, ttl=60):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl, on_evict=self._forget)
+        self._tokens_by_user = {}
+        # Reentrant: the evictions caused by set() call _forget on the same thread
+        self._lock = threading.RLock()
+
+    def _forget(self, token, user):
+        user_id = str(user['_id'])
+        with self._lock:
+            tokens = self._tokens_by_user.get(user_id)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._tokens_by_user[user_id]
+
+    def get(self, token):
+        return self._cache.get(token)
+
+    def set(self, token, user, token_exp=None):
+        # Never keep an entry past the expiry of the token itself
+        ttl = self._cache.ttl
+        if token_exp is not None:
+            ttl = min(ttl, token_exp - time.time())
+        if ttl <= 0:
+            return
+
+        # Indexed and cached under one lock, so invalidate_user never sees one without the other
+        with self._lock:
+            self._tokens_by_user.setdefault(str(user['_id']), set()).add(token)
+            self._cache.set(token, user, ttl=ttl)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            tokens = self._tokens_by_user.pop(str(user_id), set())
+        for token in tokens:
+            self._cache.delete(token)
+
+    def clear(self):
+        with self._lock:
+            self._tokens_by_user.clear()
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+# Response cache backends share get/set/set_if_greater/stats so ResponseCache can use either one
+class LocalCacheBackend:
+    name = 'local'
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._cache.set(key, value, ttl=ttl)
+
+    # Store an integer unless the stored one is already greater; returns whether it was stored
+    def set_if_greater(self, key, value, ttl=None):
+        with self._lock:
+            current = self._cache.get(key)
+            if current is not None and int(current) > value:
+                return False
+            self._cache.set(key, value, ttl=ttl)
+            return True
+
+    def stats(self):
+        stats = self._cache.stats()
+        return {'size': stats['size'], 'evictions': stats['evictions']}
+
+
+# Shared backend for running several worker processes; needs the optional redis package
+class RedisCacheBackend:
+    name = 'redis'
+
+    # Compare and set in one server-side step, so racing workers cannot store an older value last
+    SET_IF_GREATER = """
+    local current = redis.call('GET', KEYS[1])
+    if current and tonumber(current) > tonumber(ARGV[1]) then
+        return 0
+    end
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    return 1
+    """
+
+    def __init__(self, url, ttl=60, prefix='finfine:'):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._set_if_greater = self._redis.register_script(self.SET_IF_GREATER)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        return self._redis.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        self._redis.set(self.prefix + key, value, ex=max(1, int(ttl or self.ttl)))
+
+    def set_if_greater(self, key, value, ttl=None):
+        return bool(self._set_if_greater(keys=[self.prefix + key], args=[value, max(1, int(ttl or self.ttl))]))
+
+    def stats(self):
+        info = self._redis.info('stats')
+        return {'size': self._redis.dbsize(), 'evictions': info.get('evicted_keys', 0)}
+
+
+# Caches serialized GET responses per user. Keys include the user's data version,
+# so bumping the version on a write invalidates every cached response of that user.
+class ResponseCache:
+    def __init__(self, backend, version_ttl=5):
+        self.backend = backend
+        self.version_ttl = version_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _version_key(user_id):
+        return f'version:{user_id}'
+
+    def get_version(self, user_id):
+        version = self.backend.get(self._version_key(user_id))
+        return None if version is None else int(version)
+
+    # Versions only move forward: when two writes race, or a read races a write, the older
+    # version is never stored over the newer one
+    def set_version(self, user_id, version):
+        self.backend.set_if_greater(self._version_key(user_id), version, ttl=self.version_ttl)
+
+    @staticmethod
+    def key(user_id, version, path, args):
+        return f'response:{user_id}:{version}:{path}:{args}'
+
+    def get(self, key):
+        body = self.backend.get(key)
+        with self._lock:
+            if body is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return body
+
+    def set(self, key, body):
+        self.backend.set(key, body)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'backend': self.backend.name,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+        stats.update(self.backend.stats())
+        return stats
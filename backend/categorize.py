@@ -0,0 +1,289 @@
+"""Rule-based transaction categorization.
+
+A rule maps a merchant pattern (one or more words) to a category. All patterns of a rule
+set are compiled into a single regular expression shaped like a trie of their characters,
+so a description is matched against every rule in one scan instead of one scan per rule.
+Matches must start and end on word boundaries; the leftmost match wins, and the longest
+pattern wins among matches at the same position. A user's own rules take precedence over
+the global merchant rules. The global payroll and salary rules only apply to income.
+
+Categorize existing uncategorized transactions:  python categorize.py --apply [--user-id <id>]
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+
+import pymongo
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+import rollups
+import spending
+from cache import TTLCache
+from versions import bump_versions
+
+RULES_COLLECTION = 'category_rules'
+
+UNCATEGORIZED = 'Uncategorized'
+
+# Transactions categorized per bulk_write by apply()
+APPLY_BATCH_SIZE = 1000
+
+MAX_PATTERN_LENGTH = 100
+
+# Patterns every user starts with that only apply to income transactions, so that e.g.
+# 'PAYROLL SERVICES FEE' on an expense is not filed as Income
+GLOBAL_INCOME_RULES = {
+    'payroll': 'Income',
+    'salary': 'Income',
+    'direct deposit': 'Income',
+    'interest paid': 'Income'
+}
+
+# Merchant patterns every user starts with
+GLOBAL_RULES = {
+    'whole foods': 'Food',
+    'trader joe': 'Food',
+    'safeway': 'Food',
+    'kroger': 'Food',
+    'aldi': 'Food',
+    'costco': 'Food',
+    'grocery': 'Food',
+    'starbucks': 'Dining',
+    'mcdonald': 'Dining',
+    'chipotle': 'Dining',
+    'doordash': 'Dining',
+    'grubhub': 'Dining',
+    'uber eats': 'Dining',
+    'restaurant': 'Dining',
+    'cafe': 'Dining',
+    'netflix': 'Entertainment',
+    'spotify': 'Entertainment',
+    'hulu': 'Entertainment',
+    'disney plus': 'Entertainment',
+    'steam games': 'Entertainment',
+    'cinema': 'Entertainment',
+    'uber': 'Transportation',
+    'lyft': 'Transportation',
+    'shell oil': 'Transportation',
+    'chevron': 'Transportation',
+    'exxon': 'Transportation',
+    'parking': 'Transportation',
+    'transit': 'Transportation',
+    'amazon': 'Shopping',
+    'amzn mktp': 'Shopping',
+    'target': 'Shopping',
+    'walmart': 'Shopping',
+    'ebay': 'Shopping',
+    'rent': 'Housing',
+    'mortgage': 'Housing',
+    'electric': 'Utilities',
+    'water bill': 'Utilities',
+    'comcast': 'Utilities',
+    'verizon': 'Utilities',
+    'at t': 'Utilities',
+    'pharmacy': 'Health',
+    'cvs': 'Health',
+    'walgreens': 'Health',
+    'gym': 'Health'
+}
+
+_SEPARATOR = re.compile(r'[^a-z0-9]+')
+
+_matchers = TTLCache(maxsize=int(os.getenv('CATEGORY_MATCHER_CACHE_SIZE', 1000)), ttl=3600)
+
+
+class RuleError(ValueError):
+    pass
+
+
+def rules_collection(db):
+    return db[RULES_COLLECTION]
+
+
+# Lowercase words separated by single spaces, the form patterns are stored and looked up in
+def normalize_pattern(pattern):
+    return _SEPARATOR.sub(' ', (pattern or '').lower()).strip()
+
+
+def _trie_regex(node):
+    # node: char -> child node; '' marks the end of a pattern
+    branches = []
+    for char, child in sorted(node.items()):
+        if char:
+            # A space in a pattern matches any run of separators in a description
+            branches.append(('[^a-z0-9]+' if char == ' ' else re.escape(char)) + _trie_regex(child))
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    return f'(?:{body})?' if '' in node else body
+
+
+class Matcher:
+    def __init__(self, rules):
+        # rules: pattern -> category
+        self.rules = {normalize_pattern(pattern): category for pattern, category in rules.items()}
+        self.rules.pop('', None)
+
+        trie = {}
+        for pattern in self.rules:
+            node = trie
+            for char in pattern:
+                node = node.setdefault(char, {})
+            node[''] = True
+        self.regex = re.compile(rf'(?<![a-z0-9])(?:{_trie_regex(trie)})(?![a-z0-9])') if self.rules else None
+
+    def match(self, description):
+        if self.regex is None or not description:
+            return None
+        found = self.regex.search(description.lower())
+        return self.rules[normalize_pattern(found.group())] if found else None
+
+    def match_many(self, descriptions):
+        return [self.match(description) for description in descriptions]
+
+
+GLOBAL_MATCHER = Matcher(GLOBAL_RULES)
+
+GLOBAL_INCOME_MATCHER = Matcher(GLOBAL_INCOME_RULES)
+
+
+class Categorizer:
+    # A user's rules first, then the global ones
+    def __init__(self, user_matcher):
+        self.user_matcher = user_matcher
+
+    def __call__(self, description, transaction_type='expense'):
+        category = self.user_matcher.match(description)
+        if not category and transaction_type == 'income':
+            category = GLOBAL_INCOME_MATCHER.match(description)
+        return category or GLOBAL_MATCHER.match(description)
+
+
+def user_rules(db, user_id):
+    return {
+        rule['pattern']: rule['category']
+        for rule in rules_collection(db).find({'user_id': user_id}, {'pattern': 1, 'category': 1})
+    }
+
+
+# Compiled once per distinct rule set; reading the rules is one indexed query
+def categorizer(db, user_id):
+    rules = user_rules(db, user_id)
+    key = hashlib.sha1(repr(sorted(rules.items())).encode()).hexdigest()
+    matcher = _matchers.get(key)
+    if matcher is None:
+        matcher = Matcher(rules)
+        _matchers.set(key, matcher)
+    return Categorizer(matcher)
+
+
+def add_rule(db, user_id, pattern, category):
+    pattern = normalize_pattern(pattern)
+    if not pattern or len(pattern) > MAX_PATTERN_LENGTH:
+        raise RuleError(f'pattern must contain letters or digits and be at most {MAX_PATTERN_LENGTH} characters')
+    if not isinstance(category, str) or not category.strip():
+        raise RuleError('category is required')
+
+    return rules_collection(db).find_one_and_update(
+        {'user_id': user_id, 'pattern': pattern},
+        {'$set': {'category': category.strip()}},
+        projection={'pattern': 1, 'category': 1},
+        upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+
+
+def _uncategorized(match):
+    return {**match, 'category': {'$in': [None, UNCATEGORIZED]}}
+
+
+def _apply_batch(db, batch):
+    # batch: (transaction, category) pairs. Conditional on still being uncategorized, so a
+    # category set concurrently is never overwritten and never counted twice. Each update also
+    # tags the row with this run's id, so the rows actually modified can be told apart.
+    run_id = ObjectId()
+    ids = [transaction['_id'] for transaction, _ in batch]
+    result = db.transactions.bulk_write([
+        UpdateOne(
+            _uncategorized({'_id': transaction['_id']}),
+            {'$set': {'category': category, 'categorize_run': run_id}}
+        )
+        for transaction, category in batch
+    ], ordered=False)
+    if not result.modified_count:
+        return 0
+
+    # Rows a concurrent write categorized first keep their amounts where that write moved them
+    if result.modified_count < len(batch):
+        modified = {
+            transaction['_id']
+            for transaction in db.transactions.find({'_id': {'$in': ids}, 'categorize_run': run_id}, {'_id': 1})
+        }
+        batch = [(transaction, category) for transaction, category in batch if transaction['_id'] in modified]
+    db.transactions.update_many({'_id': {'$in': ids}, 'categorize_run': run_id}, {'$unset': {'categorize_run': ''}})
+
+    # Move the amounts from Uncategorized to the new categories in the rollups and budgets
+    before = [transaction for transaction, _ in batch]
+    after = [{**transaction, 'category': category} for transaction, category in batch]
+    for module in (rollups, spending):
+        module.apply_transactions(db, before, sign=-1)
+        module.apply_transactions(db, after)
+    return len(batch)
+
+
+# Categorize every uncategorized transaction that a rule matches.
+# Returns the number of transactions categorized per user.
+def apply(db, user_id=None):
+    match = {} if user_id is None else {'user_id': user_id}
+    projection = {'user_id': 1, 'description': 1, 'amount': 1, 'date': 1, 'type': 1, 'category': 1}
+
+    categorized = {}
+    current_user, categorize, batch = None, None, []
+
+    def flush():
+        categorized[current_user] = categorized.get(current_user, 0) + _apply_batch(db, batch)
+        batch.clear()
+
+    # Transactions arrive grouped by user, so each user's rules are compiled once
+    for transaction in db.transactions.find(_uncategorized(match), projection).sort('user_id', 1):
+        if transaction['user_id'] != current_user:
+            if batch:
+                flush()
+            current_user = transaction['user_id']
+            categorize = categorizer(db, current_user)
+
+        category = categorize(transaction.get('description'), transaction.get('type') or 'expense')
+        if category:
+            batch.append((transaction, category))
+        if len(batch) >= APPLY_BATCH_SIZE:
+            flush()
+
+    if batch:
+        flush()
+    return categorized
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--database', default='finfine')
+    parser.add_argument('--apply', action='store_true', help='categorize uncategorized transactions')
+    parser.add_argument('--user-id', help='limit to one user')
+    args = parser.parse_args()
+
+    if not args.apply:
+        parser.print_help()
+        return 1
+
+    db = pymongo.MongoClient(args.mongo_uri)[args.database]
+    categorized = apply(db, ObjectId(args.user_id) if args.user_id else None)
+    bump_versions(db, [user_id for user_id, count in categorized.items() if count])
+    print(f'Categorized {sum(categorized.values())} transactions for {len(categorized)} users')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
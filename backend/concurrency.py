@@ -0,0 +1,39 @@
+"""Shared, bounded thread pool for issuing independent MongoDB reads concurrently."""
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+QUERY_POOL_SIZE = int(os.getenv('QUERY_POOL_SIZE', 16))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def query_pool():
+    # Created on first use rather than at import, so each forked worker gets its own threads
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=QUERY_POOL_SIZE, thread_name_prefix='query')
+    return _pool
+
+
+def shutdown_query_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+# Run the given zero-argument callables concurrently and return their results in order.
+# The first one runs on the calling thread, so a single call never touches the pool.
+def fan_out(*calls):
+    futures = [
+        query_pool().submit(contextvars.copy_context().run, call)
+        for call in calls[1:]
+    ]
+    first = calls[0]()
+    return [first] + [future.result() for future in futures]
@@ -0,0 +1,142 @@
+import datetime
+import os
+
+import schemas
+from concurrency import fan_out
+
+# Number of recent transactions shown on the dashboard summary
+RECENT_TRANSACTIONS_LIMIT = 5
+
+# 'aggregate' reads everything in one round trip; 'fan_out' issues one query per
+# collection concurrently, trading extra round trips for lower single-request latency
+SUMMARY_STRATEGY = os.getenv('SUMMARY_STRATEGY', 'aggregate')
+
+
+def _tagged(source, fields):
+    # Project the response fields and tag each row with its source collection
+    projection = {'_id': 0, '_src': {'$literal': source}, 'id': {'$toString': '$_id'}}
+    projection.update(fields)
+    return {'$project': projection}
+
+
+ACCOUNT_FIELDS = schemas.ACCOUNT.aggregation_fields()
+
+TRANSACTION_FIELDS = schemas.TRANSACTION.aggregation_fields()
+
+BUDGET_FIELDS = schemas.BUDGET.aggregation_fields()
+
+GOAL_FIELDS = schemas.GOAL.aggregation_fields()
+
+
+def _sum_of(source, field):
+    return {'$sum': {'$cond': [{'$eq': ['$_src', source]}, '$' + field, 0]}}
+
+
+def _rows_of(source):
+    return [{'$match': {'_src': source}}, {'$project': {'_src': 0}}]
+
+
+# Build one aggregation that reads all four collections and totals them server-side.
+# It runs against the accounts collection and pulls in the others with $unionWith.
+def summary_pipeline(db, user_id):
+    match = {'$match': {'user_id': user_id}}
+
+    return [
+        match,
+        _tagged('accounts', ACCOUNT_FIELDS),
+        {'$unionWith': {
+            'coll': db.transactions.name,
+            'pipeline': [
+                match,
+                {'$sort': {'date': -1, '_id': -1}},
+                {'$limit': RECENT_TRANSACTIONS_LIMIT},
+                _tagged('transactions', TRANSACTION_FIELDS)
+            ]
+        }},
+        {'$unionWith': {
+            'coll': db.budgets.name,
+            'pipeline': [match, _tagged('budgets', BUDGET_FIELDS)]
+        }},
+        {'$unionWith': {
+            'coll': db.goals.name,
+            'pipeline': [match, _tagged('goals', GOAL_FIELDS)]
+        }},
+        {'$facet': {
+            'accounts': _rows_of('accounts'),
+            'transactions': _rows_of('transactions'),
+            'budgets': _rows_of('budgets'),
+            'goals': _rows_of('goals'),
+            'totals': [{'$group': {
+                '_id': None,
+                'balance': _sum_of('accounts', 'balance'),
+                'budget_total': _sum_of('budgets', 'amount'),
+                'budget_spent': _sum_of('budgets', 'spent'),
+                'goals_total': _sum_of('goals', 'target_amount'),
+                'goals_current': _sum_of('goals', 'current_amount')
+            }}]
+        }}
+    ]
+
+
+def _rows(collection, pipeline):
+    return [{k: v for k, v in row.items() if k != '_src'} for row in collection.aggregate(pipeline)]
+
+
+# Same result as the single aggregation, from four concurrent per-collection queries
+def _fetch_concurrently(db, user_id):
+    match = {'$match': {'user_id': user_id}}
+    accounts, transactions, budgets, goals = fan_out(
+        lambda: _rows(db.accounts, [match, _tagged('accounts', ACCOUNT_FIELDS)]),
+        lambda: _rows(db.transactions, [
+            match,
+            {'$sort': {'date': -1, '_id': -1}},
+            {'$limit': RECENT_TRANSACTIONS_LIMIT},
+            _tagged('transactions', TRANSACTION_FIELDS)
+        ]),
+        lambda: _rows(db.budgets, [match, _tagged('budgets', BUDGET_FIELDS)]),
+        lambda: _rows(db.goals, [match, _tagged('goals', GOAL_FIELDS)])
+    )
+    return {
+        'accounts': accounts,
+        'transactions': transactions,
+        'budgets': budgets,
+        'goals': goals,
+        'totals': [{
+            'balance': sum(account['balance'] for account in accounts),
+            'budget_total': sum(budget['amount'] for budget in budgets),
+            'budget_spent': sum(budget['spent'] for budget in budgets),
+            'goals_total': sum(goal['target_amount'] for goal in goals),
+            'goals_current': sum(goal['current_amount'] for goal in goals)
+        }]
+    }
+
+
+# Fetch the dashboard summary data for a user, by default in a single round trip
+def fetch_summary(db, user_id, strategy=None):
+    if (strategy or SUMMARY_STRATEGY) == 'fan_out':
+        result = _fetch_concurrently(db, user_id)
+    else:
+        result = next(db.accounts.aggregate(summary_pipeline(db, user_id)), None) or {}
+
+    totals = (result.get('totals') or [{}])[0]
+
+    # Dates are left as datetimes; the JSON provider writes them out
+    transactions = result.get('transactions', [])
+    for transaction in transactions:
+        transaction['date'] = transaction.get('date') or datetime.datetime.utcnow()
+
+    goals = result.get('goals', [])
+    for goal in goals:
+        goal['deadline'] = goal.get('deadline') or None
+
+    return {
+        'accounts': result.get('accounts', []),
+        'transactions': transactions,
+        'budgets': result.get('budgets', []),
+        'goals': goals,
+        'total_balance': totals.get('balance', 0),
+        'total_budget': totals.get('budget_total', 0),
+        'spent': totals.get('budget_spent', 0),
+        'goals_total': totals.get('goals_total', 0),
+        'goals_current': totals.get('goals_current', 0)
+    }
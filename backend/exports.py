@@ -0,0 +1,78 @@
+"""Streaming serializers for exporting a user's transaction history."""
+import csv
+import io
+import json
+
+import schemas
+from pagination import TRANSACTION_SORT
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+# The fields and defaults of the API's transactions (schemas.TRANSACTION)
+EXPORT_FIELDS = ['id', *schemas.TRANSACTION.fields]
+
+# Only the exported fields are sent over the wire
+EXPORT_PROJECTION = schemas.TRANSACTION.projection
+
+# Documents fetched from MongoDB per getMore
+EXPORT_BATCH_SIZE = 1000
+
+# Serialized rows are buffered into chunks of roughly this many characters
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def export_cursor(collection, query):
+    return collection.find(query, EXPORT_PROJECTION).sort(TRANSACTION_SORT).batch_size(EXPORT_BATCH_SIZE)
+
+
+def _row(transaction):
+    # CSV has no JSON provider to write them, so the id and date become strings here for both formats
+    row = schemas.TRANSACTION.dump(transaction)
+    row['id'] = str(row['id'])
+    row['date'] = row['date'].isoformat()
+    return row
+
+
+def _chunked(lines):
+    # Join small lines into larger chunks so the server writes fewer, bigger packets
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def ndjson_lines(transactions):
+    for transaction in transactions:
+        yield json.dumps(_row(transaction)) + '\n'
+
+
+def csv_lines(transactions):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS)
+
+    writer.writeheader()
+    # Send the header straight away so the first byte does not wait for a full chunk
+    yield out.getvalue()
+
+    for transaction in transactions:
+        out.seek(0)
+        out.truncate()
+        writer.writerow(_row(transaction))
+        yield out.getvalue()
+
+
+def stream_export(transactions, export_format):
+    lines = csv_lines(transactions) if export_format == 'csv' else ndjson_lines(transactions)
+    if export_format == 'csv':
+        yield next(lines)
+    yield from _chunked(lines)
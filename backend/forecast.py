@@ -0,0 +1,305 @@
+"""Recurring transaction detection and a day-by-day cash-flow projection.
+
+Transactions are grouped by type and normalized description. A full analysis loads the
+user's history once as NumPy arrays and computes every group's count, amount and interval
+statistics in a single sorted pass. The statistics are stored one document per group in
+`recurring_series`, and the user's data version and last analyzed transaction id in
+`recurring_series_state`. While the data version is unchanged, requests read the stored
+groups and no transactions; after a write, only transactions newer than the last analyzed
+id are folded into the groups they touch. A transaction dated before the last one of its
+group cannot be folded in incrementally and triggers a full analysis instead, as does an
+analysis older than FULL_ANALYSIS_INTERVAL, which picks up rows whose ids sorted before
+the last analyzed one (ObjectIds from different processes are only roughly ordered).
+"""
+import datetime
+import re
+
+import numpy as np
+from pymongo import UpdateOne
+
+from versions import current_version
+
+SERIES_COLLECTION = 'recurring_series'
+STATE_COLLECTION = 'recurring_series_state'
+
+FULL_ANALYSIS_INTERVAL = datetime.timedelta(days=1)
+
+# Fields of a stored group besides user_id and key
+GROUP_FIELDS = (
+    'description', 'type', 'count', 'amount_sum', 'amount_sqsum',
+    'interval_count', 'interval_sum', 'interval_sqsum', 'last_day', 'last_amount'
+)
+
+FORECAST_DAYS = 90
+MAX_FORECAST_DAYS = 365
+
+MIN_OCCURRENCES = 3
+
+# Largest relative spread of amounts that still counts as the same recurring payment
+MAX_AMOUNT_VARIATION = 0.35
+
+# name -> (nominal days between occurrences, allowed deviation of the mean interval, calendar months per step)
+CADENCES = {
+    'weekly': (7, 1.5, 0),
+    'biweekly': (14, 2.5, 0),
+    'monthly': (30.44, 3.5, 1),
+    'quarterly': (91.31, 8, 3),
+    'yearly': (365.25, 15, 12)
+}
+
+_NOISE = re.compile(r'[^a-z]+')
+
+
+def series_collection(db):
+    return db[SERIES_COLLECTION]
+
+
+# 'NETFLIX.COM 4829-11' and 'Netflix.com 5120-12' are the same payee
+def description_key(transaction):
+    description = _NOISE.sub(' ', (transaction.get('description') or '').lower()).strip()
+    return f"{transaction.get('type') or 'expense'}|{description}"
+
+
+def _analyze(transactions):
+    # Full pass: one sort by (group, date), then per-group sums with reduceat/bincount
+    if not transactions:
+        return {}
+
+    keys = np.array([description_key(transaction) for transaction in transactions])
+    groups, codes = np.unique(keys, return_inverse=True)
+    days = np.array([transaction['date'] for transaction in transactions], dtype='datetime64[D]').astype(np.int64)
+    amounts = np.array([float(transaction.get('amount') or 0) for transaction in transactions])
+
+    order = np.lexsort((days, codes))
+    codes, days, amounts = codes[order], days[order], amounts[order]
+
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    lasts = np.r_[starts[1:], len(codes)] - 1
+
+    same_group = codes[1:] == codes[:-1]
+    intervals = np.diff(days)[same_group].astype(np.float64)
+    interval_groups = codes[1:][same_group]
+
+    counts = np.diff(np.r_[starts, len(codes)])
+    amount_sums = np.add.reduceat(amounts, starts)
+    amount_sqsums = np.add.reduceat(amounts * amounts, starts)
+    interval_counts = np.bincount(interval_groups, minlength=len(groups))
+    interval_sums = np.bincount(interval_groups, weights=intervals, minlength=len(groups))
+    interval_sqsums = np.bincount(interval_groups, weights=intervals * intervals, minlength=len(groups))
+
+    # Each group is shown with the description of its latest occurrence
+    latest = order[lasts]
+    return {
+        str(key): {
+            'key': str(key),
+            'description': transactions[latest[i]].get('description') or '',
+            'type': str(key).split('|', 1)[0],
+            'count': int(counts[i]),
+            'amount_sum': float(amount_sums[i]),
+            'amount_sqsum': float(amount_sqsums[i]),
+            'interval_count': int(interval_counts[i]),
+            'interval_sum': float(interval_sums[i]),
+            'interval_sqsum': float(interval_sqsums[i]),
+            'last_day': int(days[lasts[i]]),
+            'last_amount': float(amounts[lasts[i]])
+        }
+        for i, key in enumerate(groups)
+    }
+
+
+# Fold transactions written after the stored analysis into its statistics.
+# Returns None when one of them is older than its group's last occurrence.
+def _fold(stats, transactions):
+    stats = {key: dict(group) for key, group in stats.items()}
+    for transaction in sorted(transactions, key=lambda transaction: transaction['date']):
+        key = description_key(transaction)
+        day = int(np.datetime64(transaction['date'], 'D').astype(np.int64))
+        amount = float(transaction.get('amount') or 0)
+        group = stats.get(key)
+
+        if group is None:
+            stats[key] = {
+                'key': key, 'description': transaction.get('description') or '', 'type': key.split('|', 1)[0],
+                'count': 1, 'amount_sum': amount, 'amount_sqsum': amount * amount,
+                'interval_count': 0, 'interval_sum': 0.0, 'interval_sqsum': 0.0,
+                'last_day': day, 'last_amount': amount
+            }
+            continue
+        if day < group['last_day']:
+            return None
+
+        interval = day - group['last_day']
+        group.update({
+            'description': transaction.get('description') or group['description'],
+            'count': group['count'] + 1,
+            'amount_sum': group['amount_sum'] + amount,
+            'amount_sqsum': group['amount_sqsum'] + amount * amount,
+            'interval_count': group['interval_count'] + 1,
+            'interval_sum': group['interval_sum'] + interval,
+            'interval_sqsum': group['interval_sqsum'] + interval * interval,
+            'last_day': day,
+            'last_amount': amount
+        })
+    return stats
+
+
+def _spread(total, sqtotal, count):
+    mean = total / count
+    return mean, max(sqtotal / count - mean * mean, 0) ** 0.5
+
+
+def _as_date(day):
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(days=day)
+
+
+def _step(date, cadence):
+    days, _, months = CADENCES[cadence]
+    if not months:
+        return date + datetime.timedelta(days=days)
+    month = date.month - 1 + months
+    year = date.year + month // 12
+    month = month % 12 + 1
+    # Clamp to the end of shorter months (31 Jan -> 28 Feb)
+    for day in (date.day, 30, 29, 28):
+        try:
+            return date.replace(year=year, month=month, day=day)
+        except ValueError:
+            continue
+
+
+# Recurring series among the group statistics: regular intervals, stable amounts, still active
+def recurring(stats, today):
+    series = []
+    for group in stats.values():
+        if group['count'] < MIN_OCCURRENCES or not group['interval_count']:
+            continue
+
+        interval, interval_spread = _spread(group['interval_sum'], group['interval_sqsum'], group['interval_count'])
+        amount, amount_spread = _spread(group['amount_sum'], group['amount_sqsum'], group['count'])
+        if amount <= 0 or amount_spread / amount > MAX_AMOUNT_VARIATION:
+            continue
+
+        cadence = next((
+            name for name, (days, tolerance, _) in CADENCES.items()
+            if abs(interval - days) <= tolerance and interval_spread <= max(tolerance, days * 0.2)
+        ), None)
+        if cadence is None:
+            continue
+
+        last_date = _as_date(group['last_day'])
+        # A series that missed more than one expected occurrence has stopped
+        if (today - last_date).days > CADENCES[cadence][0] * 2:
+            continue
+
+        next_date = _step(last_date, cadence)
+        while next_date <= today:
+            next_date = _step(next_date, cadence)
+
+        series.append({
+            'description': group['description'],
+            'type': group['type'],
+            'cadence': cadence,
+            'amount': round(amount, 2),
+            'occurrences': group['count'],
+            'last_date': last_date.strftime('%Y-%m-%d'),
+            'next_date': next_date.strftime('%Y-%m-%d')
+        })
+    return sorted(series, key=lambda item: (item['next_date'], item['description']))
+
+
+def _write_groups(db, user_id, groups, analysis_id):
+    if groups:
+        series_collection(db).bulk_write([
+            UpdateOne(
+                {'user_id': user_id, 'key': group['key']},
+                {'$set': {**{field: group[field] for field in GROUP_FIELDS}, 'analysis_id': analysis_id}},
+                upsert=True
+            )
+            for group in groups
+        ], ordered=False)
+
+
+# Groups that can be recurring, i.e. with enough occurrences; the others are never read back
+def _candidate_groups(db, user_id):
+    return {
+        group['key']: group
+        for group in series_collection(db).find(
+            {'user_id': user_id, 'count': {'$gte': MIN_OCCURRENCES}}, {'_id': 0, 'user_id': 0, 'analysis_id': 0}
+        )
+    }
+
+
+# Group statistics for a user, brought up to date with the fewest transactions read. `version`
+# is the user's data version read before any of the user's data (see versions.py).
+def series_stats(db, user_id, version=None):
+    version = current_version(db, user_id) if version is None else version
+    projection = {'description': 1, 'amount': 1, 'date': 1, 'type': 1}
+    state = db[STATE_COLLECTION].find_one({'_id': user_id})
+    now = datetime.datetime.utcnow()
+
+    if state and now - state['analyzed_at'] < FULL_ANALYSIS_INTERVAL:
+        if state['version'] == version:
+            return _candidate_groups(db, user_id)
+
+        new = list(db.transactions.find({'user_id': user_id, '_id': {'$gt': state['through_id']}}, projection))
+        touched = {description_key(transaction) for transaction in new}
+        stored = {
+            group['key']: group
+            for group in series_collection(db).find({'user_id': user_id, 'key': {'$in': list(touched)}})
+        }
+        folded = _fold(stored, new)
+        if folded is not None:
+            _write_groups(db, user_id, [folded[key] for key in touched], state['analysis_id'])
+            db[STATE_COLLECTION].update_one({'_id': user_id}, {'$set': {
+                'version': version,
+                'through_id': max([transaction['_id'] for transaction in new], default=state['through_id'])
+            }})
+            return _candidate_groups(db, user_id)
+
+    history = list(db.transactions.find({'user_id': user_id}, projection))
+    if not history:
+        return {}
+    stats = _analyze(history)
+
+    # Groups of the previous analysis that no longer exist are dropped once the new ones are written
+    analysis_id = max(transaction['_id'] for transaction in history)
+    _write_groups(db, user_id, list(stats.values()), analysis_id)
+    series_collection(db).delete_many({'user_id': user_id, 'analysis_id': {'$ne': analysis_id}})
+    db[STATE_COLLECTION].update_one(
+        {'_id': user_id},
+        {'$set': {'version': version, 'through_id': analysis_id, 'analysis_id': analysis_id, 'analyzed_at': now}},
+        upsert=True
+    )
+    return {key: group for key, group in stats.items() if group['count'] >= MIN_OCCURRENCES}
+
+
+# Daily balances from today's balance, applying each recurring series' future occurrences
+def project(series, start_balance, today, days=FORECAST_DAYS):
+    today = datetime.datetime(today.year, today.month, today.day)
+    end = today + datetime.timedelta(days=days)
+
+    changes = {}
+    for item in series:
+        date = datetime.datetime.strptime(item['next_date'], '%Y-%m-%d')
+        while date <= end:
+            income, expenses = changes.get(date, (0, 0))
+            if item['type'] == 'income':
+                income += item['amount']
+            else:
+                expenses += item['amount']
+            changes[date] = (income, expenses)
+            date = _step(date, item['cadence'])
+
+    points = []
+    balance = start_balance
+    for offset in range(1, days + 1):
+        date = today + datetime.timedelta(days=offset)
+        income, expenses = changes.get(date, (0, 0))
+        balance += income - expenses
+        points.append({
+            'date': date.strftime('%Y-%m-%d'),
+            'income': round(income, 2),
+            'expenses': round(expenses, 2),
+            'balance': round(balance, 2)
+        })
+    return points
@@ -0,0 +1,191 @@
+"""Monte Carlo estimate of the probability of reaching each savings goal by its deadline.
+
+All of a user's goals are simulated together on the same market paths. Each path draws
+monthly log-normal returns and its own savings level. The balance of every goal at every
+month then follows from cumulative products and sums over the path arrays, with no
+Python loop over paths or months:
+
+    growth_t  = prod_{s<=t} (1 + r_s)
+    balance_t = growth_t * (current + level * contribution * sum_{s<=t} 1 / growth_s)
+
+Paths are simulated in chunks of at most CHUNK_CELLS path-months, so memory stays bounded
+whatever the number of paths; only each goal's balance at its deadline is kept per path.
+A request larger than MAX_CELLS path-months in total is refused with SimulationTooLarge.
+"""
+import datetime
+import hashlib
+import os
+
+import numpy as np
+
+from cache import TTLCache
+
+DEFAULT_PATHS = 10000
+MAX_PATHS = 50000
+
+# Annual expected return and volatility of what goal savings are invested in
+EXPECTED_RETURN = float(os.getenv('GOAL_EXPECTED_RETURN', 0.05))
+VOLATILITY = float(os.getenv('GOAL_VOLATILITY', 0.10))
+
+# Relative variation of how much of the planned contribution a path actually saves
+CONTRIBUTION_VOLATILITY = 0.2
+
+# Deadlines further out than this are simulated up to this horizon
+MAX_HORIZON_MONTHS = 600
+
+# Largest paths x horizon (in months) a single simulation may cover
+MAX_CELLS = int(os.getenv('GOAL_SIMULATION_MAX_CELLS', 5000000))
+
+# Path-months simulated at once, which bounds the working arrays of each chunk
+CHUNK_CELLS = 250000
+
+# Share of the user's monthly savings assigned to a goal, relative to other goals
+PRIORITY_WEIGHTS = {'high': 3, 'medium': 2, 'low': 1}
+
+# Fixed so identical inputs give identical answers, which is what makes memoizing them sound
+SEED = 20240501
+
+_results = TTLCache(
+    maxsize=int(os.getenv('GOAL_SIMULATION_CACHE_SIZE', 10000)),
+    ttl=int(os.getenv('GOAL_SIMULATION_CACHE_TTL', 3600))
+)
+
+
+class SimulationTooLarge(ValueError):
+    pass
+
+
+def months_until(deadline, today=None):
+    if deadline is None:
+        return None
+    today = today or datetime.datetime.utcnow()
+    months = (deadline.year - today.year) * 12 + deadline.month - today.month
+    if deadline.day < today.day:
+        months -= 1
+    return min(max(months, 0), MAX_HORIZON_MONTHS)
+
+
+# Split monthly savings across open goals by priority
+def allocate_contributions(goals, monthly_savings):
+    open_goals = [
+        goal for goal in goals
+        if goal.get('months') and goal.get('current_amount', 0) < goal.get('target_amount', 0)
+    ]
+    total_weight = sum(PRIORITY_WEIGHTS.get(goal.get('priority'), 2) for goal in open_goals)
+    for goal in goals:
+        if goal.get('monthly_contribution') is None:
+            share = PRIORITY_WEIGHTS.get(goal.get('priority'), 2) / total_weight if goal in open_goals else 0
+            goal['monthly_contribution'] = round(max(monthly_savings, 0) * share, 2)
+    return goals
+
+
+def _horizon(goals):
+    return max((goal.get('months') or 0 for goal in goals), default=0)
+
+
+# Paths to simulate when the caller does not choose: DEFAULT_PATHS, or fewer for far deadlines
+def default_paths(goals):
+    horizon = _horizon(goals)
+    return min(DEFAULT_PATHS, MAX_CELLS // horizon) if horizon else DEFAULT_PATHS
+
+
+def _key(inputs, paths, expected_return, volatility):
+    return hashlib.sha1(repr((inputs, paths, expected_return, volatility)).encode()).hexdigest()
+
+
+# goals: dicts with target_amount, current_amount, months (None when there is no deadline)
+# and monthly_contribution. Returns one result dict per goal, in order.
+def simulate(goals, paths=DEFAULT_PATHS, expected_return=EXPECTED_RETURN, volatility=VOLATILITY):
+    horizon = _horizon(goals)
+    if paths * horizon > MAX_CELLS:
+        raise SimulationTooLarge(
+            f'{paths} paths over {horizon} months exceed the limit of {MAX_CELLS} path-months; '
+            f'use at most {MAX_CELLS // horizon} paths or closer deadlines'
+        )
+
+    inputs = tuple(
+        (float(goal.get('current_amount', 0)), float(goal.get('target_amount', 0)),
+         goal.get('months'), float(goal.get('monthly_contribution') or 0))
+        for goal in goals
+    )
+
+    key = _key(inputs, paths, expected_return, volatility)
+    results = _results.get(key)
+    if results is None:
+        results = _simulate(inputs, paths, expected_return, volatility)
+        _results.set(key, results)
+    return [dict(result) for result in results]
+
+
+def _simulate(inputs, paths, expected_return, volatility):
+    dated = [i for i, (_, _, months, _) in enumerate(inputs) if months]
+    results = [{'probability': None, 'p10': None, 'p50': None, 'p90': None} for _ in inputs]
+
+    # Goals whose deadline has passed (or that have none) are settled by their current amount
+    for i, (current, target, months, _) in enumerate(inputs):
+        if months == 0:
+            results[i] = {'probability': 1.0 if current >= target else 0.0, 'p10': current, 'p50': current, 'p90': current}
+    if not dated:
+        return results
+
+    horizon = max(inputs[i][2] for i in dated)
+    rng = np.random.default_rng(SEED)
+
+    # Column of each goal's deadline month, and every goal's balance there on every path
+    columns = np.array([inputs[i][2] - 1 for i in dated])
+    current = np.array([inputs[i][0] for i in dated])[:, None]
+    contribution = np.array([inputs[i][3] for i in dated])[:, None]
+    target = np.array([inputs[i][1] for i in dated])
+    balances = np.empty((len(dated), paths), dtype=np.float32)
+
+    chunk = max(CHUNK_CELLS // horizon, 2)
+    for start in range(0, paths, chunk):
+        size = min(chunk, paths - start)
+        growth, contributed, level = _paths(rng, size, horizon, expected_return, volatility)
+        # Transposed so each goal's balances are contiguous for the percentile sort
+        balances[:, start:start + size] = growth[:, columns].T * (
+            current + contribution * (level * contributed[:, columns].T)
+        )
+
+    probabilities = (balances >= target[:, None]).mean(axis=1)
+    p10, p50, p90 = np.percentile(balances, [10, 50, 90], axis=1)
+    for j, i in enumerate(dated):
+        results[i] = {
+            'probability': round(float(probabilities[j]), 4),
+            'p10': round(float(p10[j]), 2),
+            'p50': round(float(p50[j]), 2),
+            'p90': round(float(p90[j]), 2)
+        }
+    return results
+
+
+# Cumulative growth, cumulative discounted contributions and savings level of `paths` paths
+def _paths(rng, paths, horizon, expected_return, volatility):
+    # Antithetic sampling: every drawn path is paired with its mirror image, which halves the
+    # random numbers generated (the bulk of the cost) and reduces the variance of the estimate.
+    # float32 is ample for probabilities and percentiles, and halves memory traffic.
+    half = (paths + 1) // 2
+    shocks = rng.standard_normal(size=(half, horizon), dtype=np.float32)
+    levels = rng.standard_normal(size=half, dtype=np.float32)
+
+    # Monthly log returns with the annual mean and volatility, accumulated in place into growth
+    sigma = volatility / np.sqrt(12)
+    mu = np.log1p(expected_return) / 12 - sigma ** 2 / 2
+    growth = np.empty((2 * half, horizon), dtype=np.float32)
+    np.multiply(shocks, sigma, out=growth[:half])
+    del shocks
+    np.negative(growth[:half], out=growth[half:])
+    growth += mu
+    np.cumsum(growth, axis=1, out=growth)
+    np.exp(growth, out=growth)
+
+    # Each path saves at its own level around the planned contribution; a contribution made in
+    # month s grows by growth_t / growth_s until month t
+    level = np.maximum(1.0 + CONTRIBUTION_VOLATILITY * np.concatenate([levels, -levels]), 0)[:paths]
+    contributed = np.reciprocal(growth)
+    np.cumsum(contributed, axis=1, out=contributed)
+    return growth[:paths], contributed[:paths], level
+
+
+def cache_stats():
+    return _results.stats()
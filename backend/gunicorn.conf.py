@@ -0,0 +1,51 @@
+"""Gunicorn settings for serving the API in production.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Every setting can be overridden through the environment variables below.
+"""
+import multiprocessing
+import os
+import sys
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+
+# Pre-fork worker processes, each serving requests on a pool of threads
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+# Workers get this long to finish in-flight requests after SIGTERM
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers periodically to bound memory growth (0 disables)
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+# Importing the app once in the master saves memory, but then its MongoClient
+# exists before fork and has to be replaced in every worker (see post_fork)
+preload_app = os.getenv('GUNICORN_PRELOAD', 'false').lower() == 'true'
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        app_module.connect_db()
+        server.log.info('Worker %s created its own MongoDB client', worker.pid)
+
+
+def worker_exit(server, worker):
+    from concurrency import shutdown_query_pool
+    from passwords import shutdown_hash_pool
+
+    shutdown_query_pool()
+    shutdown_hash_pool()
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        app_module.provisioning_queue.shutdown(timeout=10)
+        app_module.close_db()
@@ -0,0 +1,238 @@
+"""Index declarations for every collection, plus a query-plan check.
+
+Build the indexes:          python indexes.py
+Verify no route COLLSCANs:  python indexes.py --check
+Remove duplicates first:    python indexes.py --dedupe
+"""
+import argparse
+import datetime
+import os
+import sys
+import threading
+
+import pymongo
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+from dashboard import summary_pipeline
+from pagination import TRANSACTION_SORT, encode_cursor, seek_filter
+from search import search_pipeline
+
+# Indexes each collection needs, keyed by collection name. Names are left to MongoDB's
+# defaults so indexes created before this module existed (e.g. email_1) are recognised.
+INDEXES = {
+    'users': [
+        IndexModel([('email', ASCENDING)], unique=True)
+    ],
+    'accounts': [
+        IndexModel([('user_id', ASCENDING)]),
+        # At most one default account per user, however many times provisioning runs
+        IndexModel([('user_id', ASCENDING), ('is_default', ASCENDING)], unique=True,
+                   partialFilterExpression={'is_default': True})
+    ],
+    'transactions': [
+        IndexModel([('user_id', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel([('user_id', ASCENDING), ('category', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)]),
+        # Transactions written since the recurring series were last analyzed
+        IndexModel([('user_id', ASCENDING), ('_id', ASCENDING)]),
+        # Multikey: one entry per description trigram (see search.py)
+        IndexModel([('user_id', ASCENDING), ('search_grams', ASCENDING)]),
+        # Drops rows that were already imported from a statement
+        IndexModel([('user_id', ASCENDING), ('import_hash', ASCENDING)], unique=True,
+                   partialFilterExpression={'import_hash': {'$exists': True}})
+    ],
+    'budgets': [
+        IndexModel([('user_id', ASCENDING)])
+    ],
+    'goals': [
+        IndexModel([('user_id', ASCENDING)])
+    ],
+    'settings': [
+        IndexModel([('user_id', ASCENDING)], unique=True)
+    ],
+    'balance_snapshots': [
+        IndexModel([('user_id', ASCENDING), ('month', ASCENDING)], unique=True)
+    ],
+    'category_rules': [
+        IndexModel([('user_id', ASCENDING), ('pattern', ASCENDING)], unique=True)
+    ],
+    'recurring_series': [
+        IndexModel([('user_id', ASCENDING), ('key', ASCENDING)], unique=True)
+    ],
+    'daily_rollups': [
+        IndexModel([('user_id', ASCENDING), ('day', ASCENDING), ('category', ASCENDING), ('type', ASCENDING)],
+                   unique=True)
+    ]
+}
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+# Create every declared index. create_indexes is a no-op for indexes that already exist.
+def ensure_indexes(db):
+    failures = {}
+    for collection_name, models in INDEXES.items():
+        try:
+            db[collection_name].create_indexes(models)
+        except PyMongoError as e:
+            failures[collection_name] = str(e)
+            print(f"Error creating indexes on {collection_name}: {e}")
+    return failures
+
+
+# Unique indexes enforce invariants rather than speed up queries (one user per email, one default
+# account per user, no duplicate upserts), so they must exist before any request is served.
+# Raises PyMongoError when one cannot be created. Documents written before an index existed can
+# already break it; those collections are logged and returned, and dedupe() repairs them.
+def ensure_unique_indexes(db):
+    duplicates = {}
+    for collection_name, models in INDEXES.items():
+        unique = [model for model in models if model.document.get('unique')]
+        if not unique:
+            continue
+        try:
+            db[collection_name].create_indexes(unique)
+        except OperationFailure as e:
+            if e.code != DUPLICATE_KEY_ERROR:
+                raise
+            duplicates[collection_name] = str(e)
+            print(f"Error creating unique indexes on {collection_name}: existing documents are duplicates, "
+                  f"run 'python indexes.py --dedupe' to remove them: {e}")
+    return duplicates
+
+
+# Ids of all but the first document of each group that shares `key`, in `sort` order
+def _duplicate_ids(collection, match, key, sort):
+    ids = []
+    for group in collection.aggregate([
+        {'$match': match},
+        {'$sort': sort},
+        {'$group': {'_id': f'${key}', 'ids': {'$push': '$_id'}}},
+        {'$match': {'ids.1': {'$exists': True}}}
+    ], allowDiskUse=True):
+        ids.extend(group['ids'][1:])
+    return ids
+
+
+# Repair the duplicates that lazy provisioning wrote before the unique indexes existed: a
+# user's extra settings documents are deleted, keeping the most recently updated, and all but
+# their oldest default account stop being the default. Returns the documents changed per collection.
+def dedupe(db):
+    settings = _duplicate_ids(db.settings, {}, 'user_id', {'updated_at': -1, '_id': -1})
+    accounts = _duplicate_ids(db.accounts, {'is_default': True}, 'user_id', {'created_at': 1, '_id': 1})
+    return {
+        'settings': db.settings.delete_many({'_id': {'$in': settings}}).deleted_count if settings else 0,
+        'accounts': db.accounts.update_many(
+            {'_id': {'$in': accounts}}, {'$unset': {'is_default': ''}}
+        ).modified_count if accounts else 0
+    }
+
+
+def ensure_indexes_in_background(db):
+    thread = threading.Thread(target=ensure_indexes, args=(db,), name='ensure-indexes', daemon=True)
+    thread.start()
+    return thread
+
+
+# The queries each route issues, in the shape the route issues them
+def route_queries(db):
+    user_id = ObjectId()
+    cursor = encode_cursor({'_id': ObjectId(), 'date': datetime.datetime.utcnow()})
+    by_user = {'user_id': user_id}
+    by_category = {'user_id': user_id, 'category': 'Food'}
+
+    return [
+        ('POST /api/login', 'users', {'filter': {'email': 'user@example.com'}}),
+        ('GET /api/settings', 'settings', {'filter': by_user}),
+        ('GET /api/dashboard/summary', 'accounts', {'pipeline': summary_pipeline(db, user_id)}),
+        ('GET /api/dashboard/accounts', 'accounts', {'filter': by_user}),
+        ('GET /api/dashboard/transactions', 'transactions',
+         {'filter': by_user, 'sort': TRANSACTION_SORT}),
+        ('GET /api/dashboard/transactions?type=', 'transactions',
+         {'filter': {'user_id': user_id, 'type': 'expense'}, 'sort': TRANSACTION_SORT}),
+        ('GET /api/dashboard/transactions?category=', 'transactions',
+         {'filter': by_category, 'sort': TRANSACTION_SORT}),
+        ('GET /api/dashboard/transactions?cursor=', 'transactions',
+         {'filter': seek_filter(by_user, cursor), 'sort': TRANSACTION_SORT}),
+        ('GET /api/dashboard/transactions?category=&cursor=', 'transactions',
+         {'filter': seek_filter(by_category, cursor), 'sort': TRANSACTION_SORT}),
+        ('GET /api/dashboard/analytics', 'daily_rollups',
+         {'filter': {'user_id': user_id, 'day': {'$gte': datetime.datetime(2024, 1, 1)}}}),
+        ('GET /api/dashboard/networth', 'balance_snapshots',
+         {'filter': {'user_id': user_id, 'month': {'$gte': datetime.datetime(2024, 1, 1)}}}),
+        ('GET /api/dashboard/transactions/search', 'transactions',
+         {'pipeline': search_pipeline(user_id, 'amazon')}),
+        ('GET /api/dashboard/forecast', 'transactions',
+         {'filter': {'user_id': user_id, '_id': {'$gt': ObjectId()}}}),
+        ('GET /api/dashboard/budgets', 'budgets', {'filter': by_user}),
+        ('GET /api/dashboard/goals', 'goals', {'filter': by_user})
+    ]
+
+
+def _collection_scans(explain_output):
+    # Walk an explain document and collect every COLLSCAN stage, ignoring rejected plans
+    found = []
+    if isinstance(explain_output, dict):
+        if explain_output.get('stage') == 'COLLSCAN':
+            found.append(explain_output.get('namespace') or explain_output.get('ns') or '?')
+        for key, value in explain_output.items():
+            if key != 'rejectedPlans':
+                found.extend(_collection_scans(value))
+    elif isinstance(explain_output, list):
+        for item in explain_output:
+            found.extend(_collection_scans(item))
+    return found
+
+
+def explain_route_query(db, collection_name, spec):
+    collection = db[collection_name]
+    if 'pipeline' in spec:
+        return db.command('aggregate', collection_name, pipeline=spec['pipeline'], explain=True)
+
+    cursor = collection.find(spec['filter'])
+    if spec.get('sort'):
+        cursor = cursor.sort(spec['sort'])
+    return cursor.explain()
+
+
+# Explain every route query and return the ones whose plan contains a COLLSCAN
+def verify_query_plans(db):
+    failures = []
+    for route, collection_name, spec in route_queries(db):
+        scans = _collection_scans(explain_route_query(db, collection_name, spec))
+        if scans:
+            failures.append((route, collection_name, scans))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--database', default='finfine')
+    parser.add_argument('--check', action='store_true', help='fail if any route query plan is a COLLSCAN')
+    parser.add_argument('--dedupe', action='store_true', help='remove duplicate settings and default accounts first')
+    args = parser.parse_args()
+
+    db = pymongo.MongoClient(args.mongo_uri)[args.database]
+
+    if args.dedupe:
+        for collection_name, changed in dedupe(db).items():
+            print(f'Removed {changed} duplicates from {collection_name}')
+
+    if ensure_indexes(db):
+        return 1
+
+    if args.check:
+        failures = verify_query_plans(db)
+        for route, collection_name, scans in failures:
+            print(f"COLLSCAN: {route} on {collection_name} ({', '.join(scans)})")
+        if failures:
+            return 1
+        print('All route queries use an index')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
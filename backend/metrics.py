@@ -0,0 +1,189 @@
+"""Request latency histograms and MongoDB command accounting, rendered in Prometheus text format.
+
+Every MongoDB command is attributed to the request that issued it through a context variable;
+fan_out copies the context to its pool threads, so concurrent reads are attributed as well.
+Metrics are kept per process: with several workers, each scrape sees the worker that served it.
+"""
+import contextvars
+import threading
+
+from pymongo import monitoring
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Upper bounds of the MongoDB commands-per-request histogram buckets
+COMMAND_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Commands of the request being served: command name -> [count, documents returned]
+_request_commands = contextvars.ContextVar('request_commands', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket', {**labels, 'le': str(bound)}, cumulative
+        yield f'{name}_sum', labels, round(self.total, 6)
+        yield f'{name}_count', labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_latency = {}    # (route, method, status) -> Histogram
+        self.request_commands = {}   # route -> Histogram of commands per request
+        self.command_latency = {}    # command -> Histogram
+        self.commands = {}           # (route, command) -> [count, documents returned]
+        self.command_failures = {}   # command -> count
+
+    # Start attributing MongoDB commands to a new request; returns the token for end_request
+    def start_request(self):
+        return _request_commands.set({})
+
+    def end_request(self, token, route, method, status, seconds):
+        commands = _request_commands.get() or {}
+        _request_commands.reset(token)
+        with self._lock:
+            self.request_latency.setdefault((route, method, str(status)), Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.request_commands.setdefault(route, Histogram(COMMAND_COUNT_BUCKETS)).observe(
+                sum(count for count, _ in commands.values())
+            )
+            for command, (count, documents) in commands.items():
+                totals = self.commands.setdefault((route, command), [0, 0])
+                totals[0] += count
+                totals[1] += documents
+
+    def command_succeeded(self, command, seconds, documents):
+        # Outside any request (e.g. a background thread), the command is counted with an empty route
+        commands = _request_commands.get()
+        with self._lock:
+            self.command_latency.setdefault(command, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            if commands is None:
+                totals = self.commands.setdefault(('', command), [0, 0])
+            else:
+                # Under the lock, since fan_out threads add to the same request's counts
+                totals = commands.setdefault(command, [0, 0])
+            totals[0] += 1
+            totals[1] += documents
+
+    # MongoDB commands issued so far by the current request: command -> {count, documents}
+    def current_commands(self):
+        commands = _request_commands.get() or {}
+        with self._lock:
+            return {command: {'count': count, 'documents': documents} for command, (count, documents) in commands.items()}
+
+    def command_failed(self, command, seconds):
+        with self._lock:
+            self.command_failures[command] = self.command_failures.get(command, 0) + 1
+            self.command_latency.setdefault(command, Histogram(LATENCY_BUCKETS)).observe(seconds)
+
+    # Prometheus text exposition of everything recorded, plus extra gauges:
+    # gauges maps a metric family name to {labels tuple: value}
+    def render(self, gauges=None):
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample_name, labels, value in samples:
+                lines.append(f'{sample_name}{_labels(labels)} {value}')
+
+        with self._lock:
+            family('http_request_duration_seconds', 'histogram', 'Request latency by route, method and status.', [
+                sample
+                for (route, method, status), histogram in sorted(self.request_latency.items())
+                for sample in histogram.samples('http_request_duration_seconds',
+                                                {'route': route, 'method': method, 'status': status})
+            ])
+            family('mongo_commands_per_request', 'histogram', 'MongoDB commands issued per request.', [
+                sample
+                for route, histogram in sorted(self.request_commands.items())
+                for sample in histogram.samples('mongo_commands_per_request', {'route': route})
+            ])
+            family('mongo_command_duration_seconds', 'histogram', 'MongoDB command round-trip time.', [
+                sample
+                for command, histogram in sorted(self.command_latency.items())
+                for sample in histogram.samples('mongo_command_duration_seconds', {'command': command})
+            ])
+            family('mongo_commands_total', 'counter', 'MongoDB commands by issuing route.', [
+                ('mongo_commands_total', {'route': route, 'command': command}, count)
+                for (route, command), (count, _) in sorted(self.commands.items())
+            ])
+            family('mongo_documents_returned_total', 'counter', 'Documents returned by MongoDB commands.', [
+                ('mongo_documents_returned_total', {'route': route, 'command': command}, documents)
+                for (route, command), (_, documents) in sorted(self.commands.items())
+            ])
+            family('mongo_command_failures_total', 'counter', 'Failed MongoDB commands.', [
+                ('mongo_command_failures_total', {'command': command}, count)
+                for command, count in sorted(self.command_failures.items())
+            ])
+
+        for name, (help_text, values) in (gauges or {}).items():
+            family(name, 'gauge', help_text, [(name, dict(labels), value) for labels, value in values.items()])
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+# Documents in the batch of a find, aggregate or getMore reply
+def _documents_returned(reply):
+    cursor = reply.get('cursor')
+    if isinstance(cursor, dict):
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', ())))
+    return 0
+
+
+class CommandListener(monitoring.CommandListener):
+    def __init__(self, registry):
+        self.registry = registry
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.registry.command_succeeded(event.command_name, event.duration_micros / 1e6, _documents_returned(event.reply))
+
+    def failed(self, event):
+        self.registry.command_failed(event.command_name, event.duration_micros / 1e6)
+
+
+registry = Registry()
+command_listener = CommandListener(registry)
+
+
+# Flatten {name: stats dict} (cache or limiter stats) into one gauge family per numeric field,
+# e.g. cache_hits{cache="auth"} from {'auth': {'hits': 10, ...}}
+def stats_gauges(prefix, label, stats_by_name):
+    gauges = {}
+    for name, stats in stats_by_name.items():
+        for field, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                help_text, values = gauges.setdefault(f'{prefix}_{field}', (f'{field} per {label}.', {}))
+                values[((label, name),)] = value
+    return gauges
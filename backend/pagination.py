@@ -0,0 +1,51 @@
+import base64
+import binascii
+import datetime
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Sort order shared by every paginated transactions query; _id breaks ties between equal dates
+TRANSACTION_SORT = [('date', -1), ('_id', -1)]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# Encode the (date, _id) position of the last row on a page as an opaque token
+def encode_cursor(doc):
+    date = doc.get('date')
+    # Integer division: total_seconds() * 1000 loses a millisecond to float error on some dates
+    millis = '' if date is None else str((date - EPOCH) // datetime.timedelta(milliseconds=1))
+    raw = f"{millis}:{doc['_id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        millis, _, object_id = base64.urlsafe_b64decode(padded).decode().partition(':')
+        date = EPOCH + datetime.timedelta(milliseconds=int(millis)) if millis else None
+        return date, ObjectId(object_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError, InvalidId) as e:
+        raise InvalidCursor(str(e))
+
+
+# Restrict a query to rows strictly after the cursor position in TRANSACTION_SORT order
+def seek_filter(query, cursor):
+    date, object_id = decode_cursor(cursor)
+
+    if date is None:
+        # Rows without a date sort last, so only those with a smaller _id remain
+        after = {'date': None, '_id': {'$lt': object_id}}
+    else:
+        after = {'$or': [
+            {'date': {'$lt': date}},
+            {'date': date, '_id': {'$lt': object_id}},
+            {'date': None}
+        ]}
+
+    return {'$and': [query, after]}
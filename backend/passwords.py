@@ -0,0 +1,143 @@
+"""Password hashing off the request thread, on a bounded process pool.
+
+Hashing is deliberately CPU-expensive and holds the GIL, so running it inline stalls every
+other request served by the same worker. Here it runs in separate processes; the number of
+queued hashes is capped and callers wait at most HASH_TIMEOUT seconds.
+"""
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# werkzeug method string, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+
+# Hashing processes per server worker; 0 hashes inline on the request thread
+HASH_POOL_WORKERS = int(os.getenv('HASH_POOL_WORKERS', 2))
+
+# Hashes allowed in flight (running or queued) per server worker before callers are turned away
+HASH_QUEUE_LIMIT = int(os.getenv('HASH_QUEUE_LIMIT', max(HASH_POOL_WORKERS, 1) * 8))
+
+# Seconds a request waits for its hash before giving up
+HASH_TIMEOUT = float(os.getenv('HASH_TIMEOUT', 5))
+
+
+class HashingUnavailable(Exception):
+    pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_QUEUE_LIMIT)
+_method_prefix = None
+
+
+def _hash_pool():
+    # Created on first use, so each server worker (after fork) gets its own pool
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if sys.platform == 'win32':
+                    context = multiprocessing.get_context('spawn')
+                else:
+                    # Children are forked from a clean single-threaded server process rather than
+                    # from this multi-threaded one, and only this module is preloaded into it
+                    context = multiprocessing.get_context('forkserver')
+                    context.set_forkserver_preload([__name__])
+                _pool = ProcessPoolExecutor(max_workers=HASH_POOL_WORKERS, mp_context=context)
+    return _pool
+
+
+def shutdown_hash_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+# Replace the pool and queue limit, e.g. for benchmarks; None keeps the current setting
+def configure_hash_pool(workers=None, queue_limit=None):
+    global HASH_POOL_WORKERS, HASH_QUEUE_LIMIT, _slots
+    shutdown_hash_pool()
+    if workers is not None:
+        HASH_POOL_WORKERS = workers
+    if queue_limit is not None:
+        HASH_QUEUE_LIMIT = queue_limit
+        _slots = threading.BoundedSemaphore(queue_limit)
+
+
+# A hashing process that dies (e.g. killed by the OOM killer) breaks the whole pool; the
+# next caller replaces it, once, however many callers saw it broken
+def _discard_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False)
+
+
+def _run(fn, *args, retry=True):
+    if HASH_POOL_WORKERS <= 0:
+        return fn(*args)
+
+    slots = _slots
+    if not slots.acquire(blocking=False):
+        raise HashingUnavailable('Too many password operations in progress')
+
+    pool = None
+    try:
+        pool = _hash_pool()
+        future = pool.submit(fn, *args)
+    except BrokenProcessPool:
+        slots.release()
+        future = None
+    except Exception:
+        slots.release()
+        raise
+
+    if future is not None:
+        # The slot is held until the hash really finishes, even if the caller times out
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=HASH_TIMEOUT)
+        except TimeoutError:
+            raise HashingUnavailable('Password operation timed out')
+        except BrokenProcessPool:
+            pass
+
+    _discard_pool(pool)
+    if retry:
+        return _run(fn, *args, retry=False)
+    raise HashingUnavailable('Password hashing pool is unavailable')
+
+
+def _generate(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def hash_password(password):
+    return _run(_generate, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(password_hash, password):
+    return _run(check_password_hash, password_hash, password)
+
+
+def _configured_prefix():
+    # werkzeug fills in default parameters (e.g. 'scrypt' -> 'scrypt:32768:8:1'),
+    # so learn the stored form of the configured method from a real hash once
+    global _method_prefix
+    if _method_prefix is None:
+        _method_prefix = _run(_generate, '', PASSWORD_HASH_METHOD).split('$', 1)[0]
+    return _method_prefix
+
+
+# True when a stored hash was made with different parameters than the configured ones
+def needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != _configured_prefix()
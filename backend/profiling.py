@@ -0,0 +1,141 @@
+"""Opt-in profiling of single requests.
+
+Profiling is enabled by setting PROFILE_DIR. A request is then profiled when it carries
+`X-Profile: <PROFILE_TOKEN>`, or at random with probability PROFILE_SAMPLE_RATE. Each profiled
+request writes two files to PROFILE_DIR, named <timestamp>-<route>-<user>:
+
+- `.folded` (PROFILE_MODE=sample, the default): collapsed stacks sampled every PROFILE_INTERVAL
+  seconds, one `frame;frame;frame count` line per stack, ready for flamegraph.pl or speedscope.
+- `.prof` (PROFILE_MODE=cprofile): deterministic cProfile statistics, for pstats or snakeviz.
+- `.json`: route, path, user, status, duration and the MongoDB commands the request issued.
+
+Only the request's own thread is profiled; reads that fan_out runs on pool threads are not.
+With PROFILE_DIR unset, the only cost per request is one boolean check.
+"""
+import cProfile
+import datetime
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+import metrics
+
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+ENABLED = bool(PROFILE_DIR)
+
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_HEADER = 'X-Profile'
+SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+
+# 'sample' or 'cprofile'
+MODE = os.getenv('PROFILE_MODE', 'sample')
+
+# Seconds between stack samples
+INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.001))
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+# Python 3.12+ allows one active cProfile per process, so concurrent requests are not profiled
+_cprofile_lock = threading.Lock()
+
+
+def requested(request):
+    # Constant-time comparison, so response timing does not reveal the token
+    if PROFILE_TOKEN and hmac.compare_digest(request.headers.get(PROFILE_HEADER, '').encode(), PROFILE_TOKEN.encode()):
+        return True
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+class StackSampler:
+    # Samples one thread's stack from a background thread and counts identical stacks
+    def __init__(self, thread_id, interval=INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({frame.f_globals.get('__name__', '?')}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.counts.items()))
+
+
+def _status(response):
+    # Handlers return a response, or a (body, status) tuple
+    if isinstance(response, tuple) and len(response) > 1 and isinstance(response[1], int):
+        return response[1]
+    return getattr(response, 'status_code', 200)
+
+
+# Call a handler under the profiler and write its output, tagged with the request it served
+def profile(request, user_id, handler, *args, **kwargs):
+    if MODE == 'cprofile':
+        if not _cprofile_lock.acquire(blocking=False):
+            return handler(*args, **kwargs)
+        try:
+            return _profile(request, user_id, cProfile.Profile(), handler, *args, **kwargs)
+        finally:
+            _cprofile_lock.release()
+    return _profile(request, user_id, None, handler, *args, **kwargs)
+
+
+def _profile(request, user_id, profiler, handler, *args, **kwargs):
+    started = time.perf_counter()
+    if profiler is not None:
+        response = profiler.runcall(handler, *args, **kwargs)
+    else:
+        with StackSampler(threading.get_ident()) as sampler:
+            response = handler(*args, **kwargs)
+    elapsed = time.perf_counter() - started
+
+    route = request.url_rule.rule if request.url_rule else request.path
+    stamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+    base = os.path.join(PROFILE_DIR, f'{stamp}-{_UNSAFE.sub("_", route).strip("_")}-{user_id}')
+
+    # The request has been served; a profile that cannot be written must not fail it
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if profiler is not None:
+            profiler.dump_stats(base + '.prof')
+        else:
+            with open(base + '.folded', 'w') as f:
+                f.write(sampler.collapsed())
+
+        with open(base + '.json', 'w') as f:
+            json.dump({
+                'route': route,
+                'method': request.method,
+                'path': request.full_path.rstrip('?'),
+                'user_id': str(user_id),
+                'status': _status(response),
+                'duration_seconds': round(elapsed, 6),
+                'mode': 'cprofile' if profiler is not None else 'sample',
+                'mongo_commands': metrics.registry.current_commands()
+            }, f, indent=2)
+    except OSError as e:
+        print(f"Error writing profile to {PROFILE_DIR}: {e}")
+    return response
@@ -0,0 +1,134 @@
+"""Default documents for new users, written idempotently and off the sign-up request."""
+import datetime
+import queue
+import threading
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+DEFAULT_SETTINGS = {
+    'theme': 'light',
+    'currency': 'USD',
+    'language': 'English',
+    'notifications': {
+        'email': True,
+        'push': True,
+        'budget_alerts': True,
+        'transaction_alerts': True,
+        'goal_reminders': True,
+        'investment_opportunities': False,
+        'monthly_reports': True
+    },
+    'privacy': {
+        'share_analytics': False,
+        'two_factor_auth': False,
+        'third_party_integrations': False,
+        'public_profile': False
+    },
+    'dashboard': {
+        'show_accounts': True,
+        'show_transactions': True,
+        'show_budgets': True,
+        'show_goals': True,
+        'compact_view': False
+    }
+}
+
+DEFAULT_ACCOUNT = {
+    'name': 'Cash Account',
+    'type': 'Cash',
+    'balance': 1000.00,
+    'currency': 'USD'
+}
+
+# Attempts per user before the queue gives up and leaves it to the lazy read path
+PROVISION_ATTEMPTS = 3
+
+
+def default_settings(user_id, now=None):
+    now = now or datetime.datetime.utcnow()
+    # The nested groups are copied so callers never share (and mutate) the template's dicts
+    settings = {key: dict(value) if isinstance(value, dict) else value for key, value in DEFAULT_SETTINGS.items()}
+    return {'user_id': user_id, **settings, 'created_at': now, 'updated_at': now}
+
+
+def default_account(user_id, now=None):
+    # is_default is covered by a partial unique index, so a user never gets two default accounts
+    return {'user_id': user_id, **DEFAULT_ACCOUNT, 'is_default': True, 'created_at': now or datetime.datetime.utcnow()}
+
+
+def _upsert(collection, query, document):
+    # $setOnInsert leaves an existing document untouched, so this is safe to repeat.
+    # Two racing upserts can still collide on the unique index; the loser reads the winner's document.
+    try:
+        return collection.find_one_and_update(
+            query,
+            {'$setOnInsert': {key: value for key, value in document.items() if key not in query}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        return collection.find_one(query)
+
+
+def ensure_default_settings(collection, user_id):
+    return _upsert(collection, {'user_id': user_id}, default_settings(user_id))
+
+
+def ensure_default_account(collection, user_id):
+    return _upsert(collection, {'user_id': user_id, 'is_default': True}, default_account(user_id))
+
+
+class ProvisioningQueue:
+    """Runs provision(user_id) for newly registered users on a background thread.
+
+    The thread is started on first use, so each forked server worker gets its own.
+    A failed user is retried after a delay on a timer, so it never holds up the users
+    queued behind it. Work still queued when the process exits is lost, which is harmless:
+    the settings and accounts endpoints create the same defaults on first read.
+    """
+
+    def __init__(self, provision):
+        self.provision = provision
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, user_id):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='provisioning', daemon=True)
+                self._thread.start()
+        self._queue.put((user_id, 1))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            user_id, attempt = item
+            # Any error is caught: an exception escaping here would stop provisioning for good
+            try:
+                self.provision(user_id)
+            except Exception as e:
+                if attempt < PROVISION_ATTEMPTS:
+                    print(f"Error provisioning user {user_id} (attempt {attempt}), retrying: {e}")
+                    self._retry_later(user_id, attempt + 1, delay=attempt)
+                else:
+                    print(f"Error provisioning user {user_id}, giving up: {e}")
+
+    def _retry_later(self, user_id, attempt, delay):
+        timer = threading.Timer(delay, self._queue.put, args=((user_id, attempt),))
+        timer.daemon = True
+        timer.start()
+
+    # Finish the queued work and stop the thread
+    def shutdown(self, timeout=None):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def __len__(self):
+        return self._queue.qsize()
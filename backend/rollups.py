@@ -0,0 +1,233 @@
+"""Per-user daily rollups of transaction amounts by category and type.
+
+Rebuild every rollup from the transactions collection:  python rollups.py --rebuild
+Rebuild a single user:                                  python rollups.py --rebuild --user-id <id>
+"""
+import argparse
+import contextlib
+import datetime
+import os
+import sys
+import time
+
+import pymongo
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+import indexes
+from versions import all_user_ids, bump_versions
+
+ROLLUP_COLLECTION = 'daily_rollups'
+
+# A full rebuild is written here, then renamed over ROLLUP_COLLECTION
+REBUILD_COLLECTION = 'daily_rollups_rebuild'
+
+# One document per running rebuild, _id the user or ALL_USERS. The API refuses transaction
+# writes for a user while a rebuild covers them (see rebuilding()).
+REBUILD_LOCK_COLLECTION = 'rollup_rebuilds'
+ALL_USERS = 'all'
+
+# How long a rebuild waits after taking its lock, so that writes which started before it
+# (and still $inc the live rows) finish before the transactions are read
+REBUILD_DRAIN_SECONDS = 30
+
+
+def rollups_collection(db):
+    return db[ROLLUP_COLLECTION]
+
+
+def day_of(date):
+    return datetime.datetime(date.year, date.month, date.day)
+
+
+def rollup_key(transaction):
+    return (
+        transaction['user_id'],
+        day_of(transaction.get('date') or datetime.datetime.utcnow()),
+        transaction.get('category') or 'Uncategorized',
+        transaction.get('type') or 'expense'
+    )
+
+
+# Fold newly written (sign=1) or removed (sign=-1) transactions into the rollups with $inc
+def apply_transactions(db, transactions, sign=1):
+    deltas = {}
+    for transaction in transactions:
+        key = rollup_key(transaction)
+        amount, count = deltas.get(key, (0, 0))
+        deltas[key] = (amount + transaction.get('amount', 0), count + 1)
+
+    if not deltas:
+        return
+
+    rollups_collection(db).bulk_write([
+        UpdateOne(
+            {'user_id': user_id, 'day': day, 'category': category, 'type': transaction_type},
+            {'$inc': {'amount': sign * amount, 'count': sign * count}},
+            upsert=True
+        )
+        for (user_id, day, category, transaction_type), (amount, count) in deltas.items()
+    ], ordered=False)
+
+
+class RebuildInProgress(Exception):
+    pass
+
+
+# Whether a rebuild covering the user is running; transaction writes must wait for it
+def rebuilding(db, user_id):
+    return db[REBUILD_LOCK_COLLECTION].count_documents({'_id': {'$in': [user_id, ALL_USERS]}}, limit=1) > 0
+
+
+# Raise RebuildInProgress instead of writing transactions the rebuild could miss or count twice
+def check_writable(db, user_id):
+    if rebuilding(db, user_id):
+        raise RebuildInProgress()
+
+
+@contextlib.contextmanager
+def _rebuild_lock(db, user_id, drain_seconds):
+    scope = ALL_USERS if user_id is None else user_id
+    rebuild_id = ObjectId()
+    # Replaced rather than inserted, so a rebuild that was killed does not block the next one
+    db[REBUILD_LOCK_COLLECTION].replace_one(
+        {'_id': scope},
+        {'rebuild_id': rebuild_id, 'started_at': datetime.datetime.utcnow()},
+        upsert=True
+    )
+    try:
+        time.sleep(drain_seconds)
+        yield rebuild_id
+    finally:
+        db[REBUILD_LOCK_COLLECTION].delete_one({'_id': scope, 'rebuild_id': rebuild_id})
+
+
+# $group and $project stages that turn transactions into rollup rows
+def _rollup_stages():
+    return [
+        {'$group': {
+            '_id': {
+                'user_id': '$user_id',
+                'day': {'$dateFromParts': {
+                    'year': {'$year': '$date'},
+                    'month': {'$month': '$date'},
+                    'day': {'$dayOfMonth': '$date'}
+                }},
+                'category': {'$ifNull': ['$category', 'Uncategorized']},
+                'type': {'$ifNull': ['$type', 'expense']}
+            },
+            'amount': {'$sum': '$amount'},
+            'count': {'$sum': 1}
+        }},
+        {'$project': {
+            '_id': 0,
+            'user_id': '$_id.user_id',
+            'day': '$_id.day',
+            'category': '$_id.category',
+            'type': '$_id.type',
+            'amount': 1,
+            'count': 1
+        }}
+    ]
+
+
+# Recompute rollups from source transactions, for one user or for everyone. Readers never
+# see a partly rebuilt user: a full rebuild is written to a separate collection and renamed
+# over the live one, and a single user's rows are replaced in place before the rows that no
+# longer have transactions are deleted.
+# An $inc landing between the read and the replace would be lost or counted twice, so the
+# rebuild holds a lock that stops the API from writing the users' transactions, and first
+# waits drain_seconds for writes already under way. Writes made outside the API (bulk loads,
+# categorize.py --apply) must not run during a rebuild.
+def rebuild(db, user_id=None, drain_seconds=REBUILD_DRAIN_SECONDS):
+    with _rebuild_lock(db, user_id, drain_seconds) as rebuild_id:
+        if user_id is None:
+            db.transactions.aggregate([*_rollup_stages(), {'$out': REBUILD_COLLECTION}])
+            db[REBUILD_COLLECTION].create_indexes(indexes.INDEXES[ROLLUP_COLLECTION])
+            db[REBUILD_COLLECTION].rename(ROLLUP_COLLECTION, dropTarget=True)
+            return
+
+        db.transactions.aggregate([
+            {'$match': {'user_id': user_id}},
+            *_rollup_stages(),
+            {'$set': {'rebuild_id': rebuild_id}},
+            {'$merge': {
+                'into': ROLLUP_COLLECTION,
+                'on': ['user_id', 'day', 'category', 'type'],
+                'whenMatched': 'replace',
+                'whenNotMatched': 'insert'
+            }}
+        ])
+        rollups_collection(db).delete_many({'user_id': user_id, 'rebuild_id': {'$ne': rebuild_id}})
+
+
+def _range_match(user_id, start, end):
+    # start and end are inclusive calendar days
+    return {'$match': {'user_id': user_id, 'day': {'$gte': day_of(start), '$lte': day_of(end)}}}
+
+
+# Income and expense totals between two days, read from at most one rollup per day/category/type
+def totals(db, user_id, start, end):
+    result = {'income': 0, 'expense': 0}
+    for row in rollups_collection(db).aggregate([
+        _range_match(user_id, start, end),
+        {'$group': {'_id': '$type', 'amount': {'$sum': '$amount'}}}
+    ]):
+        result[row['_id']] = row['amount']
+    return result
+
+
+GROUPINGS = {
+    'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$day'}},
+    'month': {'$dateToString': {'format': '%Y-%m', 'date': '$day'}},
+    'category': '$category'
+}
+
+
+# Income and expense totals bucketed by day, month or category
+def series(db, user_id, start, end, group_by='day'):
+    rows = rollups_collection(db).aggregate([
+        _range_match(user_id, start, end),
+        {'$group': {
+            '_id': GROUPINGS[group_by],
+            'income': {'$sum': {'$cond': [{'$eq': ['$type', 'income']}, '$amount', 0]}},
+            'expenses': {'$sum': {'$cond': [{'$eq': ['$type', 'expense']}, '$amount', 0]}},
+            'count': {'$sum': '$count'}
+        }},
+        {'$sort': {'_id': 1}}
+    ])
+    return [{
+        'key': row['_id'],
+        'income': row['income'],
+        'expenses': row['expenses'],
+        'net': row['income'] - row['expenses'],
+        'count': row['count']
+    } for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--database', default='finfine')
+    parser.add_argument('--rebuild', action='store_true', help='recompute rollups from transactions')
+    parser.add_argument('--user-id', help='limit the rebuild to one user')
+    parser.add_argument('--drain-seconds', type=float, default=REBUILD_DRAIN_SECONDS, help='wait for in-flight writes')
+    args = parser.parse_args()
+
+    if not args.rebuild:
+        parser.print_help()
+        return 1
+
+    db = pymongo.MongoClient(args.mongo_uri)[args.database]
+    # $merge needs the unique index on the rollup key, which a fresh database may not have yet
+    indexes.ensure_indexes(db)
+    user_id = ObjectId(args.user_id) if args.user_id else None
+    rebuild(db, user_id, args.drain_seconds)
+    # Analytics and budgets read the rollups, so cached responses and ETags must not outlive them
+    bump_versions(db, [user_id] if user_id else all_user_ids(db))
+    print(f'Rebuilt rollups ({rollups_collection(db).estimated_document_count()} rows)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Response schemas for each resource, and a JSON provider that serializes ObjectId and datetime natively.
+
+A schema lists the fields a resource returns with the default used when a document lacks one.
+The same declaration gives the MongoDB projection (only those fields are read), the
+aggregation expressions for server-side shaping, and the row builder for responses.
+"""
+import datetime
+
+from bson.objectid import ObjectId
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional; the standard library encoder is used without it
+    orjson = None
+
+
+def _now():
+    return datetime.datetime.utcnow()
+
+
+class Schema:
+    def __init__(self, **fields):
+        # field -> default; a callable default is called for each document missing the field
+        self.fields = fields
+        self.projection = dict.fromkeys(fields, 1)
+        self._static = [(name, default) for name, default in fields.items() if not callable(default)]
+        self._computed = [(name, default) for name, default in fields.items() if callable(default)]
+
+    def dump(self, document):
+        row = {'id': document.get('_id')}
+        for name, default in self._static:
+            row[name] = document.get(name, default)
+        for name, default in self._computed:
+            value = document.get(name)
+            row[name] = value if value is not None else default()
+        return row
+
+    def dump_many(self, documents):
+        return [self.dump(document) for document in documents]
+
+    # $project expressions that apply the same defaults inside an aggregation
+    def aggregation_fields(self):
+        return {
+            name: 1 if default is None or callable(default) else {'$ifNull': ['$' + name, default]}
+            for name, default in self.fields.items()
+        }
+
+
+USER = Schema(name='', email='', avatar='', role='Standard User')
+
+ACCOUNT = Schema(name='', type='', balance=0, currency='USD')
+
+TRANSACTION = Schema(date=_now, description='', amount=0, category='Uncategorized', type='expense')
+
+BUDGET = Schema(category='', amount=0, spent=0, period='monthly', period_start=None)
+
+GOAL = Schema(name='', target_amount=0, current_amount=0, deadline=None, priority='medium')
+
+SETTINGS = Schema(
+    theme='light',
+    currency='USD',
+    language='English',
+    notifications={},
+    privacy={},
+    dashboard={},
+    created_at=_now,
+    updated_at=_now
+)
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    # Same as Flask's provider, but ObjectIds become strings and datetimes ISO 8601 strings
+    @staticmethod
+    def default(value):
+        try:
+            return _default(value)
+        except TypeError:
+            return DefaultJSONProvider.default(value)
+
+
+class OrjsonProvider(JSONProvider):
+    # orjson writes naive datetimes in the same ISO 8601 form as isoformat()
+    option = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=self.option),
+            mimetype='application/json'
+        )
+
+
+def json_provider_class():
+    return OrjsonProvider if orjson is not None else StdlibJSONProvider
@@ -0,0 +1,166 @@
+"""Fuzzy search over transaction descriptions.
+
+Each transaction stores the trigrams of its description in `search_grams`, indexed together
+with user_id as a multikey index. Every word is padded with a space on both sides first, so
+word starts and ends get grams of their own: 'amazon' -> ' am', 'ama', 'maz', 'azo', 'zon', 'on '.
+
+A search ranks candidates by the share of query trigrams they contain, newest first among
+equal scores. The last query word is taken as a prefix, and a typo only costs the few
+trigrams that overlap it, so 'amaz' and 'amazn' both find 'AMAZON MKTP'.
+
+A match must contain at least MIN_SCORE of the query's n trigrams, say k of them, so it
+contains at least one of any n - k + 1 of them. Only those n - k + 1 are looked up through
+the index, choosing the user's rarest, so a common gram such as ' ci' does not pull in every
+row that shares it.
+
+Add search_grams to transactions written before it existed:  python search.py --backfill [--user-id <id>]
+"""
+import argparse
+import math
+import os
+import re
+import sys
+
+import pymongo
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+from concurrency import fan_out
+from versions import bump_versions
+
+SEARCH_FIELD = 'search_grams'
+
+# Shortest query that can be looked up (two characters form the ' xy' start-of-word gram)
+MIN_QUERY_LENGTH = 2
+MAX_QUERY_LENGTH = 100
+
+# Share of the query's trigrams a description must contain to be a match
+MIN_SCORE = 0.5
+
+# Only the start of very long descriptions is indexed
+MAX_INDEXED_LENGTH = 200
+
+# Gram counts used to pick the rarest grams stop here; grams at least this common rank equally
+RARITY_COUNT_LIMIT = 1000
+
+BACKFILL_BATCH_SIZE = 1000
+
+_SEPARATOR = re.compile(r'[^a-z0-9]+')
+
+
+def _words(text):
+    return _SEPARATOR.sub(' ', (text or '').lower()).split()
+
+
+def _grams(padded):
+    return [padded[i:i + 3] for i in range(max(len(padded) - 2, 1))]
+
+
+# Trigrams stored on a transaction
+def description_grams(description):
+    grams = set()
+    for word in _words((description or '')[:MAX_INDEXED_LENGTH]):
+        grams.update(_grams(f' {word} '))
+    return sorted(grams)
+
+
+# Trigrams looked up for a query; the last word may be incomplete, so it is not closed with a space
+def query_grams(query):
+    words = _words(query)
+    grams = set()
+    for i, word in enumerate(words):
+        grams.update(_grams(f' {word} ' if i < len(words) - 1 else f' {word}'))
+    return sorted(grams)
+
+
+# The grams to look up: the rarest n - k + 1 of the n query grams, where k is the fewest a
+# match contains. counts maps grams to how many of the user's rows hold them.
+def lookup_grams(grams, counts=None):
+    required = math.ceil(MIN_SCORE * len(grams) - 1e-9)
+    rarest = sorted(grams, key=lambda gram: (counts or {}).get(gram, 0))
+    return sorted(rarest[:len(grams) - max(required, 1) + 1])
+
+
+# Rows per gram among the user's transactions, counted on the index up to RARITY_COUNT_LIMIT.
+# The counts run concurrently. A single $group over the grams could not stop at the limit, and
+# would read every row holding a common gram.
+def gram_counts(collection, user_id, grams):
+    if not grams:
+        return {}
+    counts = fan_out(*(
+        lambda gram=gram: collection.count_documents({'user_id': user_id, SEARCH_FIELD: gram}, limit=RARITY_COUNT_LIMIT)
+        for gram in grams
+    ))
+    return dict(zip(grams, counts))
+
+
+# Search pipeline for a user's transactions. filters are extra conditions on the transactions
+# (date and amount ranges, type, category) applied in the same index-backed $match.
+def search_pipeline(user_id, query, filters=None, limit=20, projection=None, counts=None):
+    grams = query_grams(query)
+    fields = dict(projection or {})
+    return [
+        {'$match': {'user_id': user_id, SEARCH_FIELD: {'$in': lookup_grams(grams, counts)}, **(filters or {})}},
+        {'$addFields': {'score': {'$divide': [
+            {'$size': {'$setIntersection': ['$' + SEARCH_FIELD, grams]}},
+            len(grams)
+        ]}}},
+        {'$match': {'score': {'$gte': MIN_SCORE}}},
+        {'$sort': {'score': -1, 'date': -1, '_id': -1}},
+        {'$limit': limit},
+        {'$project': {**fields, 'score': 1}}
+    ]
+
+
+def search(collection, user_id, query, filters=None, limit=20, projection=None):
+    grams = query_grams(query)
+    if not grams:
+        return []
+    counts = gram_counts(collection, user_id, grams)
+    return list(collection.aggregate(search_pipeline(user_id, query, filters, limit, projection, counts)))
+
+
+# Index descriptions of transactions that do not have search_grams yet.
+# Returns the number indexed and the users they belong to.
+def backfill(db, user_id=None):
+    match = {SEARCH_FIELD: {'$exists': False}}
+    if user_id is not None:
+        match['user_id'] = user_id
+
+    updated, users = 0, set()
+    requests = []
+    for transaction in db.transactions.find(match, {'user_id': 1, 'description': 1}):
+        users.add(transaction.get('user_id'))
+        requests.append(UpdateOne(
+            {'_id': transaction['_id']},
+            {'$set': {SEARCH_FIELD: description_grams(transaction.get('description'))}}
+        ))
+        if len(requests) >= BACKFILL_BATCH_SIZE:
+            updated += db.transactions.bulk_write(requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        updated += db.transactions.bulk_write(requests, ordered=False).modified_count
+    return updated, users
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--database', default='finfine')
+    parser.add_argument('--backfill', action='store_true', help='index transactions without search_grams')
+    parser.add_argument('--user-id', help='limit to one user')
+    args = parser.parse_args()
+
+    if not args.backfill:
+        parser.print_help()
+        return 1
+
+    db = pymongo.MongoClient(args.mongo_uri)[args.database]
+    updated, users = backfill(db, ObjectId(args.user_id) if args.user_id else None)
+    bump_versions(db, users)
+    print(f'Indexed {updated} transactions for {len(users)} users')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
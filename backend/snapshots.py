@@ -0,0 +1,158 @@
+"""End-of-day account balance snapshots, bucketed into one document per user and month.
+
+Each bucket holds the day's balance of every account plus the day's net worth:
+    {user_id, month, balances: {<account_id>: {<day>: balance}}, net_worth: {<day>: total}}
+
+History starts with the first recorded snapshot. Account balances are not moved by transaction
+writes, so past balances cannot be reconstructed by replaying transactions.
+
+Record today's balances (run once a day, e.g. from cron):  python snapshots.py --record [--user-id <id>]
+"""
+import argparse
+import datetime
+import os
+import sys
+
+import pymongo
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+from rollups import day_of
+from versions import all_user_ids, bump_versions
+
+SNAPSHOT_COLLECTION = 'balance_snapshots'
+
+GRANULARITIES = ('day', 'week', 'month')
+
+# Users whose snapshots are written per bulk_write
+RECORD_BATCH_SIZE = 1000
+
+
+def snapshots_collection(db):
+    return db[SNAPSHOT_COLLECTION]
+
+
+def month_of(date):
+    return datetime.datetime(date.year, date.month, 1)
+
+
+def _snapshot_fields(day, balances):
+    # balances: account_id -> balance at the end of day
+    fields = {f'balances.{account_id}.{day.day}': round(balance, 2) for account_id, balance in balances.items()}
+    fields[f'net_worth.{day.day}'] = round(sum(balances.values()), 2)
+    return fields
+
+
+def _snapshot_update(user_id, day, balances):
+    return UpdateOne({'user_id': user_id, 'month': month_of(day)}, {'$set': _snapshot_fields(day, balances)}, upsert=True)
+
+
+# Snapshot every account's current balance as the given day's end-of-day balance
+def record(db, user_id=None, day=None):
+    day = day_of(day or datetime.datetime.utcnow())
+    match = {} if user_id is None else {'user_id': user_id}
+
+    recorded = 0
+    requests = []
+    current_user, balances = None, {}
+    # Accounts arrive grouped by user, so a user's snapshot is complete when the next user starts
+    for account in db.accounts.find(match, {'user_id': 1, 'balance': 1}).sort('user_id', 1):
+        if account['user_id'] != current_user:
+            if current_user is not None:
+                requests.append(_snapshot_update(current_user, day, balances))
+            if len(requests) >= RECORD_BATCH_SIZE:
+                snapshots_collection(db).bulk_write(requests, ordered=False)
+                recorded += len(requests)
+                requests = []
+            current_user, balances = account['user_id'], {}
+        balances[str(account['_id'])] = account.get('balance', 0)
+
+    if current_user is not None:
+        requests.append(_snapshot_update(current_user, day, balances))
+    if requests:
+        snapshots_collection(db).bulk_write(requests, ordered=False)
+    return recorded + len(requests)
+
+
+def _month_end(month):
+    return (month + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+
+
+# The days of one month that are points of the series: every day, every Sunday or the month's
+# last day, and always the end of the range
+def _points_in_month(month, start, end, granularity):
+    first, last = max(month, start), min(_month_end(month), end)
+    if first > last:
+        return []
+    if granularity == 'month':
+        return [last]
+
+    days = []
+    day = first if granularity == 'day' else first + datetime.timedelta(days=(6 - first.weekday()) % 7)
+    while day <= last:
+        days.append(day)
+        day += datetime.timedelta(days=1 if granularity == 'day' else 7)
+    if last == end and days[-1:] != [last]:
+        days.append(last)
+    return days
+
+
+# Net worth at the end of each day, week or month between start and end (inclusive days).
+# Reads one bucket per month in range plus the last bucket before it; days without a
+# snapshot carry the previous known value forward.
+def net_worth_series(db, user_id, start, end, granularity='day'):
+    start, end = day_of(start), day_of(end)
+    projection = {'month': 1, 'net_worth': 1}
+
+    buckets = {
+        bucket['month']: sorted((int(day), value) for day, value in bucket.get('net_worth', {}).items())
+        for bucket in snapshots_collection(db).find(
+            {'user_id': user_id, 'month': {'$gte': month_of(start), '$lte': month_of(end)}}, projection)
+    }
+
+    value = None
+    previous = snapshots_collection(db).find_one(
+        {'user_id': user_id, 'month': {'$lt': month_of(start)}}, projection, sort=[('month', -1)])
+    if previous and previous.get('net_worth'):
+        value = previous['net_worth'][max(previous['net_worth'], key=int)]
+
+    # Month by month, so the work grows with the points returned rather than the days spanned
+    points = []
+    month = month_of(start)
+    while month <= end:
+        known = buckets.get(month, [])
+        i = 0
+        for day in _points_in_month(month, start, end, granularity):
+            while i < len(known) and known[i][0] <= day.day:
+                value = known[i][1]
+                i += 1
+            if value is not None:
+                points.append({'date': day.strftime('%Y-%m-%d'), 'net_worth': value})
+        if known:
+            value = known[-1][1]
+        month = _month_end(month) + datetime.timedelta(days=1)
+    return points
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--database', default='finfine')
+    parser.add_argument('--record', action='store_true', help="snapshot today's balances")
+    parser.add_argument('--user-id', help='limit to one user')
+    args = parser.parse_args()
+
+    if not args.record:
+        parser.print_help()
+        return 1
+
+    db = pymongo.MongoClient(args.mongo_uri)[args.database]
+    user_id = ObjectId(args.user_id) if args.user_id else None
+    recorded = record(db, user_id)
+    bump_versions(db, [user_id] if user_id else all_user_ids(db))
+    print(f'Recorded snapshots for {recorded} users')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
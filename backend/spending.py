@@ -0,0 +1,204 @@
+"""Keeps each budget's `spent` current for its period.
+
+Expense writes are folded in with $inc on the budgets whose current period they fall in. A
+write in the current period also rolls its budgets over when they are still on an earlier
+period, in the same single-document update, so no write is lost to a concurrent roll-over.
+It follows that a budget still on an earlier period has spent nothing in the current one;
+readers roll such budgets over with one conditional update. Budgets can be recomputed from
+the transactions collection in bulk (e.g. after a bulk load, or for expenses dated in a
+future period, which are only counted from then on):
+
+Reconcile every budget:   python spending.py --reconcile
+Reconcile a single user:  python spending.py --reconcile --user-id <id>
+"""
+import argparse
+import datetime
+import os
+import sys
+
+import pymongo
+from bson.objectid import ObjectId
+from pymongo import UpdateMany
+
+from rollups import day_of, rollups_collection
+from versions import all_user_ids, bump_versions
+
+PERIODS = ('weekly', 'monthly', 'yearly')
+
+DEFAULT_PERIOD = 'monthly'
+
+
+# First day of the period containing date; weeks start on Monday
+def period_start(period, date):
+    day = day_of(date)
+    if period == 'weekly':
+        return day - datetime.timedelta(days=day.weekday())
+    if period == 'yearly':
+        return day.replace(month=1, day=1)
+    return day.replace(day=1)
+
+
+def next_period_start(period, start):
+    if period == 'weekly':
+        return start + datetime.timedelta(days=7)
+    if period == 'yearly':
+        return start.replace(year=start.year + 1)
+    return (start + datetime.timedelta(days=32)).replace(day=1)
+
+
+def _period_filter(period):
+    # Budgets without a period count as monthly
+    return {'$in': [period, None]} if period == DEFAULT_PERIOD else period
+
+
+def _category(transaction):
+    return transaction.get('category') or 'Uncategorized'
+
+
+# Fold newly written (sign=1) or removed (sign=-1) expenses into the budgets of their category.
+# Budgets whose stored period contains the transaction date are $inc-ed. For the current period,
+# budgets still on an earlier one are rolled over by the same update: their spend restarts at
+# this amount.
+def apply_transactions(db, transactions, sign=1, today=None):
+    today = today or datetime.datetime.utcnow()
+    deltas = {}
+    for transaction in transactions:
+        if (transaction.get('type') or 'expense') != 'expense':
+            continue
+        date = transaction.get('date') or datetime.datetime.utcnow()
+        for period in PERIODS:
+            key = (transaction['user_id'], _category(transaction), period, period_start(period, date))
+            deltas[key] = deltas.get(key, 0) + transaction.get('amount', 0)
+
+    if not deltas:
+        return
+
+    requests = []
+    for (user_id, category, period, start), amount in deltas.items():
+        match = {'user_id': user_id, 'category': category, 'period': _period_filter(period)}
+        if start == period_start(period, today):
+            requests.append(UpdateMany({**match, 'period_start': {'$lte': start}}, [{'$set': {
+                'spent': {'$cond': [
+                    {'$eq': ['$period_start', start]},
+                    {'$add': [{'$ifNull': ['$spent', 0]}, sign * amount]},
+                    sign * amount
+                ]},
+                'period_start': start
+            }}]))
+        else:
+            requests.append(UpdateMany({**match, 'period_start': start}, {'$inc': {'spent': sign * amount}}))
+    db.budgets.bulk_write(requests, ordered=False)
+
+
+# Expense totals per category between start (inclusive) and end (exclusive), from the daily rollups
+def _spent_by_category(db, user_id, start, end):
+    return {
+        row['_id']: row['amount']
+        for row in rollups_collection(db).aggregate([
+            {'$match': {'user_id': user_id, 'type': 'expense', 'day': {'$gte': start, '$lt': end}}},
+            {'$group': {'_id': '$category', 'amount': {'$sum': '$amount'}}}
+        ])
+    }
+
+
+# Move budgets whose stored period has ended into the current one. Takes the user's budget
+# documents (or summary rows), updates them in place and returns True when any was rolled over.
+def roll_over(db, user_id, budgets, today=None):
+    today = today or datetime.datetime.utcnow()
+    stale, untracked = set(), {}
+    for budget in budgets:
+        period = budget.get('period') or DEFAULT_PERIOD
+        start = period_start(period, today)
+        if budget.get('period_start') is None:
+            untracked.setdefault((period, start), []).append(budget)
+        elif budget['period_start'] < start:
+            stale.add((period, start))
+            budget['period_start'], budget['spent'] = start, 0
+
+    if not stale and not untracked:
+        return False
+
+    # Any expense written in the current period has already rolled its budgets over (see
+    # apply_transactions), so these have spent nothing in it. Conditional on the budget still
+    # being on an earlier period, so a concurrent write that rolled it over first is kept.
+    requests = [
+        UpdateMany(
+            {'user_id': user_id, 'period': _period_filter(period), 'period_start': {'$lt': start}},
+            {'$set': {'period_start': start, 'spent': 0}}
+        )
+        for period, start in stale
+    ]
+
+    # Budgets that never tracked a period start from the rollups. Until they have a period_start,
+    # writes do not $inc them, so run --reconcile after loading budgets to close that window.
+    for (period, start), budgets_in_period in untracked.items():
+        spent = _spent_by_category(db, user_id, start, next_period_start(period, start))
+        for category in {budget.get('category') for budget in budgets_in_period}:
+            requests.append(UpdateMany(
+                {'user_id': user_id, 'category': category, 'period': _period_filter(period),
+                 'period_start': {'$exists': False}},
+                {'$set': {'period_start': start, 'spent': spent.get(category or 'Uncategorized', 0)}}
+            ))
+        for budget in budgets_in_period:
+            budget['period_start'] = start
+            budget['spent'] = spent.get(budget.get('category') or 'Uncategorized', 0)
+
+    db.budgets.bulk_write(requests, ordered=False)
+    return True
+
+
+# Recompute every budget's current period and spend from the transactions collection
+def reconcile(db, user_id=None, today=None):
+    today = today or datetime.datetime.utcnow()
+    user_match = {} if user_id is None else {'user_id': user_id}
+
+    for period in PERIODS:
+        start = period_start(period, today)
+        budget_match = {**user_match, 'period': _period_filter(period)}
+
+        spent = db.transactions.aggregate([
+            {'$match': {
+                **user_match,
+                'type': 'expense',
+                'date': {'$gte': start, '$lt': next_period_start(period, start)}
+            }},
+            {'$group': {
+                '_id': {'user_id': '$user_id', 'category': {'$ifNull': ['$category', 'Uncategorized']}},
+                'amount': {'$sum': '$amount'}
+            }}
+        ])
+
+        # Reset first, then set the categories that had spending in this period
+        requests = [UpdateMany(budget_match, {'$set': {'period_start': start, 'spent': 0}})]
+        requests.extend(
+            UpdateMany(
+                {**budget_match, 'user_id': row['_id']['user_id'], 'category': row['_id']['category']},
+                {'$set': {'spent': row['amount']}}
+            )
+            for row in spent
+        )
+        db.budgets.bulk_write(requests, ordered=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--database', default='finfine')
+    parser.add_argument('--reconcile', action='store_true', help='recompute budget spend from transactions')
+    parser.add_argument('--user-id', help='limit reconciliation to one user')
+    args = parser.parse_args()
+
+    if not args.reconcile:
+        parser.print_help()
+        return 1
+
+    db = pymongo.MongoClient(args.mongo_uri)[args.database]
+    user_id = ObjectId(args.user_id) if args.user_id else None
+    reconcile(db, user_id)
+    bump_versions(db, [user_id] if user_id else all_user_ids(db))
+    print(f'Reconciled budgets ({db.budgets.estimated_document_count()} budgets)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,346 @@
+"""Streaming parsers for bank statement files (CSV, OFX and QIF) and the batched import that writes them."""
+import codecs
+import csv
+import datetime
+import hashlib
+import re
+import time
+
+from pymongo.errors import BulkWriteError
+
+from search import description_grams
+
+FORMATS = ('csv', 'ofx', 'qif')
+
+# Rows are written in batches of this size
+IMPORT_BATCH_SIZE = 1000
+
+# At most this many row errors are reported back to the client
+MAX_REPORTED_ERRORS = 10
+
+DUPLICATE_KEY_ERROR = 11000
+
+OFX_CHUNK_SIZE = 64 * 1024
+
+DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y', '%m/%d/%y', '%d.%m.%Y', '%Y%m%d')
+
+CSV_COLUMNS = {
+    'date': ('date', 'transaction date', 'posted date', 'posting date', 'booking date'),
+    'description': ('description', 'payee', 'name', 'merchant', 'details', 'memo', 'narrative'),
+    'amount': ('amount', 'value', 'transaction amount'),
+    'debit': ('debit', 'withdrawal', 'withdrawals', 'money out'),
+    'credit': ('credit', 'deposit', 'deposits', 'money in'),
+    'category': ('category',),
+    'type': ('type', 'transaction type')
+}
+
+
+class StatementError(ValueError):
+    pass
+
+
+def detect_format(filename):
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return extension if extension in FORMATS else None
+
+
+def parse_date(value, date_format=None):
+    value = value.strip()
+    formats = (date_format,) if date_format else DATE_FORMATS
+    for fmt in formats:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise StatementError(f'Unrecognised date "{value}"')
+
+
+def parse_amount(value):
+    cleaned = value.strip().replace(',', '').replace('$', '')
+    # Accounting style negatives: (12.50)
+    if cleaned.startswith('(') and cleaned.endswith(')'):
+        cleaned = '-' + cleaned[1:-1]
+    try:
+        return float(cleaned)
+    except ValueError:
+        raise StatementError(f'Unrecognised amount "{value}"')
+
+
+def _parsed(build, record):
+    # Bad rows are yielded as their error so the import can count them and carry on
+    try:
+        return build(record)
+    except StatementError as e:
+        return e
+    except ValueError as e:
+        # e.g. a QIF date with month 13, which parses but is not a date
+        return StatementError(str(e))
+
+
+def _csv_rows(lines, date_format=None):
+    reader = csv.reader(lines)
+
+    # A malformed line (an oversized field, a NUL byte) leaves the reader unusable, so it
+    # ends the import rather than being skipped like a row with a bad value
+    def read():
+        try:
+            return next(reader, None)
+        except csv.Error as e:
+            raise StatementError(f'Malformed CSV: {e}')
+
+    header = [column.strip().lower() for column in read() or []]
+
+    columns = {}
+    for field, aliases in CSV_COLUMNS.items():
+        for alias in aliases:
+            if alias in header:
+                columns[field] = header.index(alias)
+                break
+
+    if 'date' not in columns or 'description' not in columns or not (
+            'amount' in columns or 'debit' in columns or 'credit' in columns):
+        raise StatementError('CSV header must have date, description and amount (or debit/credit) columns')
+
+    def cell(row, field):
+        index = columns.get(field)
+        return row[index].strip() if index is not None and index < len(row) else ''
+
+    def build(row):
+        if cell(row, 'amount'):
+            amount = parse_amount(cell(row, 'amount'))
+        else:
+            amount = (parse_amount(cell(row, 'credit')) if cell(row, 'credit') else 0) - \
+                (parse_amount(cell(row, 'debit')) if cell(row, 'debit') else 0)
+
+        # Some exports keep amounts positive and carry the direction in a type column
+        if cell(row, 'type').lower() in ('debit', 'expense', 'withdrawal') and amount > 0:
+            amount = -amount
+
+        return {
+            'date': parse_date(cell(row, 'date'), date_format),
+            'description': cell(row, 'description'),
+            'amount': amount,
+            'category': cell(row, 'category') or None
+        }
+
+    def rows():
+        for row in iter(read, None):
+            if any(row):
+                yield _parsed(build, row)
+
+    # The header is checked before any row is read, so a bad file fails up front
+    return rows()
+
+
+def _ofx_tokens(reader):
+    # OFX 1.x is SGML without closing tags and may put the whole file on one line,
+    # so read fixed-size chunks and split on '<' rather than on newlines.
+    pending = ''
+    for chunk in iter(lambda: reader.read(OFX_CHUNK_SIZE), ''):
+        pending += chunk
+        parts = pending.split('<')
+        pending = parts.pop()
+        for part in parts:
+            if part:
+                tag, _, value = part.partition('>')
+                yield tag.upper(), value.strip()
+    if pending:
+        tag, _, value = pending.partition('>')
+        yield tag.upper(), value.strip()
+
+
+def _build_ofx(record):
+    if 'DTPOSTED' not in record or 'TRNAMT' not in record:
+        raise StatementError('OFX transaction without DTPOSTED or TRNAMT')
+    return {
+        'date': parse_date(record['DTPOSTED'][:8], '%Y%m%d'),
+        'description': record.get('NAME') or record.get('MEMO') or '',
+        'amount': parse_amount(record['TRNAMT']),
+        'category': None,
+        'external_id': record.get('FITID')
+    }
+
+
+def _ofx_rows(reader, date_format=None):
+    record = None
+    for tag, value in _ofx_tokens(reader):
+        if tag == 'STMTTRN':
+            record = {}
+        elif tag == '/STMTTRN' and record is not None:
+            yield _parsed(_build_ofx, record)
+            record = None
+        elif record is not None and not tag.startswith('/'):
+            record[tag] = value
+
+
+QIF_SHORT_YEAR = re.compile(r"^(\d{1,2})/(\d{1,2})'\s*(\d{2})$")
+
+
+def _qif_date(value, date_format=None):
+    # Quicken writes years after 2000 as 1/15'24
+    match = QIF_SHORT_YEAR.match(value.strip())
+    if match:
+        month, day, year = match.groups()
+        return datetime.datetime(2000 + int(year), int(month), int(day))
+    return parse_date(value, date_format)
+
+
+def _qif_rows(lines, date_format=None):
+    def build(record):
+        if 'D' not in record or ('T' not in record and 'U' not in record):
+            raise StatementError('QIF record without date or amount')
+        category = record.get('L')
+        return {
+            'date': _qif_date(record['D'], date_format),
+            'description': record.get('P') or record.get('M') or '',
+            'amount': parse_amount(record.get('T') or record['U']),
+            # [Account] in the category field marks a transfer, not a category
+            'category': category if category and not category.startswith('[') else None
+        }
+
+    record = {}
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line or line.startswith('!'):
+            continue
+
+        code, value = line[0], line[1:].strip()
+        if code == '^':
+            yield _parsed(build, record)
+            record = {}
+        else:
+            record.setdefault(code, value)
+
+
+PARSERS = {
+    'csv': _csv_rows,
+    'ofx': _ofx_rows,
+    'qif': _qif_rows
+}
+
+
+# Yield one parsed row (or the StatementError it raised) per statement transaction.
+# The binary stream is decoded lazily, so memory use does not depend on the file size.
+def parse_statement(stream, statement_format, date_format=None):
+    reader = codecs.getreader('utf-8-sig')(stream, errors='replace')
+    return PARSERS[statement_format](reader, date_format)
+
+
+def _normalized_description(description):
+    # Case and spacing differ between exports of the same statement
+    return ' '.join((description or '').lower().split())
+
+
+# What identifies a row without a FITID: identical rows in one file share it
+def content_key(user_id, row):
+    return '|'.join([
+        str(user_id),
+        row['date'].isoformat(),
+        f"{row['amount']:.2f}",
+        _normalized_description(row['description'])
+    ])
+
+
+def import_hash(user_id, row, occurrence=0):
+    # The bank's FITID identifies an OFX transaction on its own, whatever else an edited export changed
+    if row.get('external_id'):
+        return hashlib.sha1(f"{user_id}|fitid|{row['external_id']}".encode()).hexdigest()
+    # occurrence counts the identical rows before this one in the same file (two coffees on the
+    # same day), so re-importing the file, or an overlapping one, reproduces the same hashes
+    return hashlib.sha1(f'{content_key(user_id, row)}|{occurrence}'.encode()).hexdigest()
+
+
+def _insert_batch(collection, batch):
+    # Unordered insert so one duplicate does not stop the rest of the batch
+    try:
+        collection.insert_many(batch, ordered=False)
+        return batch, 0
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(error.get('code') != DUPLICATE_KEY_ERROR for error in errors):
+            raise
+        failed = {error['index'] for error in errors}
+        return [doc for i, doc in enumerate(batch) if i not in failed], len(failed)
+
+
+# Import parsed statement rows into the transactions collection.
+# Yields a progress dict after every batch; the last one has 'done': True. A file that
+# cannot be read past some row ends the import there, and the last report carries an 'error'.
+# on_inserted is called with the documents that were actually written. categorize, when
+# given, maps a description and type to a category for rows the statement left uncategorized.
+def import_statement(collection, user_id, rows, on_inserted=None, account_id=None, categorize=None,
+                     batch_size=IMPORT_BATCH_SIZE):
+    started = time.perf_counter()
+    now = datetime.datetime.utcnow()
+    progress = {'rows': 0, 'inserted': 0, 'duplicates': 0, 'skipped': 0, 'errors': []}
+    # Identical rows seen so far, keyed by the 20-byte digest of their content
+    occurrences = {}
+    batch = []
+
+    def report(done=False):
+        elapsed = time.perf_counter() - started
+        return {
+            **progress,
+            'errors': list(progress['errors']),
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(progress['rows'] / elapsed) if elapsed > 0 else 0,
+            'done': done
+        }
+
+    def flush():
+        inserted, duplicates = _insert_batch(collection, batch)
+        progress['inserted'] += len(inserted)
+        progress['duplicates'] += duplicates
+        if inserted and on_inserted:
+            on_inserted(inserted)
+        batch.clear()
+
+    rows = iter(rows)
+    while True:
+        try:
+            row = next(rows, None)
+        except StatementError as e:
+            if batch:
+                flush()
+            yield {**report(done=True), 'error': f"Row {progress['rows'] + 1}: {e}"}
+            return
+        if row is None:
+            break
+
+        progress['rows'] += 1
+        if isinstance(row, StatementError):
+            progress['skipped'] += 1
+            if len(progress['errors']) < MAX_REPORTED_ERRORS:
+                progress['errors'].append(f"Row {progress['rows']}: {row}")
+            continue
+
+        occurrence = 0
+        if not row.get('external_id'):
+            key = hashlib.sha1(content_key(user_id, row).encode()).digest()
+            occurrence = occurrences.get(key, 0)
+            occurrences[key] = occurrence + 1
+
+        transaction = {
+            'user_id': user_id,
+            'date': row['date'],
+            'description': row['description'],
+            'amount': abs(row['amount']),
+            'type': 'income' if row['amount'] > 0 else 'expense',
+            'import_hash': import_hash(user_id, row, occurrence),
+            'search_grams': description_grams(row['description']),
+            'created_at': now
+        }
+        category = row['category'] or (categorize(row['description'], transaction['type']) if categorize else None)
+        if category:
+            transaction['category'] = category
+        if account_id is not None:
+            transaction['account_id'] = account_id
+        batch.append(transaction)
+
+        if len(batch) >= batch_size:
+            flush()
+            yield report()
+
+    if batch:
+        flush()
+    yield report(done=True)
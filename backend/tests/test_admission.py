@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+import admission
+
+
+def test_route_classes():
+    assert admission.route_class('POST', '/api/login') == 'auth'
+    assert admission.route_class('POST', '/api/import/transactions') == 'import'
+    assert admission.route_class('GET', '/api/export/transactions') == 'export'
+    assert admission.route_class('POST', '/api/dashboard/goals/simulation') == 'simulation'
+    assert admission.route_class('GET', '/api/dashboard/summary') == 'dashboard'
+    assert admission.route_class('GET', '/api/dashboard/transactions') == 'read'
+    assert admission.route_class('POST', '/api/dashboard/transactions') == 'write'
+
+
+def test_requests_beyond_the_limit_and_queue_are_shed():
+    limiter = admission.ConcurrencyLimiter('dashboard', limit=1, queue=0, timeout=0.01)
+    limiter.acquire()
+
+    with pytest.raises(admission.Overloaded) as e:
+        limiter.acquire()
+    assert e.value.route_class == 'dashboard'
+    assert e.value.retry_after == admission.RETRY_AFTER
+
+    limiter.release()
+    limiter.acquire()
+    assert limiter.stats() == {'limit': 1, 'queue': 0, 'active': 1, 'waiting': 0, 'admitted': 2, 'rejected': 1}
+
+
+def test_queued_request_gets_a_released_slot():
+    limiter = admission.ConcurrencyLimiter('export', limit=1, queue=1, timeout=5)
+    limiter.acquire()
+    admitted = threading.Event()
+
+    def wait_for_slot():
+        limiter.acquire()
+        admitted.set()
+
+    waiter = threading.Thread(target=wait_for_slot)
+    waiter.start()
+    while limiter.stats()['waiting'] == 0:
+        pass
+
+    # The queue is full, so a third request is shed without waiting
+    with pytest.raises(admission.Overloaded):
+        limiter.acquire()
+
+    limiter.release()
+    waiter.join(timeout=5)
+    assert admitted.is_set()
+    assert limiter.stats()['rejected'] == 1
+
+
+def test_queued_request_times_out():
+    limiter = admission.ConcurrencyLimiter('import', limit=1, queue=1, timeout=0.05)
+    limiter.acquire()
+    with pytest.raises(admission.Overloaded):
+        limiter.acquire()
+    assert limiter.stats()['waiting'] == 0
+
+
+def test_unlimited_classes_are_not_tracked():
+    control = admission.AdmissionControl({'dashboard': (1, 0), 'read': (0, 0)}, timeout=0.01)
+    assert control.admit('GET', '/api/dashboard/transactions') is None
+
+    slot = control.admit('GET', '/api/dashboard/summary')
+    with pytest.raises(admission.Overloaded):
+        control.admit('GET', '/api/dashboard/forecast')
+    slot.release()
+    assert list(control.stats()) == ['dashboard']
+
+
+def test_token_bucket_allows_a_burst_then_the_rate(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, 'monotonic', lambda: now[0])
+    bucket = admission.TokenBucket(capacity=2, rate=1)
+
+    assert bucket.take('ip:1', 'email:a') == 0
+    assert bucket.take('ip:1', 'email:a') == 0
+    assert bucket.take('ip:1', 'email:a') == pytest.approx(1)
+    # An empty bucket takes no token from the others
+    assert bucket.take('ip:1', 'email:b') == pytest.approx(1)
+    assert bucket.take('ip:2', 'email:b') == 0
+
+    now[0] += 1
+    assert bucket.take('ip:1', 'email:a') == 0
@@ -0,0 +1,123 @@
+import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+import forecast
+import versions
+
+mongomock = pytest.importorskip('mongomock')
+
+USER_ID = ObjectId()
+
+TODAY = datetime.datetime(2024, 6, 20)
+
+
+def _history():
+    transactions = []
+    for month in range(1, 7):
+        transactions.append({'description': f'NETFLIX.COM {4800 + month}-{month}', 'amount': 15.99,
+                             'type': 'expense', 'date': datetime.datetime(2024, month, 5)})
+        transactions.append({'description': 'ACME PAYROLL', 'amount': 2500 + month, 'type': 'income',
+                             'date': datetime.datetime(2024, month, 1)})
+    for week in range(10):
+        transactions.append({'description': 'City Gym', 'amount': 12, 'type': 'expense',
+                             'date': datetime.datetime(2024, 4, 15) + datetime.timedelta(weeks=week)})
+    # Irregular intervals, unstable amounts, too few occurrences, and a series that stopped
+    for day, amount in ((2, 40), (3, 35), (20, 60), (28, 45)):
+        transactions.append({'description': 'Corner Store', 'amount': amount, 'type': 'expense',
+                             'date': datetime.datetime(2024, 5, day)})
+    for month, amount in ((3, 20), (4, 200), (5, 90)):
+        transactions.append({'description': 'Utility Co', 'amount': amount, 'type': 'expense',
+                             'date': datetime.datetime(2024, month, 10)})
+    for month in (5, 6):
+        transactions.append({'description': 'Spotify', 'amount': 9.99, 'type': 'expense',
+                             'date': datetime.datetime(2024, month, 12)})
+    for month in (1, 2, 3):
+        transactions.append({'description': 'Old Magazine', 'amount': 5, 'type': 'expense',
+                             'date': datetime.datetime(2024, month, 8)})
+    return transactions
+
+
+def test_description_key_ignores_digits_punctuation_and_case():
+    assert forecast.description_key({'description': 'NETFLIX.COM 4829-11'}) == \
+        forecast.description_key({'description': 'Netflix.com 5120-12', 'type': 'expense'})
+    assert forecast.description_key({'description': 'Refund', 'type': 'income'}) != \
+        forecast.description_key({'description': 'Refund', 'type': 'expense'})
+
+
+def test_recurring_series_are_detected_by_cadence():
+    series = {item['description']: item for item in forecast.recurring(forecast._analyze(_history()), TODAY)}
+
+    assert set(series) == {'NETFLIX.COM 4806-6', 'ACME PAYROLL', 'City Gym'}
+    assert series['NETFLIX.COM 4806-6'] == {
+        'description': 'NETFLIX.COM 4806-6', 'type': 'expense', 'cadence': 'monthly', 'amount': 15.99,
+        'occurrences': 6, 'last_date': '2024-06-05', 'next_date': '2024-07-05'
+    }
+    assert series['ACME PAYROLL']['type'] == 'income'
+    assert series['ACME PAYROLL']['amount'] == 2503.5
+    assert series['City Gym']['cadence'] == 'weekly'
+    assert series['City Gym']['next_date'] == '2024-06-24'
+
+
+def test_folding_new_transactions_matches_a_full_analysis():
+    history = sorted(_history(), key=lambda transaction: transaction['date'])
+    earlier = [transaction for transaction in history if transaction['date'] < datetime.datetime(2024, 5, 1)]
+    later = [transaction for transaction in history if transaction['date'] >= datetime.datetime(2024, 5, 1)]
+
+    folded = forecast._fold(forecast._analyze(earlier), later)
+    full = forecast._analyze(history)
+    assert folded.keys() == full.keys()
+    for key, group in full.items():
+        for field in forecast.GROUP_FIELDS:
+            assert folded[key][field] == pytest.approx(group[field]), (key, field)
+
+
+def test_back_dated_transaction_cannot_be_folded():
+    stats = forecast._analyze(_history())
+    back_dated = {'description': 'City Gym', 'amount': 12, 'type': 'expense', 'date': datetime.datetime(2024, 1, 1)}
+    assert forecast._fold(stats, [back_dated]) is None
+
+
+def test_monthly_steps_clamp_to_the_end_of_the_month():
+    assert forecast._step(datetime.datetime(2024, 1, 31), 'monthly') == datetime.datetime(2024, 2, 29)
+    assert forecast._step(datetime.datetime(2024, 11, 30), 'quarterly') == datetime.datetime(2025, 2, 28)
+    assert forecast._step(datetime.datetime(2024, 2, 29), 'yearly') == datetime.datetime(2025, 2, 28)
+
+
+def test_series_stats_reads_only_new_transactions_after_a_write():
+    db = mongomock.MongoClient().db
+    db.transactions.insert_many([{**transaction, 'user_id': USER_ID} for transaction in _history()])
+    stats = forecast.series_stats(db, USER_ID, versions.bump_version(db, USER_ID))
+    assert stats['expense|city gym']['count'] == 10
+
+    # Unchanged version: answered from the stored groups
+    assert forecast.series_stats(db, USER_ID, versions.current_version(db, USER_ID)) == stats
+
+    analysis_id = db[forecast.STATE_COLLECTION].find_one({'_id': USER_ID})['analysis_id']
+    db.transactions.insert_one({'user_id': USER_ID, 'description': 'City Gym', 'amount': 12, 'type': 'expense',
+                                'date': datetime.datetime(2024, 6, 24)})
+    stats = forecast.series_stats(db, USER_ID, versions.bump_version(db, USER_ID))
+    assert stats['expense|city gym']['count'] == 11
+    assert db[forecast.STATE_COLLECTION].find_one({'_id': USER_ID})['analysis_id'] == analysis_id
+
+    # A back-dated write is folded in by a full analysis
+    back_dated = db.transactions.insert_one({'user_id': USER_ID, 'description': 'City Gym', 'amount': 12,
+                                             'type': 'expense', 'date': datetime.datetime(2024, 1, 1)}).inserted_id
+    stats = forecast.series_stats(db, USER_ID, versions.bump_version(db, USER_ID))
+    assert stats['expense|city gym']['count'] == 12
+    assert db[forecast.STATE_COLLECTION].find_one({'_id': USER_ID})['analysis_id'] == back_dated
+
+
+def test_projection_applies_each_occurrence():
+    series = [
+        {'type': 'income', 'amount': 1000, 'cadence': 'monthly', 'next_date': '2024-07-01'},
+        {'type': 'expense', 'amount': 50, 'cadence': 'weekly', 'next_date': '2024-06-24'},
+    ]
+    points = forecast.project(series, 100, TODAY, days=14)
+
+    assert len(points) == 14
+    assert points[0] == {'date': '2024-06-21', 'income': 0, 'expenses': 0, 'balance': 100}
+    assert points[3] == {'date': '2024-06-24', 'income': 0, 'expenses': 50, 'balance': 50}
+    assert points[10] == {'date': '2024-07-01', 'income': 1000, 'expenses': 50, 'balance': 1000}
+    assert points[-1]['balance'] == 1000
@@ -0,0 +1,51 @@
+import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+import indexes
+
+mongomock = pytest.importorskip('mongomock')
+
+
+def _db():
+    db = mongomock.MongoClient().db
+    user_id, other_user = ObjectId(), ObjectId()
+    db.settings.insert_many([
+        {'user_id': user_id, 'theme': 'light', 'updated_at': datetime.datetime(2024, 1, 1)},
+        {'user_id': user_id, 'theme': 'dark', 'updated_at': datetime.datetime(2024, 3, 1)},
+        {'user_id': user_id, 'theme': 'light', 'updated_at': datetime.datetime(2024, 2, 1)},
+        {'user_id': other_user, 'theme': 'light', 'updated_at': datetime.datetime(2024, 1, 1)},
+    ])
+    db.accounts.insert_many([
+        {'user_id': user_id, 'name': 'Cash', 'is_default': True, 'created_at': datetime.datetime(2024, 2, 1)},
+        {'user_id': user_id, 'name': 'Cash', 'is_default': True, 'created_at': datetime.datetime(2024, 1, 1)},
+        {'user_id': other_user, 'name': 'Cash', 'is_default': True, 'created_at': datetime.datetime(2024, 1, 1)},
+    ])
+    return db, user_id
+
+
+def test_dedupe_keeps_the_latest_settings_and_the_oldest_default_account():
+    db, user_id = _db()
+
+    assert indexes.dedupe(db) == {'settings': 2, 'accounts': 1}
+    assert [settings['theme'] for settings in db.settings.find({'user_id': user_id})] == ['dark']
+    assert db.settings.count_documents({}) == 2
+    default, = db.accounts.find({'user_id': user_id, 'is_default': True})
+    assert default['created_at'] == datetime.datetime(2024, 1, 1)
+    assert db.accounts.count_documents({}) == 3
+
+    assert indexes.dedupe(db) == {'settings': 0, 'accounts': 0}
+
+
+def test_unique_index_on_duplicates_is_reported_not_raised(monkeypatch):
+    db, user_id = _db()
+    # mongomock ignores partial filters, so only the settings index is built here
+    monkeypatch.setattr(indexes, 'INDEXES', {'settings': indexes.INDEXES['settings']})
+
+    duplicates = indexes.ensure_unique_indexes(db)
+    assert list(duplicates) == ['settings']
+
+    indexes.dedupe(db)
+    assert indexes.ensure_unique_indexes(db) == {}
+    assert 'user_id_1' in db.settings.index_information()
@@ -0,0 +1,55 @@
+import datetime
+import random
+
+import pytest
+from bson.objectid import ObjectId
+
+from pagination import TRANSACTION_SORT, InvalidCursor, decode_cursor, encode_cursor, seek_filter
+
+
+def _millisecond_dates(count, seed=0):
+    rng = random.Random(seed)
+    start = datetime.datetime(1990, 1, 1)
+    # BSON dates have millisecond precision, so stored dates never carry microseconds below that
+    return [start + datetime.timedelta(milliseconds=rng.randrange(0, 60 * 365 * 86400 * 1000)) for _ in range(count)]
+
+
+def test_cursor_round_trips_every_millisecond_date():
+    for date in _millisecond_dates(200000) + [datetime.datetime(2004, 10, 28, 23, 41, 18, 916000)]:
+        object_id = ObjectId()
+        assert decode_cursor(encode_cursor({'date': date, '_id': object_id})) == (date, object_id)
+
+
+def test_cursor_without_a_date_round_trips():
+    object_id = ObjectId()
+    assert decode_cursor(encode_cursor({'_id': object_id})) == (None, object_id)
+
+
+@pytest.mark.parametrize('cursor', ['not-a-cursor', 'MTIzOnh5eg', '!!!'])
+def test_invalid_cursors_are_rejected(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def test_seek_walks_every_row_once_including_equal_dates():
+    mongomock = pytest.importorskip('mongomock')
+    collection = mongomock.MongoClient().db.transactions
+    user_id = ObjectId()
+    same = datetime.datetime(2004, 10, 28, 23, 41, 18, 916000)
+    collection.insert_many(
+        [{'user_id': user_id, 'date': same} for _ in range(7)]
+        + [{'user_id': user_id, 'date': date} for date in _millisecond_dates(30, seed=1)]
+        + [{'user_id': user_id} for _ in range(3)]
+    )
+
+    seen, cursor = [], None
+    while True:
+        query = {'user_id': user_id} if cursor is None else seek_filter({'user_id': user_id}, cursor)
+        page = list(collection.find(query).sort(TRANSACTION_SORT).limit(4))
+        if not page:
+            break
+        seen.extend(row['_id'] for row in page)
+        cursor = encode_cursor(page[-1])
+
+    expected = [row['_id'] for row in collection.find({'user_id': user_id}).sort(TRANSACTION_SORT)]
+    assert seen == expected
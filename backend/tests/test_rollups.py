@@ -0,0 +1,73 @@
+import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+import rollups
+
+mongomock = pytest.importorskip('mongomock')
+
+USER_ID = ObjectId()
+
+
+def _db():
+    db = mongomock.MongoClient().db
+    db.transactions.insert_many([
+        {'user_id': USER_ID, 'date': datetime.datetime(2024, 1, 1, 9), 'amount': 10, 'type': 'expense'},
+        {'user_id': USER_ID, 'date': datetime.datetime(2024, 1, 1, 18), 'amount': 5, 'type': 'expense'},
+        {'user_id': USER_ID, 'date': datetime.datetime(2024, 1, 2), 'amount': 100, 'type': 'income'},
+    ])
+    return db
+
+
+def test_full_rebuild_matches_incremental_rollups():
+    db = _db()
+    rollups.rebuild(db, drain_seconds=0)
+    assert rollups.totals(db, USER_ID, datetime.datetime(2024, 1, 1), datetime.datetime(2024, 1, 31)) == {
+        'income': 100, 'expense': 15
+    }
+
+    incremental = mongomock.MongoClient().db
+    rollups.apply_transactions(incremental, db.transactions.find())
+    assert rollups.series(db, USER_ID, datetime.datetime(2024, 1, 1), datetime.datetime(2024, 1, 31)) == \
+        rollups.series(incremental, USER_ID, datetime.datetime(2024, 1, 1), datetime.datetime(2024, 1, 31))
+
+
+def test_writes_are_refused_while_a_rebuild_runs(monkeypatch):
+    db = _db()
+    other_user = ObjectId()
+    seen = []
+
+    def drain(seconds):
+        seen.append((seconds, rollups.rebuilding(db, USER_ID), rollups.rebuilding(db, other_user)))
+        with pytest.raises(rollups.RebuildInProgress):
+            rollups.check_writable(db, USER_ID)
+
+    monkeypatch.setattr(rollups.time, 'sleep', drain)
+    rollups.rebuild(db)
+
+    # A full rebuild covers every user
+    assert seen == [(rollups.REBUILD_DRAIN_SECONDS, True, True)]
+    assert not rollups.rebuilding(db, USER_ID)
+    rollups.check_writable(db, USER_ID)
+
+
+def test_failed_rebuild_releases_its_lock(monkeypatch):
+    db = _db()
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('aggregation failed')
+
+    monkeypatch.setattr(db.transactions, 'aggregate', fail)
+    with pytest.raises(RuntimeError):
+        rollups.rebuild(db, drain_seconds=0)
+    assert not rollups.rebuilding(db, USER_ID)
+
+
+def test_lock_of_a_killed_rebuild_is_taken_over():
+    db = _db()
+    db[rollups.REBUILD_LOCK_COLLECTION].insert_one({'_id': rollups.ALL_USERS, 'rebuild_id': ObjectId()})
+    assert rollups.rebuilding(db, USER_ID)
+
+    rollups.rebuild(db, drain_seconds=0)
+    assert not rollups.rebuilding(db, USER_ID)
@@ -0,0 +1,64 @@
+import math
+
+import pytest
+from bson.objectid import ObjectId
+
+import search
+
+mongomock = pytest.importorskip('mongomock')
+
+USER_ID = ObjectId()
+
+
+def test_lookup_grams_keeps_the_rarest_grams_every_match_shares():
+    grams = ['aaa', 'bbb', 'ccc', 'ddd', 'eee']
+    counts = {'aaa': 900, 'bbb': 3, 'ccc': 50, 'ddd': 1, 'eee': 1000}
+
+    # A match holds at least 3 of the 5 grams, so it holds one of any 3 of them
+    assert search.lookup_grams(grams, counts) == ['bbb', 'ccc', 'ddd']
+
+
+def test_lookup_grams_without_counts():
+    grams = search.query_grams('starbucks')
+    lookup = search.lookup_grams(grams)
+    assert len(lookup) == len(grams) - math.ceil(search.MIN_SCORE * len(grams)) + 1
+    assert set(lookup) <= set(grams)
+
+
+def test_lookup_grams_of_a_single_gram():
+    assert search.lookup_grams([' ab'], {' ab': 10}) == [' ab']
+
+
+def test_gram_counts_stop_at_the_limit(monkeypatch):
+    monkeypatch.setattr(search, 'RARITY_COUNT_LIMIT', 5)
+    collection = mongomock.MongoClient().db.transactions
+    collection.insert_many(
+        [{'user_id': USER_ID, search.SEARCH_FIELD: search.description_grams('Coffee')} for _ in range(8)] +
+        [{'user_id': USER_ID, search.SEARCH_FIELD: search.description_grams('Cola')} for _ in range(2)] +
+        [{'user_id': ObjectId(), search.SEARCH_FIELD: search.description_grams('Cola')} for _ in range(3)]
+    )
+
+    counts = search.gram_counts(collection, USER_ID, [' co', 'col', 'off', 'xyz'])
+    assert counts == {' co': 5, 'col': 2, 'off': 5, 'xyz': 0}
+    assert search.gram_counts(collection, USER_ID, []) == {}
+
+
+def test_rarest_grams_match_every_result():
+    collection = mongomock.MongoClient().db.transactions
+    descriptions = ['AMAZON MKTP US', 'AMZN Mktp US', 'Amazon Prime', 'Starbucks #1234', 'Walmart'] * 4
+    collection.insert_many([
+        {'user_id': USER_ID, 'description': description, search.SEARCH_FIELD: search.description_grams(description)}
+        for description in descriptions
+    ])
+
+    for query in ('amazon', 'amzn mktp', 'starbcks', 'wal'):
+        grams = search.query_grams(query)
+        counts = search.gram_counts(collection, USER_ID, grams)
+        matches = {
+            row['_id'] for row in collection.find({'user_id': USER_ID})
+            if len(set(row[search.SEARCH_FIELD]) & set(grams)) >= search.MIN_SCORE * len(grams)
+        }
+        # The index-backed $match of the search pipeline
+        candidates = {row['_id'] for row in collection.find(search.search_pipeline(USER_ID, query, counts=counts)[0]['$match'])}
+        assert matches
+        assert matches <= candidates
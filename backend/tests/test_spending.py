@@ -0,0 +1,115 @@
+import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+import rollups
+import spending
+
+mongomock = pytest.importorskip('mongomock')
+
+USER_ID = ObjectId()
+
+TODAY = datetime.datetime(2024, 3, 15, 12)
+MARCH = datetime.datetime(2024, 3, 1)
+FEBRUARY = datetime.datetime(2024, 2, 1)
+
+
+def _expense(day, amount, category='Food', transaction_type='expense'):
+    return {'user_id': USER_ID, 'date': day, 'amount': amount, 'category': category, 'type': transaction_type}
+
+
+def _budget(db, category='Food', period='monthly', **fields):
+    return db.budgets.insert_one({'user_id': USER_ID, 'category': category, 'period': period, **fields}).inserted_id
+
+
+@pytest.mark.parametrize('period, date, start, following', [
+    ('weekly', datetime.datetime(2024, 3, 15, 18), datetime.datetime(2024, 3, 11), datetime.datetime(2024, 3, 18)),
+    ('monthly', datetime.datetime(2024, 12, 31, 23), datetime.datetime(2024, 12, 1), datetime.datetime(2025, 1, 1)),
+    ('monthly', datetime.datetime(2024, 1, 31), datetime.datetime(2024, 1, 1), datetime.datetime(2024, 2, 1)),
+    ('yearly', datetime.datetime(2024, 7, 4), datetime.datetime(2024, 1, 1), datetime.datetime(2025, 1, 1)),
+])
+def test_periods(period, date, start, following):
+    assert spending.period_start(period, date) == start
+    assert spending.next_period_start(period, start) == following
+
+
+def test_first_expense_of_a_new_period_rolls_the_budget_over():
+    db = mongomock.MongoClient().db
+    budget_id = _budget(db, period_start=FEBRUARY, spent=250)
+
+    spending.apply_transactions(db, [_expense(TODAY, 12)], today=TODAY)
+    assert db.budgets.find_one(budget_id)['period_start'] == MARCH
+    assert db.budgets.find_one(budget_id)['spent'] == 12
+
+    spending.apply_transactions(db, [_expense(TODAY, 8), _expense(TODAY, 100, transaction_type='income')], today=TODAY)
+    assert db.budgets.find_one(budget_id)['spent'] == 20
+
+
+def test_back_dated_expense_only_counts_for_budgets_on_its_period():
+    db = mongomock.MongoClient().db
+    current = _budget(db, period_start=MARCH, spent=5)
+    previous = _budget(db, period_start=FEBRUARY, spent=5)
+
+    spending.apply_transactions(db, [_expense(datetime.datetime(2024, 2, 10), 7)], today=TODAY)
+    assert db.budgets.find_one(current)['spent'] == 5
+    assert db.budgets.find_one(previous)['spent'] == 12
+
+
+def test_removed_expense_is_subtracted():
+    db = mongomock.MongoClient().db
+    budget_id = _budget(db, period_start=MARCH, spent=30)
+
+    spending.apply_transactions(db, [_expense(TODAY, 10)], sign=-1, today=TODAY)
+    assert db.budgets.find_one(budget_id)['spent'] == 20
+
+
+def test_roll_over_restarts_stale_budgets_and_starts_untracked_ones_from_the_rollups():
+    db = mongomock.MongoClient().db
+    stale = _budget(db, period_start=FEBRUARY, spent=250)
+    untracked = _budget(db, category='Transport')
+    rollups.apply_transactions(db, [
+        _expense(datetime.datetime(2024, 3, 2), 40, category='Transport'),
+        _expense(datetime.datetime(2024, 2, 28), 99, category='Transport'),
+    ])
+
+    budgets = list(db.budgets.find({'user_id': USER_ID}))
+    assert spending.roll_over(db, USER_ID, budgets, today=TODAY)
+
+    for budget in budgets:
+        assert db.budgets.find_one(budget['_id'])['spent'] == budget['spent']
+        assert budget['period_start'] == MARCH
+    assert db.budgets.find_one(stale)['spent'] == 0
+    assert db.budgets.find_one(untracked)['spent'] == 40
+
+    assert not spending.roll_over(db, USER_ID, list(db.budgets.find({'user_id': USER_ID})), today=TODAY)
+
+
+def test_roll_over_keeps_a_concurrent_roll_over():
+    db = mongomock.MongoClient().db
+    budget_id = _budget(db, period_start=FEBRUARY, spent=250)
+    budgets = list(db.budgets.find({'user_id': USER_ID}))
+
+    # An expense rolls the budget over between the read and the roll-over
+    spending.apply_transactions(db, [_expense(TODAY, 12)], today=TODAY)
+    spending.roll_over(db, USER_ID, budgets, today=TODAY)
+    assert db.budgets.find_one(budget_id)['spent'] == 12
+
+
+def test_reconcile_recomputes_the_current_period():
+    db = mongomock.MongoClient().db
+    monthly = _budget(db, period_start=FEBRUARY, spent=250)
+    weekly = _budget(db, period='weekly', period_start=MARCH, spent=3)
+    empty = _budget(db, category='Rent', period_start=MARCH, spent=900)
+    db.transactions.insert_many([
+        _expense(datetime.datetime(2024, 3, 4), 10),
+        _expense(datetime.datetime(2024, 3, 12), 20),
+        _expense(datetime.datetime(2024, 2, 20), 40),
+        _expense(datetime.datetime(2024, 3, 13), 500, transaction_type='income'),
+    ])
+
+    spending.reconcile(db, USER_ID, today=TODAY)
+    assert db.budgets.find_one(monthly)['spent'] == 30
+    assert db.budgets.find_one(weekly)['spent'] == 20
+    assert db.budgets.find_one(weekly)['period_start'] == datetime.datetime(2024, 3, 11)
+    assert db.budgets.find_one(empty)['spent'] == 0
@@ -0,0 +1,97 @@
+import datetime
+import io
+
+import pytest
+from bson.objectid import ObjectId
+
+import statements
+
+mongomock = pytest.importorskip('mongomock')
+
+USER_ID = ObjectId()
+
+CSV = b"""date,description,amount
+2024-01-01,Coffee Shop,-3.50
+2024-01-01,Coffee Shop,-3.50
+2024-01-02,ACME PAYROLL,2500
+2024-01-03,Grocery,-42.10
+"""
+
+
+def _collection():
+    collection = mongomock.MongoClient().db.transactions
+    collection.create_index([('user_id', 1), ('import_hash', 1)], unique=True)
+    return collection
+
+
+def _import(collection, data, statement_format='csv'):
+    rows = statements.parse_statement(io.BytesIO(data), statement_format)
+    for report in statements.import_statement(collection, USER_ID, rows):
+        pass
+    return report
+
+
+def _row(description='Coffee Shop', amount=-3.5, day=1, external_id=None):
+    return {'date': datetime.datetime(2024, 1, day), 'description': description, 'amount': amount,
+            'category': None, 'external_id': external_id}
+
+
+def test_import_hash_ignores_case_and_spacing_of_the_description():
+    assert statements.import_hash(USER_ID, _row('Coffee  Shop')) == statements.import_hash(USER_ID, _row('COFFEE SHOP'))
+
+
+def test_import_hash_tells_identical_rows_apart_by_occurrence():
+    assert statements.import_hash(USER_ID, _row(), 0) != statements.import_hash(USER_ID, _row(), 1)
+
+
+def test_import_hash_uses_the_fitid_alone():
+    edited = _row('Coffee Shop (pending)', amount=-3.75, external_id='FIT1')
+    assert statements.import_hash(USER_ID, _row(external_id='FIT1')) == statements.import_hash(USER_ID, edited, 3)
+    assert statements.import_hash(USER_ID, _row(external_id='FIT1')) != statements.import_hash(USER_ID, _row(external_id='FIT2'))
+
+
+def test_reimporting_the_same_file_inserts_nothing():
+    collection = _collection()
+    first = _import(collection, CSV)
+    second = _import(collection, CSV)
+
+    assert (first['inserted'], first['duplicates']) == (4, 0)
+    assert (second['inserted'], second['duplicates']) == (0, 4)
+
+
+def test_overlapping_statement_only_inserts_new_rows():
+    collection = _collection()
+    _import(collection, CSV)
+    # Next month's export repeats two rows at different positions and adds one
+    overlapping = b"""date,description,amount
+2024-01-03,GROCERY,-42.10
+2024-01-04,Bookshop,-12.00
+2024-01-02,ACME  PAYROLL,2500
+"""
+    report = _import(collection, overlapping)
+
+    assert (report['inserted'], report['duplicates']) == (1, 2)
+    assert collection.count_documents({}) == 5
+
+
+def test_identical_rows_in_one_file_are_all_kept():
+    collection = _collection()
+    report = _import(collection, CSV)
+
+    assert report['inserted'] == 4
+    assert collection.count_documents({'description': 'Coffee Shop'}) == 2
+
+
+def test_bad_rows_are_skipped_and_reported():
+    report = _import(_collection(), b"date,description,amount\n2024-13-01,Bad,-1\n2024-01-01,Good,-1\n")
+
+    assert (report['inserted'], report['skipped']) == (1, 1)
+    assert report['errors'][0].startswith('Row 1:')
+
+
+def test_malformed_csv_ends_the_import_with_the_row_number():
+    data = b'date,description,amount\n2024-01-01,Tea,-2\n2024-01-02,"' + b'x' * 200000 + b'",-1\n'
+    report = _import(_collection(), data)
+
+    assert report['inserted'] == 1
+    assert report['error'].startswith('Row 2: Malformed CSV')
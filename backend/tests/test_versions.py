@@ -0,0 +1,49 @@
+import pytest
+from bson.objectid import ObjectId
+
+import search
+import versions
+
+mongomock = pytest.importorskip('mongomock')
+
+
+def _db():
+    return mongomock.MongoClient().db
+
+
+def test_bump_versions_bumps_each_user_once(monkeypatch):
+    monkeypatch.setattr(versions, 'BUMP_BATCH_SIZE', 3)
+    db = _db()
+    user_ids = [ObjectId() for _ in range(7)]
+    versions.bump_version(db, user_ids[0])
+
+    assert versions.bump_versions(db, iter(user_ids)) == 7
+    assert versions.current_version(db, user_ids[0]) == 2
+    assert all(versions.current_version(db, user_id) == 1 for user_id in user_ids[1:])
+
+
+def test_bump_versions_without_users():
+    db = _db()
+    assert versions.bump_versions(db, []) == 0
+    assert db[versions.VERSION_COLLECTION].count_documents({}) == 0
+
+
+def test_all_user_ids():
+    db = _db()
+    user_ids = db.users.insert_many([{'email': 'a@example.com'}, {'email': 'b@example.com'}]).inserted_ids
+    assert sorted(versions.all_user_ids(db)) == sorted(user_ids)
+
+
+def test_backfill_reports_the_users_it_indexed():
+    db = _db()
+    indexed, pending = ObjectId(), ObjectId()
+    db.transactions.insert_many([
+        {'user_id': indexed, 'description': 'Coffee', search.SEARCH_FIELD: search.description_grams('Coffee')},
+        {'user_id': pending, 'description': 'Grocery'},
+        {'user_id': pending, 'description': 'Rent'},
+    ])
+
+    updated, users = search.backfill(db)
+    assert updated == 2
+    assert users == {pending}
+    assert search.backfill(db) == (0, set())
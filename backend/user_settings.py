@@ -0,0 +1,123 @@
+"""Validation and single round trip updates for the per-user settings document."""
+import datetime
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import schemas
+from provisioning import DEFAULT_SETTINGS
+
+THEMES = ('light', 'dark', 'system')
+
+# Accepted keys of each nested settings group, including the frontend UI (camelCase) aliases,
+# mapped to the stored field name
+NOTIFICATION_FIELDS = {
+    'email': 'email',
+    'push': 'push',
+    'budget_alerts': 'budget_alerts',
+    'transaction_alerts': 'transaction_alerts',
+    'goal_reminders': 'goal_reminders',
+    'investment_opportunities': 'investment_opportunities',
+    'monthly_reports': 'monthly_reports',
+    'goalReminders': 'goal_reminders',
+    'budgetAlerts': 'budget_alerts',
+    'investmentOpportunities': 'investment_opportunities',
+    'monthlyReports': 'monthly_reports'
+}
+
+PRIVACY_FIELDS = {
+    'share_analytics': 'share_analytics',
+    'two_factor_auth': 'two_factor_auth',
+    'third_party_integrations': 'third_party_integrations',
+    'public_profile': 'public_profile',
+    'analyticsSharing': 'share_analytics',
+    'twoFactorAuth': 'two_factor_auth',
+    'thirdPartyIntegrations': 'third_party_integrations',
+    'publicProfile': 'public_profile'
+}
+
+DASHBOARD_FIELDS = {
+    'show_accounts': 'show_accounts',
+    'show_transactions': 'show_transactions',
+    'show_budgets': 'show_budgets',
+    'show_goals': 'show_goals',
+    'compact_view': 'compact_view'
+}
+
+# Nested group -> (accepted keys, value conversion)
+GROUPS = {
+    'notifications': (NOTIFICATION_FIELDS, bool),
+    'privacy': (PRIVACY_FIELDS, bool),
+    'dashboard': (DASHBOARD_FIELDS, None)
+}
+
+
+class SettingsError(ValueError):
+    pass
+
+
+# $set paths for the recognised keys of one group; unknown keys are ignored
+def group_updates(group, values):
+    fields, convert = GROUPS[group]
+    if not isinstance(values, dict):
+        raise SettingsError(f'{group} must be an object')
+
+    updates = {}
+    for key, value in values.items():
+        if key in fields:
+            updates[f'{group}.{fields[key]}'] = convert(value) if convert else value
+    return updates
+
+
+# $set paths for any subset of the settings, e.g.
+# {'theme': 'dark', 'notifications': {'budgetAlerts': False}}
+def settings_updates(data):
+    updates = {}
+
+    if 'theme' in data:
+        if data['theme'] not in THEMES:
+            raise SettingsError('Invalid theme value. Must be "light", "dark", or "system"')
+        updates['theme'] = data['theme']
+    for field in ('currency', 'language'):
+        if field in data:
+            updates[field] = data[field]
+
+    for group in GROUPS:
+        if group in data:
+            updates.update(group_updates(group, data[group]))
+
+    return updates
+
+
+# Default values as $setOnInsert paths, one per nested field, so they never conflict with
+# the $set of one field of the same group
+def _default_paths(updates, now):
+    paths = {'created_at': now}
+    for key, value in DEFAULT_SETTINGS.items():
+        if isinstance(value, dict):
+            paths.update({f'{key}.{field}': default for field, default in value.items()})
+        else:
+            paths[key] = value
+    return {path: value for path, value in paths.items() if path not in updates}
+
+
+# Apply the updates and return the resulting document in one round trip. A user whose
+# settings were never provisioned gets the defaults with the updates applied.
+def update_settings(collection, user_id, updates):
+    now = datetime.datetime.utcnow()
+    update = {'$set': {**updates, 'updated_at': now}, '$setOnInsert': _default_paths(updates, now)}
+    try:
+        return collection.find_one_and_update(
+            {'user_id': user_id}, update, projection=schemas.SETTINGS.projection,
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Provisioning inserted the document concurrently; it now matches, so this updates it
+        return collection.find_one_and_update(
+            {'user_id': user_id}, update, projection=schemas.SETTINGS.projection,
+            return_document=ReturnDocument.AFTER
+        )
+
+
+def format_settings(settings):
+    return schemas.SETTINGS.dump(settings)
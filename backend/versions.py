@@ -0,0 +1,50 @@
+"""Per-user data versions, bumped on every write to a user's dashboard data.
+
+Maintenance jobs that rewrite dashboard data outside the API (rollup rebuilds, budget
+reconciliation, bulk categorization, search backfills, balance snapshots) bump the versions
+of the users they touched when they finish. Workers see the new version once their cached
+copy expires (RESPONSE_CACHE_VERSION_TTL).
+"""
+from pymongo import UpdateOne
+
+VERSION_COLLECTION = 'data_versions'
+
+# Users bumped per bulk_write by bump_versions()
+BUMP_BATCH_SIZE = 1000
+
+
+def current_version(db, user_id):
+    doc = db[VERSION_COLLECTION].find_one({'_id': user_id}, {'version': 1})
+    return doc['version'] if doc else 0
+
+
+# Monotonically increase the user's version and return the new value
+def bump_version(db, user_id):
+    doc = db[VERSION_COLLECTION].find_one_and_update(
+        {'_id': user_id},
+        {'$inc': {'version': 1}},
+        projection={'version': 1},
+        upsert=True,
+        return_document=True
+    )
+    return doc['version']
+
+
+# Bump many users' versions, e.g. at the end of a maintenance job; returns how many were bumped
+def bump_versions(db, user_ids):
+    bumped = 0
+    requests = []
+    for user_id in user_ids:
+        requests.append(UpdateOne({'_id': user_id}, {'$inc': {'version': 1}}, upsert=True))
+        if len(requests) >= BUMP_BATCH_SIZE:
+            db[VERSION_COLLECTION].bulk_write(requests, ordered=False)
+            bumped += len(requests)
+            requests = []
+    if requests:
+        db[VERSION_COLLECTION].bulk_write(requests, ordered=False)
+    return bumped + len(requests)
+
+
+# Every user, for jobs that ran over the whole population
+def all_user_ids(db):
+    return (user['_id'] for user in db.users.find({}, {'_id': 1}))